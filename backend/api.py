@@ -1,7 +1,17 @@
-from fastapi import APIRouter, HTTPException, Request
-from typing import Optional, List
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Literal, Optional, List
 from pydantic import BaseModel
 from supabase_client import supabase
+from ttl_cache import TTLCache, etag_matches
+from generation_jobs import job_queue, JobQueueFull, ProgressCallback
+from fal_queue import fal_queue, FAL_WEBHOOK_SECRET
+from stage_timings import StageTimer, aggregate_stage_timings, ms_since
+from image_engine import image_engine, ImageEngineBusy
+from upload_ingest import ingest_image_upload, load_uploaded_image, uploaded_path
+from session_store import session_store
+from signed_tokens import signed_tokens, looks_signed
+from pagination import KEYSET_ORDER, count_mode, encode_cursor, join_filters, keyset_filter, next_page
 from email_service import send_verification_email
 from tinkoff_payment import (
     init_payment,
@@ -17,6 +27,10 @@ import time
 import uuid
 import random
 import base64
+import hashlib
+import hmac
+import json
+from urllib.parse import quote
 from datetime import datetime, timedelta
 
 router = APIRouter()
@@ -33,6 +47,10 @@ class GenerateRequest(BaseModel):
     theme: str = 'main'  # main, kids, totems, custom
     # Custom 3D form specific fields
     objectDescription: Optional[str] = None  # Description of which object to extract from photo
+    # URL from POST /api/uploads, used when imageBase64 is empty
+    imageUrl: Optional[str] = None
+    # Result cache: 'off' (always generate), 'reuse' (return a cached result for identical input), 'refresh' (regenerate)
+    cachePolicy: Literal['off', 'reuse', 'refresh'] = 'off'
 
 
 class ApplicationCreate(BaseModel):
@@ -89,74 +107,77 @@ class SettingsUpdate(BaseModel):
     volumetric_pendant_prompt: Optional[str] = None  # For custom 3D objects
 
 
-@router.get("/settings")
-async def get_settings():
-    """Get generation settings from Supabase"""
-    defaults = {
-        "num_images": 4,
-        "main_prompt": "",
-        "main_prompt_no_image": "",
-        "form_factors": {
-            "round": {
-                "label": "Круглый кулон",
-                "description": "Круглый кулон",
-                "icon": "circle",
-                "addition": "Объект вписан в круглую рамку-медальон.",
-                "shape": "круглая форма, объект вписан в круг"
-            },
-            "oval": {
-                "label": "Жетон",
-                "description": "Мужской жетон",
-                "icon": "rectangle-vertical",
-                "addition": "Форма армейского жетона (dog tag) - вертикальный скруглённый прямоугольник с небольшой выемкой сверху для цепочки.",
-                "shape": "military dog tag shape - vertical rounded rectangle with small notch at top for chain"
-            },
-            "contour": {
-                "label": "Контурный кулон",
-                "description": "По контуру рисунка",
-                "icon": "hexagon",
-                "addition": "Форма повторяет контур изображения.",
-                "shape": "по контуру выбранного объекта"
-            }
-        },
-        "sizes": {
-            "silver": {
-                "s": {"label": "S", "dimensionsMm": 13, "apiSize": "bracelet", "price": 5000},
-                "m": {"label": "M", "dimensionsMm": 19, "apiSize": "pendant", "price": 8000},
-                "l": {"label": "L", "dimensionsMm": 25, "apiSize": "interior", "price": 12000}
-            },
-            "gold": {
-                "s": {"label": "S", "dimensionsMm": 10, "apiSize": "bracelet", "price": 15000},
-                "m": {"label": "M", "dimensionsMm": 13, "apiSize": "pendant", "price": 22000},
-                "l": {"label": "L", "dimensionsMm": 19, "apiSize": "interior", "price": 35000}
-            }
+# Generation settings cache. Settings change a few times a week but are read
+# on every page load and every generation, so keep them in memory for a while.
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "300"))
+SETTINGS_CACHE_KEY = "generation_settings"
+settings_cache = TTLCache(ttl=SETTINGS_CACHE_TTL)
+
+DEFAULT_SETTINGS = {
+    "num_images": 4,
+    "main_prompt": "",
+    "main_prompt_no_image": "",
+    "form_factors": {
+        "round": {
+            "label": "Круглый кулон",
+            "description": "Круглый кулон",
+            "icon": "circle",
+            "addition": "Объект вписан в круглую рамку-медальон.",
+            "shape": "круглая форма, объект вписан в круг"
         },
-        "materials": {
-            "silver": {"label": "Серебро 925", "enabled": True},
-            "gold": {"label": "Золото 585", "enabled": False}
+        "oval": {
+            "label": "Жетон",
+            "description": "Мужской жетон",
+            "icon": "rectangle-vertical",
+            "addition": "Форма армейского жетона (dog tag) - вертикальный скруглённый прямоугольник с небольшой выемкой сверху для цепочки.",
+            "shape": "military dog tag shape - vertical rounded rectangle with small notch at top for chain"
         },
-        "visualization": {
-            "imageWidthMm": 250,
-            "female": {"attachX": 0.5, "attachY": 0.5},
-            "male": {"attachX": 0.5, "attachY": 0.75}
-        },
-        # Gems configuration
-        "gems_config": {
-            "scaleCoefficient": 1.4,  # Pendant height * 1.4 = image height for gem sizing
-            "pricePerGem": 2000  # Price per gem in rubles
-        },
-        # Custom 3D form generation (arbitrary objects from photos)
-        "custom_form_enabled": False,
-        "custom_form_prompt": "",  # Deprecated, use volumetric_pendant_prompt instead
-        "custom_form_sizes": {
-            "silver": {
-                "s": {"label": "S", "dimensionsMm": 15, "price": 7000},
-                "m": {"label": "M", "dimensionsMm": 25, "price": 12000},
-                "l": {"label": "L", "dimensionsMm": 40, "price": 18000}
-            }
+        "contour": {
+            "label": "Контурный кулон",
+            "description": "По контуру рисунка",
+            "icon": "hexagon",
+            "addition": "Форма повторяет контур изображения.",
+            "shape": "по контуру выбранного объекта"
+        }
+    },
+    "sizes": {
+        "silver": {
+            "s": {"label": "S", "dimensionsMm": 13, "apiSize": "bracelet", "price": 5000},
+            "m": {"label": "M", "dimensionsMm": 19, "apiSize": "pendant", "price": 8000},
+            "l": {"label": "L", "dimensionsMm": 25, "apiSize": "interior", "price": 12000}
         },
-        # Separate prompts for different pendant types
-        "flat_pendant_prompt": """Create a jewelry pendant from the reference image.
+        "gold": {
+            "s": {"label": "S", "dimensionsMm": 10, "apiSize": "bracelet", "price": 15000},
+            "m": {"label": "M", "dimensionsMm": 13, "apiSize": "pendant", "price": 22000},
+            "l": {"label": "L", "dimensionsMm": 19, "apiSize": "interior", "price": 35000}
+        }
+    },
+    "materials": {
+        "silver": {"label": "Серебро 925", "enabled": True},
+        "gold": {"label": "Золото 585", "enabled": False}
+    },
+    "visualization": {
+        "imageWidthMm": 250,
+        "female": {"attachX": 0.5, "attachY": 0.5},
+        "male": {"attachX": 0.5, "attachY": 0.75}
+    },
+    # Gems configuration
+    "gems_config": {
+        "scaleCoefficient": 1.4,  # Pendant height * 1.4 = image height for gem sizing
+        "pricePerGem": 2000  # Price per gem in rubles
+    },
+    # Custom 3D form generation (arbitrary objects from photos)
+    "custom_form_enabled": False,
+    "custom_form_prompt": "",  # Deprecated, use volumetric_pendant_prompt instead
+    "custom_form_sizes": {
+        "silver": {
+            "s": {"label": "S", "dimensionsMm": 15, "price": 7000},
+            "m": {"label": "M", "dimensionsMm": 25, "price": 12000},
+            "l": {"label": "L", "dimensionsMm": 40, "price": 18000}
+        }
+    },
+    # Separate prompts for different pendant types
+    "flat_pendant_prompt": """Create a jewelry pendant from the reference image.
 Type: {form_label}
 {user_wishes}
 
@@ -170,7 +191,7 @@ CRITICAL REQUIREMENTS:
 - {form_addition}
 - Shape: {form_shape}
 - Maximum surface detail, jewelry quality finish""",
-        "volumetric_pendant_prompt": """Create a wearable 3D silver pendant based on the object from the photo.
+    "volumetric_pendant_prompt": """Create a wearable 3D silver pendant based on the object from the photo.
 Object to transform: {object_description}
 {user_wishes}
 
@@ -188,139 +209,177 @@ CRITICAL REQUIREMENTS:
 - Size: {size_dimensions}
 - Maximum surface detail, jewelry quality finish
 - Style: realistic silver miniature sculpture that looks like a professional jewelry piece you can actually wear""",
-        # Model selection for AI generation
-        "generation_model": "seedream",  # 'seedream' | 'flux-kontext' | 'nano-banana'
-        "available_models": {
-            "seedream": {
-                "label": "Seedream v4",
-                "description": "Bytedance SeedDream - хорошая детализация",
-                "cost_per_image_cents": 3
-            },
-            "flux-kontext": {
-                "label": "Flux Kontext",
-                "description": "Black Forest Labs - качественное редактирование",
-                "cost_per_image_cents": 4
-            },
-            "nano-banana": {
-                "label": "Nano Banana",
-                "description": "Google - быстрая генерация",
-                "cost_per_image_cents": 3
-            }
+    # Model selection for AI generation
+    "generation_model": "seedream",  # 'seedream' | 'flux-kontext' | 'nano-banana'
+    "available_models": {
+        "seedream": {
+            "label": "Seedream v4",
+            "description": "Bytedance SeedDream - хорошая детализация",
+            "cost_per_image_cents": 3
+        },
+        "flux-kontext": {
+            "label": "Flux Kontext",
+            "description": "Black Forest Labs - качественное редактирование",
+            "cost_per_image_cents": 4
+        },
+        "nano-banana": {
+            "label": "Nano Banana",
+            "description": "Google - быстрая генерация",
+            "cost_per_image_cents": 3
         }
     }
+}
 
-    try:
-        settings_list = await supabase.select("generation_settings")
 
-        if not settings_list:
-            return defaults
+async def _load_settings_from_db() -> dict:
+    """Read generation_settings rows and merge them over DEFAULT_SETTINGS"""
+    settings_list = await supabase.select("generation_settings")
 
-        result = defaults.copy()
-        for item in settings_list:
-            key = item.get("key")
-            value = item.get("value")
+    if not settings_list:
+        return DEFAULT_SETTINGS
 
-            if key == 'num_images':
-                try:
-                    result['num_images'] = int(value)
-                except:
-                    pass
-            elif key == 'form_factors' and isinstance(value, dict):
-                result['form_factors'] = value
-            elif key == 'sizes' and isinstance(value, dict):
-                result['sizes'] = value
-            elif key == 'materials' and isinstance(value, dict):
-                result['materials'] = value
-            elif key == 'visualization' and isinstance(value, dict):
-                result['visualization'] = value
-            elif key == 'gems_config' and isinstance(value, dict):
-                result['gems_config'] = value
-            elif key in ['main_prompt', 'main_prompt_no_image', 'custom_form_prompt', 'flat_pendant_prompt', 'volumetric_pendant_prompt']:
-                result[key] = str(value) if value else ""
-            elif key == 'custom_form_sizes' and isinstance(value, dict):
-                result['custom_form_sizes'] = value
-            elif key == 'custom_form_enabled':
-                result['custom_form_enabled'] = bool(value) if value is not None else False
-            elif key == 'generation_model':
-                result['generation_model'] = str(value) if value else "seedream"
-            elif key == 'available_models' and isinstance(value, dict):
-                result['available_models'] = value
+    result = DEFAULT_SETTINGS.copy()
+    for item in settings_list:
+        key = item.get("key")
+        value = item.get("value")
 
-        return result
+        if key == 'num_images':
+            try:
+                result['num_images'] = int(value)
+            except:
+                pass
+        elif key == 'form_factors' and isinstance(value, dict):
+            result['form_factors'] = value
+        elif key == 'sizes' and isinstance(value, dict):
+            result['sizes'] = value
+        elif key == 'materials' and isinstance(value, dict):
+            result['materials'] = value
+        elif key == 'visualization' and isinstance(value, dict):
+            result['visualization'] = value
+        elif key == 'gems_config' and isinstance(value, dict):
+            result['gems_config'] = value
+        elif key in ['main_prompt', 'main_prompt_no_image', 'custom_form_prompt', 'flat_pendant_prompt', 'volumetric_pendant_prompt']:
+            result[key] = str(value) if value else ""
+        elif key == 'custom_form_sizes' and isinstance(value, dict):
+            result['custom_form_sizes'] = value
+        elif key == 'custom_form_enabled':
+            result['custom_form_enabled'] = bool(value) if value is not None else False
+        elif key == 'generation_model':
+            result['generation_model'] = str(value) if value else "seedream"
+        elif key == 'available_models' and isinstance(value, dict):
+            result['available_models'] = value
+
+    return result
+
+
+async def get_cached_settings() -> dict:
+    """
+    Get generation settings through the in-process cache.
+    The returned dict is shared between requests - treat it as read-only.
+    """
+    try:
+        return await settings_cache.get_or_load(SETTINGS_CACHE_KEY, _load_settings_from_db)
     except Exception as e:
         print(f"Error fetching settings: {e}")
-        return defaults
+        return DEFAULT_SETTINGS
+
+
+@router.get("/settings")
+async def get_settings(request: Request, response: Response):
+    """Get generation settings (cached, supports ETag / If-None-Match)"""
+    settings = await get_cached_settings()
+
+    etag = settings_cache.etag(SETTINGS_CACHE_KEY)
+    if etag:
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+
+    return settings
+
+
+async def _upsert_settings(rows: list):
+    """Write {"key", "value"} rows in one upsert (unique index on key, migration 025)"""
+    try:
+        await supabase.upsert_many("generation_settings", rows, on_conflict="key")
+    except httpx.HTTPStatusError as e:
+        if "42P10" not in e.response.text:
+            raise
+        # No unique index on key yet - update/insert key by key
+        settings_list = await supabase.select("generation_settings", columns="id,key")
+        existing_keys = {item["key"]: item["id"] for item in settings_list}
+        for row in rows:
+            if row["key"] in existing_keys:
+                await supabase.update("generation_settings", existing_keys[row["key"]], {"value": row["value"]})
+            else:
+                await supabase.insert("generation_settings", row)
 
 
 @router.post("/settings")
 async def update_settings(updates: SettingsUpdate):
     """Update generation settings in Supabase"""
     try:
-        settings_list = await supabase.select("generation_settings")
-        existing_keys = {item["key"]: item["id"] for item in settings_list}
+        rows = []
 
-        async def set_val(key, val):
-            if val is None:
-                return
-            if key in existing_keys:
-                await supabase.update("generation_settings", existing_keys[key], {"value": val})
-            else:
-                await supabase.insert("generation_settings", {"key": key, "value": val})
+        def set_val(key, val):
+            if val is not None:
+                rows.append({"key": key, "value": val})
 
         if updates.num_images is not None:
-            await set_val('num_images', updates.num_images)
+            set_val('num_images', updates.num_images)
         if updates.main_prompt is not None:
-            await set_val('main_prompt', updates.main_prompt)
+            set_val('main_prompt', updates.main_prompt)
         if updates.main_prompt_no_image is not None:
-            await set_val('main_prompt_no_image', updates.main_prompt_no_image)
+            set_val('main_prompt_no_image', updates.main_prompt_no_image)
         if updates.form_factors:
-            await set_val('form_factors', updates.form_factors)
+            set_val('form_factors', updates.form_factors)
         if updates.sizes:
-            await set_val('sizes', updates.sizes)
+            set_val('sizes', updates.sizes)
         if updates.materials:
-            await set_val('materials', updates.materials)
+            set_val('materials', updates.materials)
         if updates.visualization:
-            await set_val('visualization', updates.visualization)
+            set_val('visualization', updates.visualization)
         if updates.gems_config:
-            await set_val('gems_config', updates.gems_config)
+            set_val('gems_config', updates.gems_config)
         if updates.custom_form_prompt is not None:
-            await set_val('custom_form_prompt', updates.custom_form_prompt)
+            set_val('custom_form_prompt', updates.custom_form_prompt)
         if updates.custom_form_sizes:
-            await set_val('custom_form_sizes', updates.custom_form_sizes)
+            set_val('custom_form_sizes', updates.custom_form_sizes)
         if updates.custom_form_enabled is not None:
-            await set_val('custom_form_enabled', updates.custom_form_enabled)
+            set_val('custom_form_enabled', updates.custom_form_enabled)
         if updates.generation_model is not None:
-            await set_val('generation_model', updates.generation_model)
+            set_val('generation_model', updates.generation_model)
         if updates.available_models:
-            await set_val('available_models', updates.available_models)
+            set_val('available_models', updates.available_models)
         if updates.flat_pendant_prompt is not None:
-            await set_val('flat_pendant_prompt', updates.flat_pendant_prompt)
+            set_val('flat_pendant_prompt', updates.flat_pendant_prompt)
         if updates.volumetric_pendant_prompt is not None:
-            await set_val('volumetric_pendant_prompt', updates.volumetric_pendant_prompt)
+            set_val('volumetric_pendant_prompt', updates.volumetric_pendant_prompt)
 
+        await _upsert_settings(rows)
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Drop cached settings even after a partial write
+        settings_cache.invalidate()
 
 
 @router.post("/settings/reset")
 async def reset_settings_to_defaults():
     """Reset critical settings to correct defaults - model, prompts, form factors"""
     try:
-        settings_list = await supabase.select("generation_settings")
-        existing_keys = {item["key"]: item["id"] for item in settings_list}
+        rows = []
 
-        async def set_val(key, val):
-            if key in existing_keys:
-                await supabase.update("generation_settings", existing_keys[key], {"value": val})
-            else:
-                await supabase.insert("generation_settings", {"key": key, "value": val})
+        def set_val(key, val):
+            rows.append({"key": key, "value": val})
 
         # Reset model to seedream
-        await set_val('generation_model', 'seedream')
+        set_val('generation_model', 'seedream')
 
         # Reset form factors with correct dog tag shape
-        await set_val('form_factors', {
+        set_val('form_factors', {
             "round": {
                 "label": "Круглый кулон",
                 "description": "Круглый кулон",
@@ -345,7 +404,7 @@ async def reset_settings_to_defaults():
         })
 
         # Reset flat pendant prompt with NO COLORS requirement
-        await set_val('flat_pendant_prompt', """Create a jewelry pendant from the reference image.
+        set_val('flat_pendant_prompt', """Create a jewelry pendant from the reference image.
 Type: {form_label}
 {user_wishes}
 
@@ -362,7 +421,7 @@ CRITICAL REQUIREMENTS:
 - Maximum surface detail, jewelry quality finish""")
 
         # Reset volumetric prompt with NO COLORS requirement
-        await set_val('volumetric_pendant_prompt', """Create a wearable 3D silver pendant based on the object from the photo.
+        set_val('volumetric_pendant_prompt', """Create a wearable 3D silver pendant based on the object from the photo.
 Object to transform: {object_description}
 {user_wishes}
 
@@ -382,6 +441,8 @@ CRITICAL REQUIREMENTS:
 - Maximum surface detail, jewelry quality finish
 - Style: realistic silver miniature sculpture that looks like a professional jewelry piece you can actually wear""")
 
+        await _upsert_settings(rows)
+
         return {
             "success": True,
             "message": "Settings reset to defaults: seedream model, no-colors prompts, correct dog tag shape",
@@ -390,6 +451,39 @@ CRITICAL REQUIREMENTS:
     except Exception as e:
         print(f"Error resetting settings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        settings_cache.invalidate()
+
+
+def _is_missing_relationship(e: Exception) -> bool:
+    """PostgREST PGRST200: no foreign key behind an embedded resource (migration 024 not applied)"""
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 400 and "PGRST200" in e.response.text
+
+
+async def _select_page(table: str, columns: str, filters: Optional[str], cursor: Optional[str], limit: int,
+                       offset: Optional[int], count: str, embed: Optional[dict] = None) -> tuple:
+    """
+    One keyset-ordered page plus the total over `filters` (None for count=none).
+    The first page gets both from a single request; cursor pages count separately,
+    since the keyset condition would narrow the count to the rows after the cursor.
+    """
+    if cursor:
+        page_filters, offset = join_filters(filters, keyset_filter(cursor)), None
+    else:
+        page_filters = filters
+    if count == "none":
+        rows = await supabase.select(table, columns=columns, filters=page_filters, order=KEYSET_ORDER,
+                                     limit=limit, offset=offset, embed=embed)
+        return rows, None
+    if cursor:
+        rows, total = await asyncio.gather(
+            supabase.select(table, columns=columns, filters=page_filters, order=KEYSET_ORDER,
+                            limit=limit, embed=embed),
+            supabase.count(table, filters=filters, mode=count),
+        )
+        return rows, total
+    return await supabase.select_with_count(table, columns=columns, filters=filters, order=KEYSET_ORDER,
+                                            limit=limit, offset=offset, embed=embed, count=count)
 
 
 @router.get("/applications")
@@ -397,9 +491,15 @@ async def list_applications(
     user_id: Optional[str] = None,
     limit: int = 20,
     offset: int = 0,
-    status: Optional[str] = None
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    count: str = "exact"
 ):
-    """List applications with pagination - optimized without heavy base64 fields"""
+    """
+    List applications with pagination - optimized without heavy base64 fields.
+    Pass `cursor` (next_cursor of the previous page) instead of `offset` for
+    constant-cost deep pages; count=planned|estimated|none skips the exact total.
+    """
     try:
         # Cap limit at 100 for performance
         limit = min(limit, 100)
@@ -417,21 +517,30 @@ async def list_applications(
         # input_image_url and back_image_url can be 300KB+ per record (base64 data)
         columns = "id,user_id,session_id,current_step,status,form_factor,material,size,size_option,user_comment,generated_preview,generated_images,theme,has_back_engraving,back_comment,gems,created_at,updated_at,paid_at,submitted_at,customer_name,customer_email"
 
-        # Get total count for pagination
-        total = await supabase.count("applications", filters=filters)
-
-        # Get paginated data
-        apps = await supabase.select(
-            "applications",
-            columns=columns,
-            filters=filters,
-            order="created_at.desc",
-            limit=limit,
-            offset=offset
-        )
+        # Page (one extra row tells whether there is a next page), total count and
+        # the owner's email/name (embedded via applications.user_id) in one request
+        mode = count_mode(count)
+        embedded = True
+        try:
+            apps, total = await _select_page("applications", columns + ",users(email,name)", filters, cursor,
+                                             limit + 1, offset, mode)
+        except httpx.HTTPStatusError as e:
+            if not _is_missing_relationship(e):
+                raise
+            embedded = False
+            apps, total = await _select_page("applications", columns, filters, cursor, limit + 1, offset, mode)
+        apps, next_cursor = next_page(apps, limit)
+
+        if embedded:
+            for app in apps:
+                owner = app.pop("users", None)
+                if owner and not app.get("customer_email"):
+                    app["customer_email"] = owner.get("email")
+                    if not app.get("customer_name"):
+                        app["customer_name"] = owner.get("name")
 
         # Enrich with user emails from users table for registered users
-        if apps:
+        elif apps:
             user_ids = list(set(a.get("user_id") for a in apps if a.get("user_id") and not a.get("customer_email")))
             if user_ids:
                 try:
@@ -455,8 +564,11 @@ async def list_applications(
             "total": total,
             "limit": limit,
             "offset": offset,
-            "has_more": offset + limit < total
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
         }
+    except HTTPException:
+        raise
     except Exception as e:
         # Log the error for debugging
         error_msg = str(e)
@@ -522,18 +634,31 @@ async def create_application(app: ApplicationCreate):
 async def get_application(app_id: str):
     """Get application by ID with all its generations"""
     try:
-        app = await supabase.select_one("applications", app_id)
+        generation_columns = "id,created_at,output_images,input_image_url,cost_cents,model_used"
+        try:
+            # Application with its latest generations embedded - one request
+            rows = await supabase.select(
+                "applications",
+                columns=f"*,pendant_generations({generation_columns})",
+                filters=f"id=eq.{app_id}",
+                embed={"pendant_generations": {"order": "created_at.desc", "limit": 50}}
+            )
+            app = rows[0] if rows else None
+            generations = (app.pop("pendant_generations", None) or []) if app else []
+        except httpx.HTTPStatusError as e:
+            if not _is_missing_relationship(e):
+                raise
+            app = await supabase.select_one("applications", app_id)
+            generations = await supabase.select(
+                "pendant_generations",
+                columns=generation_columns,
+                filters={"application_id": app_id},
+                order="created_at.desc",
+                limit=50  # Get more generations
+            ) if app else []
         if not app:
             raise HTTPException(status_code=404, detail="Application not found")
 
-        # Get all generations for this application
-        generations = await supabase.select(
-            "pendant_generations",
-            filters={"application_id": app_id},
-            order="created_at.desc",
-            limit=50  # Get more generations
-        )
-
         # Collect all images from all generations (for backward compatibility)
         all_images = []
         for gen in generations:
@@ -630,6 +755,7 @@ async def submit_order(app_id: str, req: SubmitOrderRequest):
                     user_updates["telegram_username"] = req.telegram
                 if user_updates:
                     await supabase.update("users", user_id, user_updates)
+                    _invalidate_client_search(user_updates)
             else:
                 # Create new user
                 new_user = await supabase.insert("users", {
@@ -638,6 +764,7 @@ async def submit_order(app_id: str, req: SubmitOrderRequest):
                     "phone": req.phone or "",
                     "telegram_username": req.telegram or "",
                 })
+                client_search_cache.invalidate()
                 if new_user:
                     user_id = new_user.get("id")
 
@@ -683,53 +810,58 @@ async def submit_order(app_id: str, req: SubmitOrderRequest):
 
 
 @router.get("/history")
-async def get_history(limit: int = 20, offset: int = 0):
-    """Get generation history with pagination and selected variant info"""
+async def get_history(limit: int = 20, offset: int = 0, cursor: Optional[str] = None, count: str = "exact"):
+    """
+    Get generation history with pagination and selected variant info.
+    Supports keyset paging via `cursor` and count=exact|planned|estimated|none.
+    """
     try:
         # Cap limit at 100 for performance
         limit = min(limit, 100)
 
-        # Get total count
-        total = await supabase.count("pendant_generations")
-
         # Include input_image_url - we'll filter out base64 data below
         columns = "id,application_id,session_id,user_comment,form_factor,material,size,input_image_url,output_images,prompt_used,cost_cents,model_used,execution_time_ms,created_at"
 
-        # Get generations with application's selected preview
-        raw_gens = await supabase.select(
-            "pendant_generations",
-            columns=columns,
-            order="created_at.desc",
-            limit=limit,
-            offset=offset
-        )
-
-        # Batch fetch all related applications to avoid N+1 queries
-        app_ids = list(set(g.get('application_id') for g in raw_gens if g.get('application_id')))
-        apps_map = {}
-        if app_ids:
-            # Fetch all applications in one query
-            all_apps = await supabase.select(
-                "applications",
-                columns="id,generated_preview,input_image_url",
-                order="created_at.desc",
-                limit=len(app_ids) + 10
+        # Generations, total count and each generation's application (selected
+        # preview, input image) embedded via application_id - one request
+        mode = count_mode(count)
+        apps_map = None
+        try:
+            raw_gens, total = await _select_page(
+                "pendant_generations", columns + ",applications(id,generated_preview,input_image_url)",
+                None, cursor, limit + 1, offset, mode
             )
-            apps_map = {a['id']: a for a in all_apps if a['id'] in app_ids}
+        except httpx.HTTPStatusError as e:
+            if not _is_missing_relationship(e):
+                raise
+            raw_gens, total = await _select_page("pendant_generations", columns, None, cursor,
+                                                 limit + 1, offset, mode)
+            # Batch fetch exactly the referenced applications
+            app_ids = list(set(g.get('application_id') for g in raw_gens if g.get('application_id')))
+            apps_map = {}
+            if app_ids:
+                all_apps = await supabase.select(
+                    "applications",
+                    columns="id,generated_preview,input_image_url",
+                    filters=f"id=in.({','.join(app_ids)})"
+                )
+                apps_map = {a['id']: a for a in all_apps}
+        raw_gens, next_cursor = next_page(raw_gens, limit)
 
         # Enrich with application data (selected preview, input_image_url)
         enriched = []
         for gen in raw_gens:
             gen_data = dict(gen)
+            embedded_app = gen_data.pop('applications', None)
 
             # Filter out base64 input_image_url (only keep actual URLs)
             input_url = gen_data.get('input_image_url')
             if input_url and input_url.startswith('data:'):
                 gen_data['input_image_url'] = None
 
-            # If has application_id, get data from cache
+            # If has application_id, use the embedded (or batch-fetched) application
             if gen_data.get('application_id'):
-                app = apps_map.get(gen_data['application_id'])
+                app = embedded_app if apps_map is None else apps_map.get(gen_data['application_id'])
                 if app:
                     gen_data['selected_preview'] = app.get('generated_preview')
                     # If generation has no input_image_url, try from application
@@ -749,8 +881,11 @@ async def get_history(limit: int = 20, offset: int = 0):
             "total": total,
             "limit": limit,
             "offset": offset,
-            "has_more": offset + limit < total
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -769,6 +904,7 @@ MODEL_CONFIGS = {
         "cost_per_image_cents": 3,
         "image_key": "image_urls",  # Key for input images in request
         "supports_num_images": True,
+        "input_max_size": 2048,  # Input photo is downscaled to this before upload
     },
     "flux-kontext": {
         "edit_url": "https://queue.fal.run/fal-ai/flux-kontext/dev",
@@ -778,6 +914,7 @@ MODEL_CONFIGS = {
         "cost_per_image_cents": 4,
         "image_key": "image_url",  # Single image URL
         "supports_num_images": True,
+        "input_max_size": 1024,
     },
     "nano-banana": {
         "edit_url": "https://queue.fal.run/fal-ai/nano-banana/edit",
@@ -787,78 +924,311 @@ MODEL_CONFIGS = {
         "cost_per_image_cents": 3,
         "image_key": "image_urls",  # Array of image URLs
         "supports_num_images": True,
+        "input_max_size": 1024,
     },
 }
 
 
+FAL_BIREFNET_URL = "https://queue.fal.run/fal-ai/birefnet"
+
+
 async def remove_background(image_url: str, fal_key: str) -> str:
     """Remove background from image using FAL.ai birefnet model"""
     try:
-        async with httpx.AsyncClient(timeout=120) as client:
-            response = await client.post(
-                "https://queue.fal.run/fal-ai/birefnet",
-                json={
-                    "image_url": image_url,
-                    "model": "General Use (Light)",
-                    "operating_resolution": "1024x1024",
-                    "output_format": "png"
-                },
-                headers={
-                    "Authorization": f"Key {fal_key}",
-                    "Content-Type": "application/json"
-                }
+        result = await fal_queue.run(FAL_BIREFNET_URL, {
+            "image_url": image_url,
+            "model": "General Use (Light)",
+            "operating_resolution": "1024x1024",
+            "output_format": "png"
+        }, key=fal_key, timeout=60)
+        if "image" in result:
+            return result["image"]["url"]
+        return image_url
+    except Exception as e:
+        print(f"Error removing background: {e}")
+        return image_url  # Return original on error
+
+
+# Post-processing concurrency limits, shared by all generations in this process
+FAL_POSTPROCESS_CONCURRENCY = int(os.getenv("FAL_POSTPROCESS_CONCURRENCY", "4"))
+STORAGE_UPLOAD_CONCURRENCY = int(os.getenv("STORAGE_UPLOAD_CONCURRENCY", "4"))
+_pipeline_semaphores: dict = {}
+
+# Rendered alongside full + thumbnail from the same decode (see image_processing.render_variants)
+GENERATION_EXTRA_VARIANTS = [{"name": "placeholder", "format": "LQIP"}]
+if os.getenv("GENERATION_AVIF_VARIANT", "false").lower() in ("1", "true", "yes"):
+    GENERATION_EXTRA_VARIANTS.append({"name": "avif", "max_size": 1024, "format": "AVIF", "quality": 60})
+
+
+def _pipeline_semaphore(name: str, limit: int) -> asyncio.Semaphore:
+    """Process-wide semaphores, created lazily inside the running event loop"""
+    semaphore = _pipeline_semaphores.get(name)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(limit)
+        _pipeline_semaphores[name] = semaphore
+    return semaphore
+
+
+async def _process_generated_image(index: int, img_url: str, generation_id: str, fal_key: str,
+                                   timings: Optional[dict] = None) -> dict:
+    """
+    Post-process one generated image: remove background via FAL, then
+    download, resize (1024px + 400px thumbnail, WebP) and upload to Storage.
+    Falls back to the FAL URL if the upload fails.
+    Stage durations (ms) are written to `timings` if given.
+    """
+    timings = timings if timings is not None else {}
+    started = time.perf_counter()
+    manifest: dict = {}
+
+    async with _pipeline_semaphore("fal", FAL_POSTPROCESS_CONCURRENCY):
+        bg_started = time.perf_counter()
+        transparent_url = await remove_background(img_url, fal_key)
+        timings["bg_removal"] = ms_since(bg_started)
+
+    try:
+        async with _pipeline_semaphore("storage", STORAGE_UPLOAD_CONCURRENCY):
+            full_url, thumb_url = await supabase.upload_with_thumbnail(
+                "generations",
+                f"{generation_id}/{index}.png",
+                transparent_url,
+                full_size=1024,
+                thumb_size=400,
+                format="WEBP",
+                quality=85,
+                timings=timings,
+                manifest=manifest,
+                extra_variants=GENERATION_EXTRA_VARIANTS
             )
+        print(f"Uploaded image {index + 1} with thumbnail")
+    except Exception as upload_err:
+        print(f"Failed to upload image {index}: {upload_err}, using original URL")
+        full_url = thumb_url = transparent_url  # Fallback to full image for thumb
+
+    timings["total"] = ms_since(started)
+    # Time spent waiting for the FAL / storage semaphores
+    timings["wait"] = max(0, timings["total"] - sum(
+        timings.get(stage, 0) for stage in ("bg_removal", "download", "resize", "upload")
+    ))
+    return {
+        "index": index,
+        "url": full_url,
+        "thumbnail": thumb_url,
+        "placeholder": manifest.get("placeholder"),
+        "variants": manifest.get("variants", {}),
+    }
+
+
+# Content-addressed generation cache: identical input image + prompt + model
+# params map to one stored result. Backed by pendant_generations.cache_key
+# (migrations/016_add_generation_cache.sql) with a small in-process LRU in front.
+GENERATION_CACHE_MAX_AGE = int(os.getenv("GENERATION_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "256"))
+generation_cache = TTLCache(ttl=GENERATION_CACHE_MAX_AGE, max_entries=GENERATION_CACHE_SIZE)
+
+# Input image fields are hashed as decoded bytes, not as their (data URI / URL) text
+_CACHE_KEY_EXCLUDED_FIELDS = ("image_urls", "image_url")
+
+
+# pendant_generations columns added by migrations 016 (cache) and 017 (stage timings);
+# on a database without them the row is saved without these keys rather than
+# failing a paid generation
+GENERATION_OPTIONAL_COLUMNS = ("output_thumbnails", "cache_key", "stage_timings")
+
+
+def _is_missing_column(e: Exception) -> bool:
+    """PostgREST PGRST204 / Postgres 42703: the payload names a column the table doesn't have"""
+    return (isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 400
+            and ("PGRST204" in e.response.text or "42703" in e.response.text))
+
+
+async def _insert_generation(gen_data: dict) -> Optional[dict]:
+    """Insert a pendant_generations row, retrying without optional columns if a migration is missing"""
+    try:
+        return await supabase.insert("pendant_generations", gen_data)
+    except httpx.HTTPStatusError as e:
+        if not _is_missing_column(e):
+            raise
+        print(f"pendant_generations is missing a newer column, saving without {GENERATION_OPTIONAL_COLUMNS}: {e.response.text}")
+        return await supabase.insert("pendant_generations", {
+            key: value for key, value in gen_data.items() if key not in GENERATION_OPTIONAL_COLUMNS
+        })
+
+
+async def _decode_input_image(image: Optional[str]) -> Optional[bytes]:
+    """Get raw bytes of the input image from a data URI, bare base64 or http(s) URL"""
+    if not image:
+        return None
+    try:
+        if image.startswith("http"):
+            response = await supabase.fetch_client.get(image)
             response.raise_for_status()
-            result = response.json()
-
-            # Poll for results if queued
-            if "request_id" in result and "status_url" in result:
-                attempts = 0
-                max_attempts = 60
-
-                while attempts < max_attempts:
-                    await asyncio.sleep(1)
-                    status_res = await client.get(
-                        result["status_url"],
-                        headers={"Authorization": f"Key {fal_key}"}
-                    )
-                    status_data = status_res.json()
-
-                    if status_data.get("status") == "COMPLETED":
-                        result_res = await client.get(
-                            result["response_url"],
-                            headers={"Authorization": f"Key {fal_key}"}
-                        )
-                        final_result = result_res.json()
-                        if "image" in final_result:
-                            return final_result["image"]["url"]
-                        break
-                    elif status_data.get("status") == "FAILED":
-                        print(f"Background removal failed")
-                        return image_url
+            return response.content
+        base64_data = image.split(",", 1)[1] if image.startswith("data:") and "," in image else image
+        return base64.b64decode(base64_data)
+    except Exception as e:
+        print(f"Failed to decode input image: {e}")
+        return None
+
+
+def _generation_cache_key(input_bytes: Optional[bytes], prompt: str, model: str, num_images: int, request_body: dict) -> str:
+    """SHA-256 over everything that determines the FAL output"""
+    params = {k: v for k, v in request_body.items() if k not in _CACHE_KEY_EXCLUDED_FIELDS}
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(input_bytes or b"").digest())
+    digest.update(json.dumps({
+        "prompt": prompt,
+        "model": model,
+        "num_images": num_images,
+        "params": params,
+    }, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+async def _lookup_cached_generation(cache_key: str) -> Optional[dict]:
+    """Find a stored generation for this key not older than GENERATION_CACHE_MAX_AGE"""
+    now = time.time()
+    cached = generation_cache.get(cache_key)
+    if cached and now - cached["created_ts"] <= GENERATION_CACHE_MAX_AGE:
+        return cached
 
-                    attempts += 1
+    try:
+        min_created = (datetime.utcnow() - timedelta(seconds=GENERATION_CACHE_MAX_AGE)).isoformat()
+        rows = await supabase.select(
+            "pendant_generations",
+            columns="id,output_images,output_thumbnails,model_used,created_at",
+            filters=f"cache_key=eq.{cache_key}&created_at=gte.{min_created}",
+            order="created_at.desc",
+            limit=1
+        )
+    except Exception as e:
+        print(f"Generation cache lookup failed: {e}")
+        return None
+    if not rows or not rows[0].get("output_images"):
+        return None
+
+    row = rows[0]
+    try:
+        created_ts = datetime.fromisoformat(row["created_at"].replace("Z", "+00:00")).timestamp()
+    except Exception:
+        created_ts = now
+    cached = {
+        "output_images": row["output_images"],
+        "output_thumbnails": row.get("output_thumbnails") or row["output_images"],
+        "model_used": row.get("model_used"),
+        "created_ts": created_ts,
+    }
+    generation_cache.set(cache_key, cached)
+    return cached
+
+
+async def _serve_cached_generation(req: GenerateRequest, cached: dict, cache_key: str, pendant_prompt: str,
+                                   start_time: float, progress: Optional[ProgressCallback],
+                                   timer: Optional[StageTimer] = None) -> dict:
+    """Record a zero-cost generation that reuses stored images and link it to the application"""
+    await _emit_progress(progress, "cache_hit", {"cacheKey": cache_key})
+    image_urls = cached["output_images"]
+    thumbnail_urls = cached["output_thumbnails"]
+    for i, (url, thumb) in enumerate(zip(image_urls, thumbnail_urls)):
+        await _emit_progress(progress, "image_ready", {"index": i, "url": url, "thumbnail": thumb})
+
+    generation_id = str(uuid.uuid4())
+    execution_time_ms = int((time.time() - start_time) * 1000)
+    db_gen = await _insert_generation({
+        "id": generation_id,
+        "user_comment": req.prompt,
+        "form_factor": req.formFactor,
+        "material": req.material,
+        "size": req.size,
+        "theme": req.theme,
+        "output_images": image_urls,
+        "output_thumbnails": thumbnail_urls,
+        "prompt_used": pendant_prompt,
+        "cost_cents": 0,
+        "model_used": cached.get("model_used"),
+        "session_id": req.sessionId,
+        "application_id": req.applicationId,
+        "execution_time_ms": execution_time_ms,
+        "cache_key": cache_key,
+        "stage_timings": timer.to_dict() if timer else None,
+    })
+    await _emit_progress(progress, "saved", {"generationId": db_gen["id"] if db_gen else None})
+
+    if req.applicationId:
+        await supabase.update("applications", req.applicationId, {
+            "status": "generated",
+            "generated_preview": image_urls[0]
+        })
+
+    return {
+        "success": True,
+        "images": image_urls,
+        "thumbnails": thumbnail_urls,
+        "prompt": pendant_prompt,
+        "generationId": db_gen["id"] if db_gen else None,
+        "costCents": 0,
+        "executionTimeMs": execution_time_ms,
+        "cached": True
+    }
+
+
+DEFAULT_INPUT_MAX_SIZE = 1024
 
-            elif "image" in result:
-                return result["image"]["url"]
 
-            return image_url
+async def _upload_input_image(image_bytes: bytes, generation_id: str, max_size: int,
+                              timer: Optional[StageTimer] = None) -> Optional[str]:
+    """
+    EXIF-rotate, downscale and re-encode the input photo as WebP, upload it as
+    {generation_id}/input.webp and return its public URL (None on failure).
+    """
+    try:
+        started = time.perf_counter()
+        data, content_type = await image_engine.normalize_image(image_bytes, max_size, format="WEBP", quality=90)
+        if timer:
+            timer.add("input_normalize", ms_since(started))
+
+        started = time.perf_counter()
+        input_path = f"{generation_id}/input.webp"
+        await supabase.upload_file("generations", input_path, data, content_type)
+        url = await supabase.get_public_url("generations", input_path)
+        if timer:
+            timer.add("input_upload", ms_since(started))
+        print(f"Uploaded input image ({len(image_bytes)} -> {len(data)} bytes): {url}")
+        return url
     except Exception as e:
-        print(f"Error removing background: {e}")
-        return image_url  # Return original on error
+        print(f"Failed to prepare input image, sending it inline: {e}")
+        return None
 
 
-@router.post("/generate")
-async def generate_pendant(req: GenerateRequest):
-    """Generate pendant images using FAL.ai"""
+async def _emit_progress(progress: Optional[ProgressCallback], stage: str, data: Optional[dict] = None):
+    """Report a finished pipeline stage; progress reporting never breaks generation"""
+    if progress is None:
+        return
+    try:
+        await progress(stage, data)
+    except Exception as e:
+        print(f"Progress callback failed at stage {stage}: {e}")
+
+
+async def run_generation(req: GenerateRequest, progress: Optional[ProgressCallback] = None) -> dict:
+    """
+    Generate pendant images using FAL.ai - the full pipeline shared by the
+    synchronous endpoint and background jobs. `progress(stage, data)` is
+    awaited as each stage finishes. Raises on failure.
+    """
     start_time = time.time()
+    timer = StageTimer()
+    if not req.imageBase64 and req.imageUrl:
+        if uploaded_path(req.imageUrl) is None:
+            raise HTTPException(status_code=400, detail="imageUrl must point to an uploaded file (POST /api/uploads)")
+        req.imageBase64 = req.imageUrl
 
     fal_key = os.environ.get("FAL_KEY")
     if not fal_key:
         raise HTTPException(status_code=500, detail="FAL_KEY is not configured")
 
     # Get settings
-    settings = await get_settings()
+    settings = await get_cached_settings()
     num_images = settings.get("num_images", 4)
 
     has_image = req.imageBase64 and len(req.imageBase64) > 0
@@ -983,6 +1353,7 @@ Maximum surface detail, jewelry quality finish."""
             print(f"Model {selected_model} doesn't support text-to-image, falling back to seedream")
 
     print(f"Using model: {model_name} ({selected_model})")
+    await _emit_progress(progress, "prompt_ready", {"model": model_name})
 
     # Build request body based on model
     request_body = {
@@ -1011,146 +1382,144 @@ Maximum surface detail, jewelry quality finish."""
         if has_image:
             request_body["image_urls"] = [req.imageBase64]
 
-    headers = {
-        "Authorization": f"Key {fal_key}",
-        "Content-Type": "application/json"
-    }
+    timer.add("prepare", ms_since(timer.started))
+
+    # Result cache lookup (opt-in via cachePolicy='reuse')
+    cache_started = time.perf_counter()
+    decoded_input = await _decode_input_image(req.imageBase64) if has_image else None
+    input_bytes = decoded_input
+    if has_image and input_bytes is None:
+        input_bytes = req.imageBase64.encode("utf-8")  # Undecodable input - key on the raw string
+    cache_key = _generation_cache_key(input_bytes, pendant_prompt, selected_model, num_images, request_body)
+    if req.cachePolicy == "reuse":
+        cached = await _lookup_cached_generation(cache_key)
+        if cached:
+            print(f"Generation cache hit: {cache_key[:12]}")
+            timer.add("cache_lookup", ms_since(cache_started))
+            return await _serve_cached_generation(req, cached, cache_key, pendant_prompt, start_time, progress, timer)
+    elif req.cachePolicy == "refresh":
+        # Regenerate; the new row replaces this entry once it is stored
+        generation_cache.invalidate(cache_key)
+    timer.add("cache_lookup", ms_since(cache_started))
+
+    # Normalize + upload the input photo once, and give FAL its URL instead of a data URI
+    generation_id = str(uuid.uuid4())
+    input_image_url = None
+    if decoded_input is not None:
+        input_max_size = model_config.get("input_max_size", DEFAULT_INPUT_MAX_SIZE)
+        input_image_url = await _upload_input_image(decoded_input, generation_id, input_max_size, timer)
+        if input_image_url:
+            for key in ("image_urls", "image_url"):
+                if key in request_body:
+                    request_body[key] = [input_image_url] if key == "image_urls" else input_image_url
+    elif has_image and req.imageBase64.startswith("http"):
+        # External URL - FAL fetches it itself; keep a copy for history
+        try:
+            input_image_url = await supabase.upload_from_url("generations", f"{generation_id}/input.webp", req.imageBase64)
+        except Exception as input_err:
+            print(f"Failed to upload input image: {input_err}")
+
+    # FAL timestamps: submit started / accepted / first seen running
+    fal_marks = {"submit": time.perf_counter()}
+
+    async def on_submit(handle: dict):
+        fal_marks["queued"] = time.perf_counter()
+        timer.add("fal_submit", ms_since(fal_marks["submit"]))
+        await _emit_progress(progress, "submitted", {"request_id": handle.get("request_id")})
+
+    async def on_status(status_data: dict):
+        if status_data.get("status") in ("IN_PROGRESS", "COMPLETED") and "running" not in fal_marks:
+            fal_marks["running"] = time.perf_counter()
+            timer.add("fal_queue", ms_since(fal_marks["queued"]))
+        await _emit_progress(progress, "fal_status", {
+            "status": status_data.get("status"),
+            "queue_position": status_data.get("queue_position"),
+        })
 
     try:
-        async with httpx.AsyncClient(timeout=300) as client:
-            response = await client.post(model_url, json=request_body, headers=headers)
-            response.raise_for_status()
-            result = response.json()
-
-            image_urls = []
-
-            # Poll for results
-            if "request_id" in result and "status_url" in result:
-                attempts = 0
-                max_attempts = 120
-
-                while attempts < max_attempts:
-                    await asyncio.sleep(2)
-                    status_res = await client.get(result["status_url"], headers={"Authorization": f"Key {fal_key}"})
-                    status_data = status_res.json()
-
-                    print(f"Status: {status_data.get('status')}, attempt: {attempts}")
-
-                    if status_data.get("status") == "COMPLETED":
-                        result_res = await client.get(result["response_url"], headers={"Authorization": f"Key {fal_key}"})
-                        final_result = result_res.json()
-                        if "images" in final_result:
-                            image_urls = [img["url"] for img in final_result["images"]]
-                        break
-                    elif status_data.get("status") == "FAILED":
-                        raise Exception("Generation failed")
-
-                    attempts += 1
-            elif "images" in result:
-                image_urls = [img["url"] for img in result["images"]]
-
-            if not image_urls:
-                raise Exception("No images generated")
-
-            # Remove background from all generated images
-            print(f"Removing background from {len(image_urls)} images...")
-            images_with_transparent_bg = []
-            for img_url in image_urls:
-                transparent_url = await remove_background(img_url, fal_key)
-                images_with_transparent_bg.append(transparent_url)
-
-            image_urls = images_with_transparent_bg
-            print(f"Background removal complete")
-
-            # Upload images to Supabase Storage for reliable access
-            # Create both full size (1024px) and thumbnail (400px) versions in WebP format
-            print(f"Uploading {len(image_urls)} images to Supabase Storage...")
-            generation_id = str(uuid.uuid4())
-            supabase_urls = []
-            thumbnail_urls = []
-            for i, img_url in enumerate(image_urls):
-                try:
-                    file_path = f"{generation_id}/{i}.png"
-                    full_url, thumb_url = await supabase.upload_with_thumbnail(
-                        "generations",
-                        file_path,
-                        img_url,
-                        full_size=1024,
-                        thumb_size=400,
-                        format="WEBP",
-                        quality=85
-                    )
-                    supabase_urls.append(full_url)
-                    thumbnail_urls.append(thumb_url)
-                    print(f"Uploaded image {i+1}/{len(image_urls)} with thumbnail")
-                except Exception as upload_err:
-                    print(f"Failed to upload image {i}: {upload_err}, using original URL")
-                    supabase_urls.append(img_url)
-                    thumbnail_urls.append(img_url)  # Fallback to full image for thumb
-
-            # Use Supabase URLs if upload succeeded
-            if supabase_urls:
-                image_urls = supabase_urls
-            print(f"Upload complete")
-
-            execution_time_ms = int((time.time() - start_time) * 1000)
-            cost_per_image = model_config.get("cost_per_image_cents", COST_PER_IMAGE_CENTS)
-            cost_cents = len(image_urls) * cost_per_image + len(image_urls) * COST_REMOVE_BG_CENTS
-
-            # Upload input image to Supabase Storage for history
-            input_image_url = None
-            if has_image and req.imageBase64:
-                try:
-                    input_path = f"{generation_id}/input.webp"
-                    if req.imageBase64.startswith("data:"):
-                        # Base64 encoded image - extract base64 data after the comma
-                        base64_data = req.imageBase64.split(",", 1)[1] if "," in req.imageBase64 else req.imageBase64
-                        image_bytes = base64.b64decode(base64_data)
-                        await supabase.upload_file("generations", input_path, image_bytes, "image/webp")
-                        input_image_url = await supabase.get_public_url("generations", input_path)
-                    elif req.imageBase64.startswith("http"):
-                        # URL - download and upload
-                        input_image_url = await supabase.upload_from_url("generations", input_path, req.imageBase64)
-                    print(f"Uploaded input image: {input_image_url}")
-                except Exception as input_err:
-                    print(f"Failed to upload input image: {input_err}")
-                    input_image_url = None
-
-            # Save to Supabase
-            gen_data = {
-                "id": generation_id,
-                "input_image_url": input_image_url,
-                "user_comment": req.prompt,
-                "form_factor": req.formFactor,
-                "material": req.material,
-                "size": req.size,
-                "theme": req.theme,
+        final_result = await fal_queue.run(
+            model_url, request_body, key=fal_key, timeout=240, on_submit=on_submit, on_status=on_status
+        )
+        image_urls = [img["url"] for img in final_result.get("images", [])]
+        if "queued" in fal_marks:
+            timer.add("fal_total", ms_since(fal_marks["queued"]))
+        if "running" in fal_marks:
+            timer.add("fal_inference", ms_since(fal_marks["running"]))
+
+        if not image_urls:
+            raise Exception("No images generated")
+        await _emit_progress(progress, "generated", {"count": len(image_urls)})
+
+        # Each image flows through bg-removal -> download -> resize -> upload
+        # on its own; process-wide semaphores cap FAL and storage load
+        print(f"Processing {len(image_urls)} images (background removal + upload)...")
+
+        async def process_image(index: int, img_url: str) -> dict:
+            item = await _process_generated_image(index, img_url, generation_id, fal_key, timer.image(index))
+            await _emit_progress(progress, "image_ready", item)
+            return item
+
+        with timer.stage("postprocess"):
+            processed = await asyncio.gather(*(
+                process_image(i, img_url) for i, img_url in enumerate(image_urls)
+            ))
+        image_urls = [item["url"] for item in processed]
+        thumbnail_urls = [item["thumbnail"] for item in processed]
+        print(f"Upload complete")
+        await _emit_progress(progress, "uploaded", {"images": image_urls, "thumbnails": thumbnail_urls})
+
+        execution_time_ms = int((time.time() - start_time) * 1000)
+        cost_per_image = model_config.get("cost_per_image_cents", COST_PER_IMAGE_CENTS)
+        cost_cents = len(image_urls) * cost_per_image + len(image_urls) * COST_REMOVE_BG_CENTS
+
+        # Save to Supabase
+        gen_data = {
+            "id": generation_id,
+            "input_image_url": input_image_url,
+            "user_comment": req.prompt,
+            "form_factor": req.formFactor,
+            "material": req.material,
+            "size": req.size,
+            "theme": req.theme,
+            "output_images": image_urls,
+            "output_thumbnails": thumbnail_urls,
+            "prompt_used": pendant_prompt,
+            "cost_cents": cost_cents,
+            "model_used": model_name,
+            "session_id": req.sessionId,
+            "application_id": req.applicationId,
+            "execution_time_ms": execution_time_ms,
+            # Only results fully stored in Supabase are reusable (FAL URLs expire)
+            "cache_key": cache_key if all(url.startswith(supabase.url) for url in image_urls) else None,
+            "stage_timings": timer.to_dict()
+        }
+        db_gen = await _insert_generation(gen_data)
+        if db_gen and db_gen.get("cache_key"):
+            # Newest row for this key - later 'reuse' calls must see it, not an older in-memory hit
+            generation_cache.set(cache_key, {
                 "output_images": image_urls,
-                "prompt_used": pendant_prompt,
-                "cost_cents": cost_cents,
+                "output_thumbnails": thumbnail_urls,
                 "model_used": model_name,
-                "session_id": req.sessionId,
-                "application_id": req.applicationId,
-                "execution_time_ms": execution_time_ms
-            }
-            db_gen = await supabase.insert("pendant_generations", gen_data)
+                "created_ts": time.time(),
+            })
+        await _emit_progress(progress, "saved", {"generationId": db_gen["id"] if db_gen else None})
 
-            # Update application if exists
-            if req.applicationId:
-                await supabase.update("applications", req.applicationId, {
-                    "status": "generated",
-                    "generated_preview": image_urls[0]
-                })
+        # Update application if exists
+        if req.applicationId:
+            await supabase.update("applications", req.applicationId, {
+                "status": "generated",
+                "generated_preview": image_urls[0]
+            })
 
-            return {
-                "success": True,
-                "images": image_urls,
-                "thumbnails": thumbnail_urls,
-                "prompt": pendant_prompt,
-                "generationId": db_gen["id"] if db_gen else None,
-                "costCents": cost_cents,
-                "executionTimeMs": execution_time_ms
-            }
+        return {
+            "success": True,
+            "images": image_urls,
+            "thumbnails": thumbnail_urls,
+            "prompt": pendant_prompt,
+            "generationId": db_gen["id"] if db_gen else None,
+            "costCents": cost_cents,
+            "executionTimeMs": execution_time_ms
+        }
 
     except Exception as e:
         error_msg = str(e)
@@ -1212,7 +1581,229 @@ Maximum surface detail, jewelry quality finish."""
             except:
                 pass  # Don't fail if error logging fails
 
-        raise HTTPException(status_code=500, detail=error_msg)
+        raise
+
+
+async def run_generation_job(payload: dict, progress: ProgressCallback) -> dict:
+    """Job queue handler: rebuild the request and run the pipeline"""
+    return await run_generation(GenerateRequest(**payload), progress)
+
+
+@router.post("/generate")
+async def generate_pendant(req: GenerateRequest, mode: str = "sync"):
+    """
+    Generate pendant images using FAL.ai.
+
+    mode=sync (default) - wait for the whole pipeline and return the images.
+    mode=job            - enqueue a background job and return its id at once;
+                          follow it via /generate/jobs/{job_id} or .../events (SSE).
+    """
+    if mode == "job":
+        try:
+            job = await job_queue.submit(req.model_dump())
+        except JobQueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        return {
+            "success": True,
+            "jobId": job["id"],
+            "status": job["status"],
+            "statusUrl": f"/api/generate/jobs/{job['id']}",
+            "eventsUrl": f"/api/generate/jobs/{job['id']}/events",
+        }
+
+    try:
+        return await run_generation(req)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Streaming generations keep running if the client disconnects (FAL is
+# already paid for); hold task references so they aren't garbage-collected
+_streaming_generations: set = set()
+STREAM_HEARTBEAT_SECONDS = 15
+
+
+@router.post("/generate/stream")
+async def generate_pendant_stream(req: GenerateRequest, format: str = "ndjson"):
+    """
+    Streaming variant of /generate: emits each image as soon as its
+    bg-removal and upload finish, then the final generation record.
+
+    format=ndjson (default) - one JSON object per line: {"type": "stage"|"image"|"result"|"error", ...}
+    format=sse              - the same payloads as Server-Sent Events named by type
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def progress(stage: str, data: Optional[dict] = None):
+        await events.put((stage, data or {}))
+
+    async def run():
+        try:
+            result = await run_generation(req, progress)
+            await events.put(("result", result))
+        except Exception as e:
+            await events.put(("error", {"detail": str(getattr(e, "detail", None) or e)}))
+
+    task = asyncio.create_task(run())
+    _streaming_generations.add(task)
+    task.add_done_callback(_streaming_generations.discard)
+
+    def encode(event_type: str, payload: dict) -> str:
+        if format == "sse":
+            return f"event: {event_type}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+        return json.dumps({"type": event_type, **payload}, ensure_ascii=False, default=str) + "\n"
+
+    async def stream():
+        while True:
+            try:
+                stage, data = await asyncio.wait_for(events.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n" if format == "sse" else encode("heartbeat", {})
+                continue
+
+            if stage == "image_ready":
+                yield encode("image", data)
+            elif stage == "result":
+                yield encode("result", {
+                    "generationId": data.get("generationId"),
+                    "images": data.get("images"),
+                    "thumbnails": data.get("thumbnails"),
+                    "prompt": data.get("prompt"),
+                    "costCents": data.get("costCents"),
+                    "executionTimeMs": data.get("executionTimeMs"),
+                })
+                return
+            elif stage == "error":
+                yield encode("error", data)
+                return
+            else:
+                yield encode("stage", {"stage": stage, **data})
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/generate/jobs/{job_id}")
+async def get_generation_job(job_id: str):
+    """Get generation job status, stage history and result"""
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/generate/jobs/{job_id}/events")
+async def stream_generation_job(job_id: str):
+    """Server-Sent Events stream of generation job stages"""
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        async for event in job_queue.events(job_id):
+            if event["stage"] == "heartbeat":
+                yield ": keep-alive\n\n"
+                continue
+            if event["stage"] in ("completed", "failed"):
+                # Final event carries the whole job record (result or error)
+                final = await job_queue.get(job_id)
+                yield f"event: {event['stage']}\ndata: {json.dumps(final, ensure_ascii=False, default=str)}\n\n"
+                continue
+            yield f"event: stage\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/uploads")
+async def upload_image(request: Request):
+    """
+    Streaming multipart image upload (field "file"). Returns a Storage URL
+    accepted by /generate (imageUrl), gem endpoints and stage photos (image_url).
+    Identical files are stored once.
+    """
+    try:
+        upload = await ingest_image_upload(request)
+        return {"success": True, **upload}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error ingesting upload: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/fal/webhook")
+async def fal_webhook(request: Request, token: Optional[str] = None):
+    """FAL.ai queue callback (enabled by FAL_WEBHOOK_URL) - wakes the waiting generation"""
+    # Webhook mode requires the secret; without one every callback is refused
+    if not FAL_WEBHOOK_SECRET or not hmac.compare_digest(token or "", FAL_WEBHOOK_SECRET):
+        raise HTTPException(status_code=403, detail="Invalid webhook token")
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    delivered = fal_queue.deliver_webhook(body)
+    return {"success": True, "delivered": delivered}
+
+
+# Rows per request; PostgREST caps responses at its max-rows (1000 on Supabase)
+TIMINGS_PAGE_SIZE = 1000
+TIMINGS_MAX_ROWS = 20000
+
+
+@router.get("/admin/generations/timings")
+async def admin_generation_timings(hours: int = 24, model: Optional[str] = None, limit: int = 5000):
+    """
+    Percentiles (ms) of generation stage timings per model over the last `hours`,
+    from the newest `limit` generations (paged, so not cut at PostgREST's max-rows).
+    `generations` is the number of rows actually aggregated; `truncated` means older
+    rows in the window were left out.
+    """
+    try:
+        since = (datetime.utcnow() - timedelta(hours=hours)).isoformat()
+        filters = f"created_at=gte.{since}&stage_timings=not.is.null"
+        if model:
+            filters += f"&model_used=eq.{model}"
+        limit = max(1, min(limit, TIMINGS_MAX_ROWS))
+
+        rows, cursor, truncated = [], None, False
+        while True:
+            page = await supabase.select(
+                "pendant_generations",
+                columns="id,created_at,model_used,stage_timings",
+                filters=join_filters(filters, keyset_filter(cursor)),
+                order=KEYSET_ORDER,
+                limit=min(TIMINGS_PAGE_SIZE, limit - len(rows) + 1)
+            )
+            if not page:
+                break
+            rows.extend(page)
+            if len(rows) > limit:
+                rows, truncated = rows[:limit], True
+                break
+            cursor = encode_cursor(page[-1])
+
+        return {
+            "since": since,
+            "hours": hours,
+            "generations": len(rows),
+            "truncated": truncated,
+            "models": aggregate_stage_timings(rows)
+        }
+    except Exception as e:
+        print(f"Error aggregating generation timings: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 # ============== EXAMPLES API ==============
@@ -1385,6 +1976,7 @@ async def request_verification_code(req: RequestCodeRequest):
             # Update existing user with new code
             user_id = existing_user["id"]
             await supabase.update("users", user_id, user_data)
+            _invalidate_client_search(user_data)
         else:
             # Create new user
             user_id = str(uuid.uuid4())
@@ -1395,6 +1987,7 @@ async def request_verification_code(req: RequestCodeRequest):
                 "email_verified": False,
                 **user_data
             })
+            client_search_cache.invalidate()
 
         # Link application to user (preliminary, not verified yet)
         if req.application_id:
@@ -1599,6 +2192,7 @@ async def update_user_profile(user_id: str, updates: UserProfileUpdate):
         # Try to update - this may fail if columns don't exist yet
         try:
             result = await supabase.update("users", user_id, update_data)
+            _invalidate_client_search(update_data)
         except Exception as update_err:
             # If columns don't exist, just return the current user data
             print(f"Warning: Could not update profile (columns may not exist): {update_err}")
@@ -1889,39 +2483,70 @@ async def test_payment(amount: int = 100):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Payment totals for the admin page, aggregated by the payment_stats_by_status
+# view (migration 021). A short TTL keeps repeated page loads off the database.
+PAYMENT_STATS_CACHE_TTL = float(os.getenv("PAYMENT_STATS_CACHE_TTL", "10"))
+payment_stats_cache = TTLCache(ttl=PAYMENT_STATS_CACHE_TTL, max_entries=1)
+
+
+async def _load_payment_stats() -> dict:
+    """total_count / paid_count / total_amount plus per-status breakdown"""
+    try:
+        rows = await supabase.select("payment_stats_by_status", columns="status,payment_count,total_amount")
+    except httpx.HTTPStatusError as e:
+        # View not created yet - aggregate the two needed columns in Python
+        print(f"payment_stats_by_status unavailable ({e.response.status_code}), aggregating in Python")
+        by_status: dict = {}
+        for p in await supabase.select("payments", columns="status,amount"):
+            row = by_status.setdefault(p.get("status"), {"status": p.get("status"), "payment_count": 0, "total_amount": 0})
+            row["payment_count"] += 1
+            row["total_amount"] += p.get("amount") or 0
+        rows = list(by_status.values())
+
+    paid = [r for r in rows if r.get("status") in SUCCESS_STATUSES]
+    return {
+        "total_count": sum(r["payment_count"] for r in rows),
+        "paid_count": sum(r["payment_count"] for r in paid),
+        "total_amount": sum(r["total_amount"] for r in paid),
+        "by_status": {
+            r.get("status"): {"count": r["payment_count"], "amount": r["total_amount"]}
+            for r in rows
+        },
+    }
+
+
 @router.get("/admin/payments")
 async def list_payments(
     status: Optional[str] = None,
     limit: int = 50,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None
 ):
-    """List all payments with optional status filter (for admin panel)"""
+    """List all payments with optional status filter (for admin panel), keyset-paged via `cursor`"""
     try:
-        # Get all payments
+        limit = min(limit, 200)
         payments = await supabase.select(
             "payments",
-            order="created_at.desc",
-            limit=limit
+            filters=join_filters(f"status=eq.{status}" if status else None, keyset_filter(cursor)),
+            order=KEYSET_ORDER,
+            limit=limit + 1,
+            offset=None if cursor else offset
         )
-
-        # Filter by status if provided
-        if status:
-            payments = [p for p in payments if p.get("status") == status]
+        payments, next_cursor = next_page(payments, limit)
 
         # Get total stats
-        all_payments = await supabase.select("payments")
-        total_count = len(all_payments)
-        total_amount = sum(p.get("amount", 0) for p in all_payments if p.get("status") in SUCCESS_STATUSES)
-        paid_count = len([p for p in all_payments if p.get("status") in SUCCESS_STATUSES])
+        if PAYMENT_STATS_CACHE_TTL > 0:
+            stats = await payment_stats_cache.get_or_load("stats", _load_payment_stats)
+        else:
+            stats = await _load_payment_stats()
 
         return {
             "payments": payments,
-            "stats": {
-                "total_count": total_count,
-                "paid_count": paid_count,
-                "total_amount": total_amount
-            }
+            "next_cursor": next_cursor,
+            "stats": stats
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error listing payments: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1987,6 +2612,7 @@ async def admin_request_code(req: AdminLoginRequest):
                 "verification_code": code,
                 "verification_code_expires_at": expires_at
             })
+            client_search_cache.invalidate()
 
         # Send email with code
         email_sent = await send_verification_email(email, "Admin", code)
@@ -2034,18 +2660,23 @@ async def admin_verify_code(req: AdminVerifyRequest):
             except:
                 pass
 
-        # Generate session token
-        session_token = str(uuid.uuid4())
-        session_expires = (datetime.utcnow() + timedelta(hours=24)).isoformat()
-
-        # Update user with session
+        # Generate session token (signed and stateless when AUTH_TOKEN_KEYS is set)
         user_id = user["id"]
-        await supabase.update("users", user_id, {
-            "verification_code": None,
-            "verification_code_expires_at": None,
-            "admin_session_token": session_token,
-            "admin_session_expires_at": session_expires
-        })
+        if signed_tokens.enabled:
+            session_token, session_expires = signed_tokens.issue("admin", email, timedelta(hours=24))
+            await supabase.update("users", user_id, {
+                "verification_code": None,
+                "verification_code_expires_at": None
+            })
+        else:
+            session_token = str(uuid.uuid4())
+            session_expires = (datetime.utcnow() + timedelta(hours=24)).isoformat()
+            await supabase.update("users", user_id, {
+                "verification_code": None,
+                "verification_code_expires_at": None,
+                "admin_session_token": session_token,
+                "admin_session_expires_at": session_expires
+            })
 
         return {
             "success": True,
@@ -2074,6 +2705,16 @@ async def admin_verify_session(request: Request):
         if email not in ADMIN_EMAILS:
             return {"valid": False}
 
+        # Signed token: signature checked locally; logout is honoured through the
+        # revocation list (cached for REVOKED_CACHE_TTL seconds) - this is the admin gate
+        if looks_signed(token):
+            claims = signed_tokens.verify(token, "admin")
+            if not claims or claims.get("sub") != email:
+                return {"valid": False}
+            if await signed_tokens.is_revoked(claims):
+                return {"valid": False}
+            return {"valid": True, "email": email}
+
         # Get user
         user = await supabase.select_by_field("users", "email", email)
 
@@ -2108,7 +2749,10 @@ async def admin_logout(request: Request):
         body = await request.json()
         email = body.get("email", "").lower().strip()
 
-        if email:
+        claims = signed_tokens.verify(body.get("token"), "admin")
+        if claims:
+            await signed_tokens.revoke(claims)
+        elif email:
             user = await supabase.select_by_field("users", "email", email)
             if user:
                 await supabase.update("users", user["id"], {
@@ -2188,6 +2832,7 @@ async def production_request_code(req: ProductionAuthRequest):
                 "verification_code": code,
                 "verification_code_expires_at": expires_at
             })
+            client_search_cache.invalidate()
 
         # Send email with code
         email_sent = await send_verification_email(email, "Production Staff", code)
@@ -2243,15 +2888,16 @@ async def production_verify_code(req: ProductionVerifyRequest):
                 pass
 
         # Generate session token (valid for 7 days)
-        session_token = str(uuid.uuid4())
-        session_expires = (datetime.utcnow() + timedelta(days=7)).isoformat()
+        if signed_tokens.enabled:
+            session_token, session_expires = signed_tokens.issue(
+                "production", email, timedelta(days=7), name=user.get("name")
+            )
+        else:
+            session_token, session_expires = await session_store.create("production", user, timedelta(days=7))
 
-        # Update user with production session
         await supabase.update("users", user["id"], {
             "verification_code": None,
-            "verification_code_expires_at": None,
-            "production_session_token": session_token,
-            "production_session_expires_at": session_expires
+            "verification_code_expires_at": None
         })
 
         return {
@@ -2266,50 +2912,96 @@ async def production_verify_code(req: ProductionVerifyRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _production_token(request: Request) -> Optional[str]:
+    """Production session token from cookie first, then from Authorization header"""
+    token = request.cookies.get("production_session")
+    if not token:
+        auth_header = request.headers.get("Authorization", "")
+        if auth_header.startswith("Bearer "):
+            token = auth_header[7:]
+    return token
+
+
+async def _reject_revoked_production_token(request: Request):
+    """For sensitive writes: refuse signed tokens that were logged out"""
+    claims = signed_tokens.verify(_production_token(request), "production")
+    if claims and await signed_tokens.is_revoked(claims):
+        raise HTTPException(status_code=401, detail="Session revoked")
+
+
 @router.get("/production/verify-session")
 async def production_verify_session(request: Request):
     """Verify production session from cookie or header"""
     try:
-        # Try to get token from cookie first, then from Authorization header
-        token = request.cookies.get("production_session")
-
-        if not token:
-            auth_header = request.headers.get("Authorization", "")
-            if auth_header.startswith("Bearer "):
-                token = auth_header[7:]
-
+        token = _production_token(request)
         if not token:
             return {"is_production": False}
 
-        # Find user with this session token
-        # We need to search by token - this is a bit inefficient but works for now
-        users = await supabase.select("users", limit=1000)
+        # Signed token: checked locally, no database access
+        if looks_signed(token):
+            claims = signed_tokens.verify(token, "production")
+            if not claims:
+                return {"is_production": False}
+            return {
+                "is_production": True,
+                "email": claims.get("sub"),
+                "name": claims.get("name")
+            }
 
-        for user in users:
-            if user.get("production_session_token") == token:
-                # Check if session is expired
-                expires_at = user.get("production_session_expires_at")
-                if expires_at:
-                    try:
-                        expiry = datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
-                        if datetime.utcnow().replace(tzinfo=expiry.tzinfo) > expiry:
-                            return {"is_production": False}
-                    except:
-                        return {"is_production": False}
-
-                return {
-                    "is_production": True,
-                    "email": user.get("email"),
-                    "name": user.get("name")
-                }
+        # Indexed lookup by token hash (cached for SESSION_CACHE_TTL seconds)
+        session = await session_store.verify("production", token)
+        if session:
+            return {
+                "is_production": True,
+                "email": session.get("email"),
+                "name": session.get("name")
+            }
 
-        return {"is_production": False}
+        # Sessions issued before migration 019 are still on the users row
+        # (the raw token is client input: encode it so it can't rewrite the filter)
+        user = await supabase.select_by_field(
+            "users", "production_session_token", quote(token, safe=""),
+            columns="email,name,production_session_expires_at"
+        )
+        if not user:
+            return {"is_production": False}
+
+        expires_at = user.get("production_session_expires_at")
+        if expires_at:
+            try:
+                expiry = datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
+                if datetime.utcnow().replace(tzinfo=expiry.tzinfo) > expiry:
+                    return {"is_production": False}
+            except:
+                return {"is_production": False}
+
+        return {
+            "is_production": True,
+            "email": user.get("email"),
+            "name": user.get("name")
+        }
 
     except Exception as e:
         print(f"Error verifying production session: {e}")
         return {"is_production": False}
 
 
+@router.post("/production/logout")
+async def production_logout(request: Request):
+    """Logout production - revoke the session token"""
+    try:
+        token = _production_token(request)
+        claims = signed_tokens.verify(token, "production")
+        if claims:
+            await signed_tokens.revoke(claims)
+        elif token:
+            await session_store.revoke(token)
+        return {"success": True}
+    except Exception as e:
+        print(f"Error logging out production: {e}")
+        return {"success": True}  # Always return success for logout
+
+
 @router.get("/admin/check/{user_id}")
 async def check_admin_status(user_id: str):
     """Check if user is an admin by user_id"""
@@ -2335,20 +3027,81 @@ async def check_admin_status(user_id: str):
 # Admin Clients & Invoices
 # ============================================
 
+# Sortable columns of client_stats (migration 022) for GET /admin/clients
+CLIENT_SORT_COLUMNS = {"created_at", "orders_count", "paid_count", "total_spent", "last_order_at", "email", "name"}
+CLIENT_LIST_COLUMNS = "user_id,email,name,first_name,last_name,telegram_username,is_admin,created_at,orders_count,paid_count,total_spent,last_order_at"
+
+
 @router.get("/admin/clients")
-async def admin_list_clients():
-    """List all clients with aggregated order/payment data - OPTIMIZED"""
+async def admin_list_clients(
+    limit: int = 500,
+    offset: int = 0,
+    sort: str = "created_at",
+    order: str = "desc",
+    count: str = "exact"
+):
+    """
+    List clients with aggregated order/payment data from client_stats,
+    which triggers keep current. Paginated and sortable by any of
+    CLIENT_SORT_COLUMNS. One page per call (has_more tells whether to fetch
+    the next offset); rows carry no applications/payments - the client card
+    loads them from GET /admin/clients/{user_id}.
+    """
+    if sort not in CLIENT_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(sorted(CLIENT_SORT_COLUMNS))}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    limit = max(1, min(limit, 1000))
+    mode = count_mode(count)
+
     try:
-        # OPTIMIZATION: Fetch all data in 3 queries instead of N+1
-        # 1. Get all users
-        users = await supabase.select("users", order="created_at.desc", limit=500)
+        # Page and total run concurrently
+        batch = supabase.batch()
+        batch.add("rows", supabase.select(
+            "client_stats",
+            columns=CLIENT_LIST_COLUMNS,
+            filters="listed=is.true",
+            order=f"{sort}.{order}.nullslast,user_id.{order}",
+            limit=limit + 1,
+            offset=offset
+        ))
+        if mode != "none":
+            batch.add("total", supabase.count("client_stats", filters="listed=is.true", mode=mode))
+        result = await batch.run()
+        try:
+            rows = result["rows"]
+            total = result["total"] if mode != "none" else None
+        except httpx.HTTPStatusError as e:
+            # client_stats not created yet - join the raw tables
+            print(f"client_stats unavailable ({e.response.status_code}), aggregating in Python")
+            return await _list_clients_joined()
 
-        # 2. Get all applications (lightweight - no base64 fields)
-        app_columns = "id,user_id,status,form_factor,material,size,generated_preview,created_at,paid_at"
-        all_apps = await supabase.select("applications", columns=app_columns, order="created_at.desc", limit=2000)
+        has_more = len(rows) > limit
+        clients = [{**{k: v for k, v in r.items() if k != "user_id"}, "id": r["user_id"]} for r in rows[:limit]]
+        return {"clients": clients, "total": total, "limit": limit, "offset": offset, "has_more": has_more}
 
-        # 3. Get all payments
-        all_payments = await supabase.select("payments", order="created_at.desc", limit=2000)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error listing clients: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _list_clients_joined() -> dict:
+    """Pre-022 client list: joins capped users/applications/payments in Python"""
+    try:
+        # OPTIMIZATION: Fetch all data in 3 concurrent queries instead of N+1
+        app_columns = "id,user_id,status,form_factor,material,size,generated_preview,created_at,paid_at"
+        result = await supabase.batch().add(
+            "users", supabase.select("users", order="created_at.desc", limit=500)
+        ).add(
+            # Lightweight applications - no base64 fields
+            "apps", supabase.select("applications", columns=app_columns, order="created_at.desc", limit=2000)
+        ).add(
+            "payments", supabase.select("payments", order="created_at.desc", limit=2000)
+        ).run()
+        # Any failure aborts - partial data would give wrong totals
+        users, all_apps, all_payments = result["users"], result["apps"], result["payments"]
 
         # Build lookup dictionaries for O(1) access
         apps_by_user = {}
@@ -2428,13 +3181,51 @@ async def admin_list_clients():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Autocomplete results per normalized query. Typing in the invoice/assign-client
+# dialogs repeats the same prefixes, so keep them briefly; every users write that
+# touches a searchable field invalidates (admin edits, orders, sign-up flows).
+CLIENT_SEARCH_CACHE_TTL = float(os.getenv("CLIENT_SEARCH_CACHE_TTL", "60"))
+client_search_cache = TTLCache(ttl=CLIENT_SEARCH_CACHE_TTL, max_entries=1024)
+CLIENT_SEARCH_LIMIT = 10
+CLIENT_SEARCH_FIELDS = ("email", "name", "first_name", "last_name", "telegram_username")
+
+
+def _invalidate_client_search(user_data: dict):
+    """Drop cached search results after a users insert/update that changes a searchable field"""
+    if any(field in user_data for field in CLIENT_SEARCH_FIELDS):
+        client_search_cache.invalidate()
+
+
+def _escape_like(term: str) -> str:
+    """Make % and _ in a search term literal for search_clients' LIKE (backslash is the escape)"""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
 @router.get("/admin/clients/search")
 async def admin_search_clients(q: str = ""):
     """Search clients by email, name or telegram for autocomplete"""
+    term = " ".join(q.lower().split())
+    if len(term) < 2:
+        return {"clients": []}
+
+    async def load():
+        return await supabase.rpc("search_clients", {"q": _escape_like(term), "max_results": CLIENT_SEARCH_LIMIT})
+
     try:
-        if len(q) < 2:
-            return {"clients": []}
+        rows = await client_search_cache.get_or_load(term, load)
+        return {"clients": [{k: v for k, v in r.items() if k != "score"} for r in rows]}
+    except httpx.HTTPStatusError as e:
+        # search_clients RPC not created yet (migration 023)
+        print(f"search_clients unavailable ({e.response.status_code}), scanning recent users")
+        return await _search_recent_clients(q)
+    except Exception as e:
+        print(f"Error searching clients: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 
+async def _search_recent_clients(q: str) -> dict:
+    """Pre-023 search: substring match over the 100 most recent users"""
+    try:
         users = await supabase.select("users", order="created_at.desc", limit=100)
         q_lower = q.lower()
 
@@ -2484,11 +3275,14 @@ async def admin_get_client(user_id: str):
         all_payments = []
         if apps:
             app_ids = [a["id"] for a in apps]
-            # Get payments for all apps at once
-            payments = await supabase.select("payments", order="created_at.desc", limit=500)
-            all_payments = [p for p in payments if p.get("application_id") in app_ids]
+            all_payments = await supabase.select(
+                "payments",
+                filters=f"application_id=in.({','.join(app_ids)})",
+                order="created_at.desc"
+            ) or []
 
-        total_spent = sum(p.get("amount", 0) for p in all_payments if p.get("status") in ("CONFIRMED", "AUTHORIZED"))
+        paid_payments = [p for p in all_payments if p.get("status") in ("CONFIRMED", "AUTHORIZED")]
+        total_spent = sum(p.get("amount", 0) for p in paid_payments)
 
         return {
             "id": user_id,
@@ -2498,7 +3292,9 @@ async def admin_get_client(user_id: str):
             "last_name": user.get("last_name", ""),
             "telegram_username": user.get("telegram_username", ""),
             "created_at": user.get("created_at"),
+            "is_admin": user.get("is_admin", False),
             "orders_count": len(apps),
+            "paid_count": len(paid_payments),
             "total_spent": total_spent,
             # NO input_image_url - can contain base64
             "applications": [{
@@ -2663,6 +3459,7 @@ async def admin_create_client(req: CreateClientRequest):
             "is_admin": False,
         }
         await supabase.insert("users", user_data)
+        client_search_cache.invalidate()
 
         return {"success": True, "id": user_id, "email": req.email}
 
@@ -2701,6 +3498,7 @@ async def admin_update_client(user_id: str, req: UpdateClientRequest):
 
         if updates:
             await supabase.update("users", user_id, updates)
+            client_search_cache.invalidate()
 
         return {"success": True, "id": user_id}
 
@@ -2935,32 +3733,30 @@ async def init_products_table():
         with open(migration_path, 'r') as f:
             create_table_sql = f.read()
 
-        # Execute SQL directly using httpx
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            # Try to create table via PostgREST
-            # Note: This may not work as PostgREST doesn't support DDL
-            # User may need to run SQL manually in Supabase SQL Editor
-            response = await client.post(
-                f"{supabase.url}/rest/v1/rpc/exec_sql",
-                headers=supabase.headers,
-                json={"query": create_table_sql}
-            )
-
-            if response.status_code == 404:
-                # RPC function doesn't exist, provide manual instructions
-                return {
-                    "success": False,
-                    "message": "Cannot create table via API. Please run SQL manually.",
-                    "sql_editor_url": "https://supabase.com/dashboard/project/vofigcbihwkmocrsfowt/sql/new",
-                    "sql": create_table_sql
-                }
+        # Try to create table via PostgREST (shared Supabase connection pool)
+        # Note: This may not work as PostgREST doesn't support DDL
+        # User may need to run SQL manually in Supabase SQL Editor
+        response = await supabase.client.post(
+            f"{supabase.url}/rest/v1/rpc/exec_sql",
+            headers=supabase.headers,
+            json={"query": create_table_sql}
+        )
 
-            response.raise_for_status()
+        if response.status_code == 404:
+            # RPC function doesn't exist, provide manual instructions
             return {
-                "success": True,
-                "message": "Products table created successfully",
-                "result": response.json()
+                "success": False,
+                "message": "Cannot create table via API. Please run SQL manually.",
+                "sql_editor_url": "https://supabase.com/dashboard/project/vofigcbihwkmocrsfowt/sql/new",
+                "sql": create_table_sql
             }
+
+        response.raise_for_status()
+        return {
+            "success": True,
+            "message": "Products table created successfully",
+            "result": response.json()
+        }
     except Exception as e:
         # Return SQL for manual execution
         import os
@@ -3273,6 +4069,7 @@ class CreateGemRequest(BaseModel):
     size_mm: float = 1.5  # Size in millimeters
     color: str  # Hex color for fallback, e.g., "#E31C25"
     image_base64: Optional[str] = None  # Base64 encoded image
+    image_url: Optional[str] = None  # Or a URL returned by POST /api/uploads
     remove_background: bool = True  # Auto-remove background
     bg_tolerance: int = 30  # Background removal tolerance
     is_active: bool = True
@@ -3286,6 +4083,7 @@ class UpdateGemRequest(BaseModel):
     size_mm: Optional[float] = None
     color: Optional[str] = None
     image_base64: Optional[str] = None
+    image_url: Optional[str] = None  # Or a URL returned by POST /api/uploads
     remove_background: Optional[bool] = True
     bg_tolerance: Optional[int] = 30
     is_active: Optional[bool] = None
@@ -3335,17 +4133,19 @@ async def admin_create_gem(req: CreateGemRequest):
         await logger.info("gem_upload", f"Creating gem: {req.name}", {
             "gem_id": gem_id,
             "shape": req.shape,
-            "has_image": bool(req.image_base64),
+            "has_image": bool(req.image_base64 or req.image_url),
             "remove_bg": req.remove_background
         })
 
         # Process and upload image if provided
-        if req.image_base64:
+        if req.image_base64 or req.image_url:
             import base64
 
-            # Decode base64
+            # Decode base64 (or fetch the pre-uploaded file)
             try:
-                if "," in req.image_base64:
+                if req.image_url:
+                    image_data = await load_uploaded_image(req.image_url)
+                elif "," in req.image_base64:
                     image_data = base64.b64decode(req.image_base64.split(",")[1])
                 else:
                     image_data = base64.b64decode(req.image_base64)
@@ -3371,6 +4171,9 @@ async def admin_create_gem(req: CreateGemRequest):
                     bg_tolerance=req.bg_tolerance
                 )
                 await logger.info("gem_upload", "Upload successful", {"image_url": image_url})
+            except ImageEngineBusy as busy:
+                await logger.warning("gem_upload", "Image engine busy", {"error": str(busy)})
+                raise HTTPException(status_code=503, detail="Image processing is busy, retry shortly")
             except Exception as upload_err:
                 await logger.exception("gem_upload", "Upload failed", upload_err)
                 raise HTTPException(status_code=500, detail=f"Image upload failed: {upload_err}")
@@ -3412,7 +4215,7 @@ async def admin_update_gem(gem_id: str, req: UpdateGemRequest):
 
         await logger.info("gem_update", f"Updating gem: {gem.get('name')}", {
             "gem_id": gem_id,
-            "has_new_image": bool(req.image_base64)
+            "has_new_image": bool(req.image_base64 or req.image_url)
         })
 
         updates = {}
@@ -3433,11 +4236,13 @@ async def admin_update_gem(gem_id: str, req: UpdateGemRequest):
             updates["sort_order"] = req.sort_order
 
         # Process new image if provided
-        if req.image_base64:
+        if req.image_base64 or req.image_url:
             import base64
 
             try:
-                if "," in req.image_base64:
+                if req.image_url:
+                    image_data = await load_uploaded_image(req.image_url)
+                elif "," in req.image_base64:
                     image_data = base64.b64decode(req.image_base64.split(",")[1])
                 else:
                     image_data = base64.b64decode(req.image_base64)
@@ -3467,6 +4272,9 @@ async def admin_update_gem(gem_id: str, req: UpdateGemRequest):
                 )
                 updates["image_url"] = image_url
                 await logger.info("gem_update", "Upload successful", {"image_url": image_url})
+            except ImageEngineBusy as busy:
+                await logger.warning("gem_update", "Image engine busy", {"error": str(busy)})
+                raise HTTPException(status_code=503, detail="Image processing is busy, retry shortly")
             except Exception as upload_err:
                 await logger.exception("gem_update", "Upload failed", upload_err)
                 raise HTTPException(status_code=500, detail=f"Image upload failed: {upload_err}")
@@ -3527,7 +4335,9 @@ async def get_gem_shapes():
 async def get_logs(
     limit: int = 100,
     level: Optional[str] = None,
-    source: Optional[str] = None
+    source: Optional[str] = None,
+    cursor: Optional[str] = None,
+    count: str = "none"
 ):
     """
     Get application logs for debugging.
@@ -3536,6 +4346,8 @@ async def get_logs(
     - limit: Max number of logs to return (default 100)
     - level: Filter by level (debug, info, warning, error)
     - source: Filter by source (gem_upload, generation, payment, etc.)
+    - cursor: next_cursor from the previous page
+    - count: total to include - exact, planned, estimated or none (default)
 
     Example: GET /api/logs?limit=50&level=error&source=gem_upload
     """
@@ -3549,18 +4361,26 @@ async def get_logs(
 
         filter_str = "&".join(filters) if filters else ""
 
+        mode = count_mode(count)
+        total = await supabase.count("app_logs", filters=filter_str, mode=mode) if mode != "none" else None
+
         logs = await supabase.select(
             "app_logs",
-            order="created_at.desc",
-            limit=limit,
-            filters=filter_str
+            order=KEYSET_ORDER,
+            limit=limit + 1,
+            filters=join_filters(filter_str, keyset_filter(cursor))
         )
+        logs, next_cursor = next_page(logs, limit)
 
         return {
-            "logs": logs or [],
-            "count": len(logs) if logs else 0,
+            "logs": logs,
+            "count": len(logs),
+            "total": total,
+            "next_cursor": next_cursor,
             "filters": {"level": level, "source": source, "limit": limit}
         }
+    except HTTPException:
+        raise
     except Exception as e:
         # If app_logs table doesn't exist yet, return helpful message
         print(f"Error getting logs: {e}")
@@ -3691,35 +4511,61 @@ async def check_system_health():
         "checks": {}
     }
 
+    # Database, FAL.ai and recent errors are independent - check them concurrently
+    result = await supabase.batch(timeout=15).add(
+        "database", supabase.select("generation_settings", limit=1)
+    ).add(
+        "fal", check_fal_status()
+    ).add(
+        "error_logs", supabase.select(
+            "app_logs",
+            filters="source=eq.generation&level=eq.error",
+            order="created_at.desc",
+            limit=10
+        )
+    ).run()
+
     # Check database
-    try:
-        test_data = await supabase.select("generation_settings", limit=1)
+    if "database" not in result.errors:
         health["checks"]["database"] = {
             "status": "healthy",
             "accessible": True
         }
-    except Exception as e:
+    else:
         health["checks"]["database"] = {
             "status": "unhealthy",
             "accessible": False,
-            "error": str(e)
+            "error": str(result.errors["database"])
         }
         health["overall_status"] = "degraded"
 
     # Check FAL.ai
-    fal_status = await check_fal_status()
+    fal_status = result.get("fal") or {
+        "fal_configured": bool(os.environ.get("FAL_KEY")),
+        "fal_accessible": False,
+        "error": f"FAL status check failed: {result.errors.get('fal')!r}"
+    }
     health["checks"]["fal_ai"] = fal_status
     if fal_status.get("error"):
         health["overall_status"] = "critical" if not fal_status.get("fal_accessible") else "degraded"
 
+    # Image processing pool (queue depth + latency)
+    engine_stats = image_engine.stats()
+    engine_stats["status"] = "warning" if engine_stats["waiting"] > 0 else "healthy"
+    health["checks"]["image_engine"] = engine_stats
+
+    # select() request coalescing
+    health["checks"]["supabase_select"] = supabase.select_stats()
+
+    # Background log shipper (queue depth, drops, disk spill)
+    from app_logger import logger
+    log_stats = logger.stats()
+    log_stats["status"] = "warning" if log_stats["dropped"] or log_stats["spill_bytes"] else "healthy"
+    health["checks"]["log_shipper"] = log_stats
+
     # Check recent generation errors
-    try:
-        error_logs = await supabase.select(
-            "app_logs",
-            filters="source=eq.generation&level=eq.error",
-            order="created_at.desc",
-            limit=10
-        )
+    if "error_logs" not in result.errors:
+        error_logs = result.get("error_logs")
         recent_errors = len(error_logs) if error_logs else 0
         health["checks"]["recent_generation_errors"] = {
             "count_last_10": recent_errors,
@@ -3727,9 +4573,8 @@ async def check_system_health():
         }
         if recent_errors > 5:
             health["overall_status"] = "degraded"
-    except:
-        pass
 
+    health["checks_ms"] = result.elapsed_ms
     return health
 
 
@@ -4062,7 +4907,8 @@ async def test_generation_flow(dry_run: bool = True):
     """
     Test the full generation flow without calling FAL.ai (dry_run=True).
     Creates application, validates generation request, returns mock results.
-    Use dry_run=False to test with real FAL.ai call (costs money).
+    Use dry_run=False to test with real FAL.ai call (costs money), or point
+    FAL_QUEUE_BASE_URL at scripts/fake_fal_server.py to run it for free.
     """
     test_result = {
         "timestamp": datetime.utcnow().isoformat(),
@@ -4107,7 +4953,7 @@ async def test_generation_flow(dry_run: bool = True):
         }
 
         # Step 3: Validate settings
-        settings = await get_settings()
+        settings = await get_cached_settings()
         if not settings.get("num_images"):
             raise ValueError("Settings missing num_images")
 
@@ -4315,7 +5161,7 @@ async def run_smoke_tests():
 
     # Test 1: Settings endpoint
     try:
-        settings = await get_settings()
+        settings = await get_cached_settings()
         if "sizeOptions" in settings and "formFactors" in settings:
             test_results["tests"].append({
                 "name": "Settings Endpoint",
@@ -4570,7 +5416,8 @@ class MoveOrderRequest(BaseModel):
 
 class StagePhotoRequest(BaseModel):
     stage: str
-    image_base64: str
+    image_base64: Optional[str] = None
+    image_url: Optional[str] = None  # URL returned by POST /api/uploads (used as-is)
 
 
 @router.get("/production/kanban")
@@ -4699,6 +5546,7 @@ async def production_move_order(order_id: str, req: MoveOrderRequest, request: R
         session_check = await production_verify_session(request)
         if not session_check.get("is_production"):
             raise HTTPException(status_code=401, detail="Production access required")
+        await _reject_revoked_production_token(request)
 
         # Get current order
         order = await supabase.select_one("orders", order_id)
@@ -4780,24 +5628,33 @@ async def production_upload_stage_photo(order_id: str, req: StagePhotoRequest, r
         session_check = await production_verify_session(request)
         if not session_check.get("is_production"):
             raise HTTPException(status_code=401, detail="Production access required")
+        await _reject_revoked_production_token(request)
 
         # Get order
         order = await supabase.select_one("orders", order_id)
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
 
-        # Upload image to storage
-        import base64
-        image_data = req.image_base64
-        if "," in image_data:
-            image_data = image_data.split(",")[1]
-        image_bytes = base64.b64decode(image_data)
+        if req.image_url:
+            # Already in Storage via /api/uploads - just reference it
+            if uploaded_path(req.image_url) is None:
+                raise HTTPException(status_code=400, detail="image_url must point to an uploaded file")
+            url = req.image_url
+        elif req.image_base64:
+            # Upload image to storage
+            import base64
+            image_data = req.image_base64
+            if "," in image_data:
+                image_data = image_data.split(",")[1]
+            image_bytes = base64.b64decode(image_data)
 
-        filename = f"stage_{req.stage}_{uuid.uuid4().hex[:8]}.webp"
-        file_path = f"orders/{order_id}/{filename}"
+            filename = f"stage_{req.stage}_{uuid.uuid4().hex[:8]}.webp"
+            file_path = f"orders/{order_id}/{filename}"
 
-        await supabase.upload_file("pendants", file_path, image_bytes, content_type="image/webp")
-        url = await supabase.get_public_url("pendants", file_path)
+            await supabase.upload_file("pendants", file_path, image_bytes, content_type="image/webp")
+            url = await supabase.get_public_url("pendants", file_path)
+        else:
+            raise HTTPException(status_code=400, detail="image_base64 or image_url is required")
 
         if not url:
             raise HTTPException(status_code=500, detail="Failed to upload image")
@@ -4891,6 +5748,7 @@ async def production_update_order(order_id: str, req: ProductionOrderUpdate, req
         session_check = await production_verify_session(request)
         if not session_check.get("is_production"):
             raise HTTPException(status_code=401, detail="Production access required")
+        await _reject_revoked_production_token(request)
 
         existing = await supabase.select_one("orders", order_id)
         if not existing:
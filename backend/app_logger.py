@@ -6,19 +6,71 @@ Usage:
 
     await logger.info("gem_upload", "Starting gem upload", {"gem_name": "Рубин"})
     await logger.error("gem_upload", "Upload failed", {"error": str(e), "traceback": traceback.format_exc()})
+
+Log calls only append to a bounded in-memory queue; a background shipper
+(started/stopped in the app lifespan) writes them to app_logs in batches of
+up to LOG_BATCH_SIZE rows, one bulk insert per batch, at least every
+LOG_FLUSH_INTERVAL seconds. When the queue is full, entries are dropped per
+LOG_DROP_POLICY (oldest | newest) and counted. Batches that cannot be
+written (Supabase unreachable: connection error, 5xx) are appended to
+LOG_SPILL_PATH and replayed after the next successful write. A batch the
+database rejects (400/409/422, e.g. a value too long for its column) is
+split in halves until the bad rows are isolated; those are dropped and
+counted as `rejected`, the rest is written. Without a running shipper
+(scripts) each call is written directly, as before.
 """
 
+import asyncio
+import json
+import os
+import shutil
+import tempfile
 import traceback
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
 from typing import Optional, Any
-import json
+
+import httpx
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "5000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "2"))
+LOG_DROP_POLICY = os.getenv("LOG_DROP_POLICY", "oldest")  # oldest | newest
+LOG_SPILL_PATH = os.getenv("LOG_SPILL_PATH", os.path.join(tempfile.gettempdir(), "olai_app_logs_spill.jsonl"))
+LOG_SPILL_MAX_BYTES = int(os.getenv("LOG_SPILL_MAX_BYTES", str(50 * 1024 * 1024)))
+# Seconds stop() may spend flushing the queue on shutdown
+LOG_SHUTDOWN_TIMEOUT = float(os.getenv("LOG_SHUTDOWN_TIMEOUT", "5"))
+
+
+def _is_rejected(e: Exception) -> bool:
+    """The database refused the rows themselves (bad value, constraint) - not an outage."""
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code in (400, 409, 422)
 
 
 class AppLogger:
     """Logger that writes to Supabase app_logs table."""
 
-    def __init__(self):
+    def __init__(self, queue_size: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL, drop_policy: str = LOG_DROP_POLICY,
+                 spill_path: str = LOG_SPILL_PATH):
         self._supabase = None
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.spill_path = spill_path
+        self._queue: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.enqueued = 0
+        self.shipped = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.rejected = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.last_error: Optional[str] = None
 
     @property
     def supabase(self):
@@ -27,16 +79,194 @@ class AppLogger:
             self._supabase = supabase
         return self._supabase
 
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # ---- lifecycle ----
+
+    async def start(self):
+        """Start the background shipper. Called once on application startup."""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._ship_loop())
+
+    async def stop(self):
+        """Flush what is queued (spilling the rest to disk) and stop the shipper."""
+        if self._task is None:
+            return
+        # Let the loop drain the queue and exit; cancel it only if that takes too long
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=LOG_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        self._task = None
+        self._stopping = False
+        if self._queue:
+            self._spill(list(self._queue))
+            self._queue.clear()
+
+    async def flush(self):
+        """Ship everything queued right now."""
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                unsent = await self._ship(batch)
+            except asyncio.CancelledError:
+                # Put the in-flight batch back so stop() spills it instead of losing it
+                self._queue.extendleft(reversed(batch))
+                raise
+            if unsent:
+                self._spill(unsent)
+                return
+
+    # ---- queue ----
+
+    def _enqueue(self, entry: dict):
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            if self.drop_policy == "newest":
+                return
+            self._queue.popleft()
+        self._queue.append(entry)
+        self.enqueued += 1
+        if len(self._queue) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _ship_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                if not self._queue and not self._stopping and self._has_spill():
+                    await self._replay_spill()
+            except Exception as e:
+                print(f"Log shipper error: {e}")
+
+    async def _ship(self, batch: list) -> list:
+        """
+        One bulk insert for the whole batch. Returns the entries that could not be
+        written because Supabase is unreachable (to be spilled); [] otherwise.
+        """
+        try:
+            # Round-trip through json so non-serializable details become strings
+            rows = json.loads(json.dumps(batch, ensure_ascii=False, default=str))
+            await self.supabase.insert_many("app_logs", rows, returning=False, chunk_size=len(rows))
+            self.shipped += len(batch)
+            return []
+        except Exception as e:
+            self.last_error = str(e)
+            if not _is_rejected(e):
+                self.failed_batches += 1
+                print(f"Log shipping failed for {len(batch)} entries: {e}")
+                return batch
+            if len(batch) == 1:
+                # Retrying can never succeed - drop the bad entry
+                self.rejected += 1
+                print(f"Log entry rejected by app_logs ({e.response.text[:200]}): {str(batch[0].get('message'))[:200]}")
+                return []
+        # Isolate the rejected rows; stop at the first half that hits an outage
+        middle = len(batch) // 2
+        unsent = await self._ship(batch[:middle])
+        if unsent:
+            return unsent + batch[middle:]
+        return await self._ship(batch[middle:])
+
+    # ---- disk spill ----
+
+    def _spill(self, batch: list):
+        try:
+            size = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+            if size >= LOG_SPILL_MAX_BYTES:
+                self.dropped += len(batch)
+                return
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for entry in batch:
+                    f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            self.spilled += len(batch)
+        except OSError as e:
+            self.dropped += len(batch)
+            print(f"Log spill to {self.spill_path} failed: {e}")
+
+    @property
+    def _replay_path(self) -> str:
+        return f"{self.spill_path}.replay"
+
+    def _has_spill(self) -> bool:
+        return os.path.exists(self.spill_path) or os.path.exists(self._replay_path)
+
+    async def _replay_spill(self):
+        """Re-ship spilled entries once Supabase is reachable again."""
+        replay_path = self._replay_path
+        try:
+            if not os.path.exists(replay_path):
+                os.replace(self.spill_path, replay_path)
+            elif os.path.exists(self.spill_path):
+                # A previous replay was interrupted (crash, cancel): merge new spill into its file
+                with open(self.spill_path, encoding="utf-8") as src, open(replay_path, "a", encoding="utf-8") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.spill_path)
+            entries = []
+            with open(replay_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        pass  # blank or torn line from a crash mid-write
+        except OSError as e:
+            print(f"Log spill replay failed: {e}")
+            return
+        for i in range(0, len(entries), self.batch_size):
+            batch = entries[i:i + self.batch_size]
+            unsent = await self._ship(batch)
+            if unsent:
+                self._spill(unsent + entries[i + self.batch_size:])
+                break
+            self.replayed += len(batch)
+        os.remove(replay_path)
+
+    def stats(self) -> dict:
+        spill_bytes = sum(os.path.getsize(path) for path in (self.spill_path, self._replay_path)
+                          if os.path.exists(path))
+        return {
+            "running": self.running,
+            "queued": len(self._queue),
+            "queue_size": self.queue_size,
+            "enqueued": self.enqueued,
+            "shipped": self.shipped,
+            "dropped": self.dropped,
+            "failed_batches": self.failed_batches,
+            "rejected": self.rejected,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "spill_bytes": spill_bytes,
+            "last_error": self.last_error,
+        }
+
+    # ---- logging API ----
+
     async def _log(self, level: str, source: str, message: str, details: Optional[dict] = None):
-        """Write log entry to database."""
+        """Queue a log entry (or write it directly when the shipper is not running)."""
+        log_entry = {
+            "level": level,
+            "source": source,
+            "message": message,
+            "details": details,
+            # Stamped now, not when the batch reaches the database
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if self.running:
+            self._enqueue(log_entry)
+            return
         try:
-            log_entry = {
-                "level": level,
-                "source": source,
-                "message": message,
-                "details": details,
-            }
-            await self.supabase.insert("app_logs", log_entry)
+            await self.supabase.insert("app_logs", json.loads(json.dumps(log_entry, default=str)))
         except Exception as e:
             # Fallback to console if DB logging fails
             print(f"[{level.upper()}] [{source}] {message}")
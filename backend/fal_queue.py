@@ -0,0 +1,337 @@
+"""
+FAL.ai queue client with adaptive polling.
+
+Requests go through FAL's queue API: submit -> poll status_url -> fetch
+response_url. Instead of sleeping a fixed interval, the next poll is
+scheduled from what FAL reports and what we've seen before:
+
+- IN_QUEUE: queue_position x observed seconds-per-position for the model
+- IN_PROGRESS: expected remaining run time (EWMA of past runs per model)
+- no estimate yet: exponential backoff from FAL_POLL_MIN_INTERVAL
+
+Delays are capped at FAL_POLL_MAX_INTERVAL and jittered so concurrent
+generations don't poll in lockstep.
+
+When FAL_WEBHOOK_URL is set (public URL of POST /api/fal/webhook), FAL
+pushes the result and polling only runs every FAL_WEBHOOK_POLL_INTERVAL
+seconds as a safety net for lost callbacks. Webhook mode needs
+FAL_WEBHOOK_SECRET; without it the URL is ignored and results are polled.
+
+A status poll that fails transiently (429, 5xx, connection error) is
+retried with the usual backoff until the timeout instead of failing the
+already-paid request.
+
+FAL_QUEUE_BASE_URL redirects all model URLs to another host, e.g. the
+local stand-in server:
+
+    python scripts/fake_fal_server.py --port 8090
+    FAL_QUEUE_BASE_URL=http://127.0.0.1:8090 FAL_KEY=fake uvicorn main:app
+
+Usage:
+    from fal_queue import fal_queue
+
+    result = await fal_queue.run(model_url, payload, timeout=240, on_status=callback)
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+FAL_QUEUE_URL = "https://queue.fal.run"
+FAL_QUEUE_BASE_URL = os.getenv("FAL_QUEUE_BASE_URL", FAL_QUEUE_URL).rstrip("/")
+FAL_WEBHOOK_URL = os.getenv("FAL_WEBHOOK_URL", "")
+# Shared secret appended to the webhook URL, checked by /api/fal/webhook
+FAL_WEBHOOK_SECRET = os.getenv("FAL_WEBHOOK_SECRET", "")
+FAL_POLL_MIN_INTERVAL = float(os.getenv("FAL_POLL_MIN_INTERVAL", "0.25"))
+FAL_POLL_MAX_INTERVAL = float(os.getenv("FAL_POLL_MAX_INTERVAL", "5"))
+FAL_WEBHOOK_POLL_INTERVAL = float(os.getenv("FAL_WEBHOOK_POLL_INTERVAL", "10"))
+
+# Weight of the newest sample in the per-model moving averages
+EWMA_ALPHA = 0.3
+BACKOFF_FACTOR = 1.5
+JITTER = 0.2
+
+StatusCallback = Callable[[dict], Awaitable[None]]
+
+
+class FalQueueError(Exception):
+    """FAL reported a failed request or returned an unusable response."""
+
+
+class FalQueueTimeout(FalQueueError):
+    """The request did not complete within the timeout."""
+
+
+def _is_transient(e: Exception) -> bool:
+    """Connection problems, rate limiting and server errors are worth another poll."""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+class ModelTimings:
+    """Moving averages of queue and run times for one model."""
+
+    def __init__(self):
+        self.run_seconds: Optional[float] = None
+        self.seconds_per_position: Optional[float] = None
+        self.completed = 0
+        self.failed = 0
+        self.polls = 0
+        self.poll_errors = 0
+
+    @staticmethod
+    def _ewma(current: Optional[float], sample: float) -> float:
+        return sample if current is None else EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * current
+
+    def record_run(self, seconds: float):
+        self.run_seconds = self._ewma(self.run_seconds, seconds)
+
+    def record_queue_progress(self, positions: int, seconds: float):
+        if positions > 0 and seconds > 0:
+            self.seconds_per_position = self._ewma(self.seconds_per_position, seconds / positions)
+
+    def to_dict(self) -> dict:
+        return {
+            "run_seconds": round(self.run_seconds, 3) if self.run_seconds is not None else None,
+            "seconds_per_position": round(self.seconds_per_position, 3) if self.seconds_per_position is not None else None,
+            "completed": self.completed,
+            "failed": self.failed,
+            "polls": self.polls,
+            "poll_errors": self.poll_errors,
+        }
+
+
+class FalQueueClient:
+    def __init__(self, base_url: str = FAL_QUEUE_BASE_URL, webhook_url: str = FAL_WEBHOOK_URL):
+        self.base_url = base_url
+        if webhook_url and not FAL_WEBHOOK_SECRET:
+            # Anyone knowing a request_id could post its result - poll instead
+            print("WARNING: FAL_WEBHOOK_URL is set without FAL_WEBHOOK_SECRET, webhook mode disabled")
+            webhook_url = ""
+        self.webhook_url = webhook_url
+        self._client: Optional[httpx.AsyncClient] = None
+        self._timings: dict = {}
+        # request_id -> Future resolved by deliver_webhook()
+        self._waiters: dict = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Long-lived keep-alive client for FAL requests."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=60.0)
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        for future in self._waiters.values():
+            if not future.done():
+                future.cancel()
+        self._waiters.clear()
+
+    def _url(self, model_url: str) -> str:
+        if self.base_url != FAL_QUEUE_URL and model_url.startswith(FAL_QUEUE_URL):
+            return self.base_url + model_url[len(FAL_QUEUE_URL):]
+        return model_url
+
+    @staticmethod
+    def model_name(model_url: str) -> str:
+        return urlsplit(model_url).path.strip("/")
+
+    def timings(self, model: str) -> ModelTimings:
+        timings = self._timings.get(model)
+        if timings is None:
+            timings = self._timings[model] = ModelTimings()
+        return timings
+
+    @staticmethod
+    def _headers(key: Optional[str]) -> dict:
+        return {
+            "Authorization": f"Key {key or os.environ.get('FAL_KEY', '')}",
+            "Content-Type": "application/json",
+        }
+
+    async def submit(self, model_url: str, payload: dict, key: Optional[str] = None) -> dict:
+        """Put a request on the FAL queue. Returns FAL's submit response."""
+        params = {}
+        if self.webhook_url:
+            webhook = self.webhook_url
+            params["fal_webhook"] = webhook + ("&" if "?" in webhook else "?") + f"token={FAL_WEBHOOK_SECRET}"
+        response = await self.client.post(
+            self._url(model_url), json=payload, params=params, headers=self._headers(key), timeout=60
+        )
+        response.raise_for_status()
+        handle = response.json()
+        if self.webhook_url and handle.get("request_id"):
+            self._waiters[handle["request_id"]] = asyncio.get_running_loop().create_future()
+        return handle
+
+    def next_poll_delay(self, model: str, status: dict, running_for: Optional[float], previous: float) -> float:
+        """Seconds to wait before the next status poll."""
+        timings = self.timings(model)
+        state = status.get("status")
+        position = status.get("queue_position")
+        delay = None
+
+        if state == "IN_QUEUE" and position is not None and timings.seconds_per_position:
+            # Aim for roughly when our turn comes up
+            delay = max(position, 1) * timings.seconds_per_position
+        elif state == "IN_PROGRESS" and running_for is not None and timings.run_seconds:
+            remaining = timings.run_seconds - running_for
+            # Poll just before the expected finish, then back off from the minimum
+            delay = remaining * 0.9 if remaining > FAL_POLL_MIN_INTERVAL else None
+
+        if delay is None:
+            delay = previous * BACKOFF_FACTOR if previous else FAL_POLL_MIN_INTERVAL
+        if self.webhook_url:
+            delay = max(delay, FAL_WEBHOOK_POLL_INTERVAL)
+        else:
+            delay = min(max(delay, FAL_POLL_MIN_INTERVAL), FAL_POLL_MAX_INTERVAL)
+        return delay * random.uniform(1 - JITTER, 1 + JITTER)
+
+    async def _wait_or_webhook(self, request_id: str, delay: float) -> Optional[dict]:
+        """Sleep `delay` seconds, or return early with the webhook body if it arrives."""
+        future = self._waiters.get(request_id)
+        if future is None:
+            await asyncio.sleep(delay)
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=delay)
+        except asyncio.TimeoutError:
+            return None
+
+    async def wait(self, model_url: str, handle: dict, key: Optional[str] = None, timeout: float = 240,
+                   on_status: Optional[StatusCallback] = None) -> dict:
+        """Wait for a submitted request and return its response body."""
+        model = self.model_name(model_url)
+        timings = self.timings(model)
+        request_id = handle.get("request_id")
+        headers = self._headers(key)
+        started = time.monotonic()
+        running_since: Optional[float] = None
+        last_position: Optional[tuple] = None
+        last_reported = None
+        status = {"status": handle.get("status", "IN_QUEUE"), "queue_position": handle.get("queue_position")}
+        delay = 0.0
+
+        try:
+            while True:
+                elapsed = time.monotonic() - started
+                if elapsed > timeout:
+                    raise FalQueueTimeout(f"{model} request {request_id} timed out after {int(elapsed)}s")
+
+                running_for = time.monotonic() - running_since if running_since is not None else None
+                delay = min(self.next_poll_delay(model, status, running_for, delay), timeout - elapsed + 0.01)
+                webhook_body = await self._wait_or_webhook(request_id, delay)
+                if webhook_body is not None:
+                    result = self._webhook_result(model, request_id, webhook_body)
+                    timings.completed += 1
+                    self._record_finish(timings, started, running_since)
+                    return result
+
+                try:
+                    status_res = await self.client.get(handle["status_url"], headers=headers)
+                    status_res.raise_for_status()
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    if not _is_transient(e):
+                        raise
+                    # Keep the last known status; the next poll backs off as usual
+                    timings.poll_errors += 1
+                    print(f"FAL status poll for {request_id} failed, retrying: {e}")
+                    continue
+                status = status_res.json()
+                timings.polls += 1
+                now = time.monotonic()
+                state = status.get("status")
+                position = status.get("queue_position")
+
+                if state == "IN_QUEUE" and position is not None:
+                    if last_position is not None and position < last_position[0]:
+                        timings.record_queue_progress(last_position[0] - position, now - last_position[1])
+                    if last_position is None or position != last_position[0]:
+                        last_position = (position, now)
+                elif state in ("IN_PROGRESS", "COMPLETED") and running_since is None:
+                    running_since = now
+                    if last_position is not None:
+                        # Leaving the queue counts as moving past position 0
+                        timings.record_queue_progress(last_position[0] + 1, now - last_position[1])
+
+                reported = (state, position)
+                if on_status is not None and reported != last_reported:
+                    last_reported = reported
+                    try:
+                        await on_status(status)
+                    except Exception as e:
+                        print(f"FAL status callback failed: {e}")
+
+                if state == "COMPLETED":
+                    try:
+                        result_res = await self.client.get(handle["response_url"], headers=headers)
+                        result_res.raise_for_status()
+                    except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                        if not _is_transient(e):
+                            raise
+                        timings.poll_errors += 1
+                        print(f"FAL result fetch for {request_id} failed, retrying: {e}")
+                        continue
+                    timings.completed += 1
+                    self._record_finish(timings, started, running_since)
+                    return result_res.json()
+                if state in ("FAILED", "ERROR"):
+                    timings.failed += 1
+                    raise FalQueueError(f"{model} request {request_id} failed: {status.get('error') or state}")
+        finally:
+            self._waiters.pop(request_id, None)
+
+    @staticmethod
+    def _record_finish(timings: ModelTimings, started: float, running_since: Optional[float]):
+        # Without an IN_PROGRESS sighting we only know the total time - still a usable upper bound
+        timings.record_run(time.monotonic() - (running_since or started))
+
+    @staticmethod
+    def _webhook_result(model: str, request_id: str, body: dict) -> dict:
+        if body.get("status") != "OK":
+            raise FalQueueError(f"{model} request {request_id} failed: {body.get('error') or body.get('status')}")
+        payload = body.get("payload")
+        if not isinstance(payload, dict):
+            raise FalQueueError(f"{model} request {request_id}: webhook without payload")
+        return payload
+
+    def deliver_webhook(self, body: dict) -> bool:
+        """Hand a FAL webhook body to the waiting request. False if nobody is waiting."""
+        future = self._waiters.get(body.get("request_id"))
+        if future is None or future.done():
+            return False
+        future.set_result(body)
+        return True
+
+    async def run(self, model_url: str, payload: dict, key: Optional[str] = None, timeout: float = 240,
+                  on_submit: Optional[StatusCallback] = None, on_status: Optional[StatusCallback] = None) -> dict:
+        """Submit and wait. Returns the model output (the response_url body)."""
+        handle = await self.submit(model_url, payload, key=key)
+        if on_submit is not None:
+            await on_submit(handle)
+        if "status_url" not in handle:
+            # Synchronous response
+            self._waiters.pop(handle.get("request_id"), None)
+            return handle
+        return await self.wait(model_url, handle, key=key, timeout=timeout, on_status=on_status)
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "webhook": bool(self.webhook_url),
+            "pending_webhooks": len(self._waiters),
+            "models": {model: t.to_dict() for model, t in self._timings.items()},
+        }
+
+
+# Singleton instance
+fal_queue = FalQueueClient()
@@ -0,0 +1,300 @@
+"""
+Background generation jobs.
+
+POST /api/generate?mode=job puts the request on an in-process queue and
+returns a job id right away. A small pool of asyncio workers runs the
+generation pipeline and records progress after every stage, which clients
+read via GET /api/generate/jobs/{id} or the SSE stream at .../events.
+
+Job state lives in a pluggable store:
+- "memory"   - process-local dict (default, lost on restart)
+- "supabase" - generation_jobs table (see migrations/015_create_generation_jobs.sql),
+               so any worker can answer status requests
+
+Usage:
+    from generation_jobs import job_queue
+
+    await job_queue.start(handler)          # app startup
+    job = await job_queue.submit(payload)   # enqueue
+    await job_queue.stop()                  # app shutdown
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+JOB_WORKERS = int(os.getenv("GENERATION_JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("GENERATION_JOB_QUEUE_SIZE", "50"))
+JOB_STORE = os.getenv("GENERATION_JOB_STORE", "memory")
+# Finished jobs are kept in memory this long for status polling
+JOB_RETENTION_SECONDS = int(os.getenv("GENERATION_JOB_RETENTION_SECONDS", "3600"))
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+ProgressCallback = Callable[[str, Optional[dict]], Awaitable[None]]
+JobHandler = Callable[[dict, ProgressCallback], Awaitable[dict]]
+
+
+class JobQueueFull(Exception):
+    """Raised when the job queue has no free slots."""
+
+
+class InMemoryJobStore:
+    """Keeps job records in a process-local dict."""
+
+    def __init__(self):
+        self._jobs: dict = {}
+
+    async def create(self, job: dict):
+        self._cleanup()
+        self._jobs[job["id"]] = job
+
+    async def update(self, job_id: str, fields: dict):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return self._jobs.get(job_id)
+
+    def _cleanup(self):
+        """Forget finished jobs older than the retention window."""
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in TERMINAL_STATUSES and job.get("finished_ts", 0) < cutoff
+        ]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+
+
+class SupabaseJobStore(InMemoryJobStore):
+    """
+    Persists jobs to the generation_jobs table.
+    Local jobs are still served from memory; the table makes status
+    visible to other workers and survives restarts.
+    """
+
+    table = "generation_jobs"
+    columns = "id,status,stage,events,result,error,created_at,updated_at"
+
+    def __init__(self):
+        super().__init__()
+        from supabase_client import supabase
+        self.supabase = supabase
+
+    @staticmethod
+    def _row(job: dict) -> dict:
+        # The request payload (often a multi-MB base64 image) is never persisted
+        return {k: job.get(k) for k in ("id", "status", "stage", "events", "result", "error")}
+
+    async def create(self, job: dict):
+        await super().create(job)
+        try:
+            await self.supabase.insert(self.table, self._row(job))
+        except Exception as e:
+            print(f"Failed to persist generation job {job['id']}: {e}")
+
+    async def update(self, job_id: str, fields: dict):
+        await super().update(job_id, fields)
+        row = {k: v for k, v in fields.items() if k in ("status", "stage", "events", "result", "error")}
+        if not row:
+            return
+        row["updated_at"] = datetime.utcnow().isoformat()
+        try:
+            await self.supabase.update(self.table, job_id, row)
+        except Exception as e:
+            print(f"Failed to update generation job {job_id}: {e}")
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = await super().get(job_id)
+        if job is not None:
+            return job
+        try:
+            rows = await self.supabase.select(self.table, columns=self.columns, filters={"id": job_id}, limit=1)
+            return rows[0] if rows else None
+        except Exception as e:
+            print(f"Failed to load generation job {job_id}: {e}")
+            return None
+
+
+def create_job_store(kind: str = JOB_STORE) -> InMemoryJobStore:
+    if kind == "supabase":
+        return SupabaseJobStore()
+    return InMemoryJobStore()
+
+
+class GenerationJobQueue:
+    """Bounded asyncio queue with a fixed pool of workers."""
+
+    def __init__(self, store: Optional[InMemoryJobStore] = None, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_SIZE):
+        self.store = store or create_job_store()
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        self._handler: Optional[JobHandler] = None
+        # job_id -> list of asyncio.Queue for live SSE subscribers
+        self._subscribers: dict = {}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self, handler: JobHandler):
+        """Spawn worker tasks. Called once on application startup."""
+        if self.running:
+            return
+        self._handler = handler
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        """Cancel workers. Jobs still queued are marked failed."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                job_id, _ = self._queue.get_nowait()
+                await self._finish(job_id, "failed", error="Server shutting down")
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, payload: dict) -> dict:
+        """Create a job record and enqueue it. Raises JobQueueFull when saturated."""
+        if not self.running:
+            raise RuntimeError("Generation job queue is not running")
+        if self._queue.full():
+            raise JobQueueFull(f"Generation queue is full ({self.max_queued} jobs)")
+
+        now = datetime.utcnow().isoformat()
+        job = {
+            "id": str(uuid.uuid4()),
+            "status": "queued",
+            "stage": "queued",
+            "events": [{"seq": 0, "stage": "queued", "at": now}],
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self.store.create(job)
+        self._queue.put_nowait((job["id"], payload))
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = await self.store.get(job_id)
+        if job is None:
+            return None
+        return {k: v for k, v in job.items() if k != "finished_ts"}
+
+    async def events(self, job_id: str, poll_interval: float = 1.0, heartbeat_interval: float = 15.0) -> AsyncIterator[dict]:
+        """
+        Yield stage events for a job: first the ones already recorded, then
+        live ones until the job finishes. Jobs owned by another worker are
+        followed by polling the store.
+        """
+        subscriber: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(subscriber)
+        try:
+            job = await self.store.get(job_id)
+            if job is None:
+                return
+            sent = 0
+            for event in list(job.get("events") or []):
+                yield event
+                sent += 1
+            if job["status"] in TERMINAL_STATUSES:
+                return
+
+            last_yield = time.monotonic()
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), timeout=poll_interval)
+                    if event["seq"] < sent:
+                        continue  # already replayed from the store
+                    yield event
+                    sent = event["seq"] + 1
+                    last_yield = time.monotonic()
+                    if event.get("stage") in TERMINAL_STATUSES:
+                        return
+                except asyncio.TimeoutError:
+                    # No live event - re-read the store (covers jobs run by other workers)
+                    job = await self.store.get(job_id)
+                    if job is None:
+                        return
+                    recorded = job.get("events") or []
+                    for event in recorded[sent:]:
+                        yield event
+                        last_yield = time.monotonic()
+                    sent = max(sent, len(recorded))
+                    if job["status"] in TERMINAL_STATUSES:
+                        return
+                    if time.monotonic() - last_yield >= heartbeat_interval:
+                        # Keep-alive marker so proxies don't drop an idle stream
+                        yield {"stage": "heartbeat"}
+                        last_yield = time.monotonic()
+        finally:
+            subs = self._subscribers.get(job_id, [])
+            if subscriber in subs:
+                subs.remove(subscriber)
+            if not subs:
+                self._subscribers.pop(job_id, None)
+
+    async def _publish(self, job_id: str, event: dict):
+        job = await self.store.get(job_id)
+        events = list((job or {}).get("events") or [])
+        event["seq"] = len(events)
+        events.append(event)
+        fields = {"events": events, "updated_at": event["at"]}
+        if event["stage"] not in TERMINAL_STATUSES:
+            fields["stage"] = event["stage"]
+        await self.store.update(job_id, fields)
+        for subscriber in self._subscribers.get(job_id, []):
+            subscriber.put_nowait(event)
+
+    async def _finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        await self.store.update(job_id, {
+            "status": status,
+            "result": result,
+            "error": error,
+            "finished_ts": time.time(),
+        })
+        event = {"stage": status, "at": datetime.utcnow().isoformat()}
+        if error:
+            event["error"] = error
+        await self._publish(job_id, event)
+
+    async def _worker(self, index: int):
+        while True:
+            job_id, payload = await self._queue.get()
+            try:
+                await self.store.update(job_id, {"status": "running"})
+
+                async def progress(stage: str, data: Optional[dict] = None, _job_id=job_id):
+                    event = {"stage": stage, "at": datetime.utcnow().isoformat()}
+                    if data:
+                        event["data"] = data
+                    await self._publish(_job_id, event)
+
+                result = await self._handler(payload, progress)
+                await self._finish(job_id, "completed", result=result)
+            except asyncio.CancelledError:
+                await self._finish(job_id, "failed", error="Job cancelled")
+                raise
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e)
+                print(f"Generation job {job_id} failed on worker {index}: {detail}")
+                await self._finish(job_id, "failed", error=str(detail))
+            finally:
+                self._queue.task_done()
+
+
+# Singleton instance
+job_queue = GenerationJobQueue()
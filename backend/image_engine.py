@@ -0,0 +1,204 @@
+"""
+Image processing executor.
+
+Pillow / NumPy work (decode, resize, background removal) is CPU-bound and
+would block the event loop if called directly from async endpoints. The
+engine runs image_processing functions in a process pool sized to the CPU
+count, falling back to a thread pool when processes are unavailable
+(IMAGE_ENGINE_MODE=thread, or the pool fails to start / breaks).
+
+Backpressure: at most IMAGE_ENGINE_MAX_PENDING tasks are submitted at once.
+Callers wait up to IMAGE_ENGINE_QUEUE_TIMEOUT seconds for a slot, then get
+ImageEngineBusy (mapped to HTTP 503 by the API).
+
+Usage:
+    from image_engine import image_engine
+
+    image_engine.start()                              # app startup
+    data, content_type = await image_engine.resize_image(raw, max_size=1024)
+    image_engine.stats()                              # queue depth + latency
+    image_engine.stop()                               # app shutdown
+"""
+
+import asyncio
+import functools
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+import image_processing
+from stage_timings import percentile
+
+IMAGE_ENGINE_MODE = os.getenv("IMAGE_ENGINE_MODE", "process")  # process | thread
+IMAGE_ENGINE_WORKERS = int(os.getenv("IMAGE_ENGINE_WORKERS", "0")) or (os.cpu_count() or 1)
+IMAGE_ENGINE_MAX_PENDING = int(os.getenv("IMAGE_ENGINE_MAX_PENDING", "0")) or IMAGE_ENGINE_WORKERS * 4
+IMAGE_ENGINE_QUEUE_TIMEOUT = float(os.getenv("IMAGE_ENGINE_QUEUE_TIMEOUT", "30"))
+
+# Latency samples kept per operation for percentiles
+LATENCY_SAMPLES = 500
+
+
+class ImageEngineBusy(Exception):
+    """No free slot in the image engine within the queue timeout."""
+
+
+class ImageEngine:
+    def __init__(self, mode: str = IMAGE_ENGINE_MODE, workers: int = IMAGE_ENGINE_WORKERS,
+                 max_pending: int = IMAGE_ENGINE_MAX_PENDING, queue_timeout: float = IMAGE_ENGINE_QUEUE_TIMEOUT):
+        self.mode = mode
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._executor: Optional[Executor] = None
+        self._executor_mode: Optional[str] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        # op name -> deque of (wait_ms, run_ms)
+        self._latency: dict = {}
+
+    def start(self):
+        """Create the worker pool. Safe to call more than once."""
+        if self._executor is not None:
+            return
+        if self.mode == "process":
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._executor_mode = "process"
+                return
+            except (OSError, NotImplementedError, ValueError) as e:
+                print(f"WARNING: image process pool unavailable ({e}), using threads")
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image")
+        self._executor_mode = "thread"
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._executor_mode = None
+
+    def _fallback_to_threads(self, broken, reason: str):
+        # Tasks failing together all land here: only the first one swaps the pool,
+        # the rest retry on the thread pool it created
+        if self._executor is not broken:
+            return
+        print(f"WARNING: image process pool broken ({reason}), switching to threads")
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image")
+        self._executor_mode = "thread"
+        broken.shutdown(wait=False)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Created lazily inside the running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        return self._slots
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        Run a picklable module-level function in the pool.
+        Raises ImageEngineBusy if no slot frees up within the queue timeout.
+        """
+        if self._executor is None:
+            self.start()
+        slots = self._semaphore()
+        queued_at = time.perf_counter()
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ImageEngineBusy(f"Image engine busy ({self.max_pending} tasks in flight)")
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        self.running += 1
+        loop = asyncio.get_running_loop()
+        try:
+            call = functools.partial(fn, *args, **kwargs)
+            executor = self._executor
+            try:
+                result = await loop.run_in_executor(executor, call)
+            except BrokenProcessPool as e:
+                # A worker died (OOM, segfault in a codec) - retry once on threads
+                self._fallback_to_threads(executor, str(e) or "worker died")
+                result = await loop.run_in_executor(self._executor, call)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            slots.release()
+            self._record(fn.__name__, (started - queued_at) * 1000, (time.perf_counter() - started) * 1000)
+
+    def _record(self, op: str, wait_ms: float, run_ms: float):
+        samples = self._latency.get(op)
+        if samples is None:
+            samples = self._latency[op] = deque(maxlen=LATENCY_SAMPLES)
+        samples.append((wait_ms, run_ms))
+
+    # ---- async wrappers for image_processing ----
+
+    async def resize_image(self, image_data: bytes, max_size: int = 800, format: str = "WEBP", quality: int = 85) -> tuple:
+        return await self.run(image_processing.resize_image, image_data, max_size=max_size, format=format, quality=quality)
+
+    async def remove_background(self, image_data: bytes, tolerance: int = 30, feather: int = 0, flood_fill: bool = False) -> bytes:
+        return await self.run(image_processing.remove_background, image_data, tolerance, feather=feather, flood_fill=flood_fill)
+
+    async def crop_to_content(self, image_data: bytes, padding: int = 5) -> bytes:
+        return await self.run(image_processing.crop_to_content, image_data, padding=padding)
+
+    async def process_gem_image(self, image_data: bytes, max_size: int = 400, tolerance: int = 30,
+                                feather: int = 0, flood_fill: bool = False) -> bytes:
+        return await self.run(image_processing.process_gem_image, image_data, max_size, tolerance,
+                              feather=feather, flood_fill=flood_fill)
+
+    async def render_variants(self, image_data: bytes, variants: list) -> list:
+        return await self.run(image_processing.render_variants, image_data, variants)
+
+    async def normalize_image(self, image_data: bytes, max_size: int, format: str = "WEBP", quality: int = 90) -> tuple:
+        return await self.run(image_processing.normalize_image, image_data, max_size, format=format, quality=quality)
+
+    # ---- metrics ----
+
+    def queue_depth(self) -> int:
+        """Tasks waiting for a slot plus tasks submitted but not finished."""
+        return self.waiting + self.running
+
+    def stats(self) -> dict:
+        operations = {}
+        for op, samples in self._latency.items():
+            waits = [s[0] for s in samples]
+            runs = [s[1] for s in samples]
+            operations[op] = {
+                "samples": len(samples),
+                "wait_ms_p50": round(percentile(waits, 50), 1),
+                "wait_ms_p95": round(percentile(waits, 95), 1),
+                "run_ms_p50": round(percentile(runs, 50), 1),
+                "run_ms_p95": round(percentile(runs, 95), 1),
+            }
+        return {
+            "mode": self._executor_mode or "stopped",
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "queue_depth": self.queue_depth(),
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "operations": operations,
+        }
+
+
+# Singleton instance
+image_engine = ImageEngine()
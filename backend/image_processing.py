@@ -0,0 +1,363 @@
+"""
+Pure image operations (Pillow / NumPy).
+
+Module-level functions with bytes in and bytes out, so they can run in a
+worker process - see image_engine.py for the async wrappers used by the
+API. SupabaseClient keeps same-named sync methods for scripts.
+"""
+
+import base64
+import io
+
+from PIL import Image, ImageOps
+
+try:
+    import numpy as np
+except ImportError:  # remove_background falls back to a per-pixel loop
+    np = None
+
+try:
+    import pillow_avif  # noqa: F401 - registers the AVIF codec with Pillow < 11.2
+except ImportError:
+    pass
+
+# format -> (content type, file extension)
+VARIANT_FORMATS = {
+    "WEBP": ("image/webp", ".webp"),
+    "AVIF": ("image/avif", ".avif"),
+    "JPEG": ("image/jpeg", ".jpg"),
+    "PNG": ("image/png", ".png"),
+}
+
+# Tiny blurred preview inlined as a data URI (never uploaded)
+LQIP_SIZE = 24
+LQIP_QUALITY = 30
+
+
+def _fill_runs(reached, mask):
+    """Extend `reached` to every horizontal run of `mask` pixels it touches."""
+    height, width = mask.shape
+    # Run ids increase at every non-mask pixel; offset per row to keep them unique
+    run_ids = np.cumsum(~mask, axis=1, dtype=np.int32)
+    run_ids += (np.arange(height, dtype=np.int32) * (width + 1))[:, None]
+    hit = np.zeros(height * (width + 1) + 1, dtype=bool)
+    hit[run_ids[reached]] = True
+    return mask & hit[run_ids]
+
+
+def _connected_to_edges(mask):
+    """
+    Pixels of `mask` 4-connected to the image border. Alternates row and
+    column run propagation until stable - converges in a few passes for
+    typical product photos, unlike pixel-by-pixel flood fill.
+    """
+    mask_t = np.ascontiguousarray(mask.T)
+    reached = np.zeros_like(mask)
+    reached[0, :] = mask[0, :]
+    reached[-1, :] = mask[-1, :]
+    reached[:, 0] |= mask[:, 0]
+    reached[:, -1] |= mask[:, -1]
+    while True:
+        grown = _fill_runs(reached, mask)
+        grown = np.ascontiguousarray(_fill_runs(np.ascontiguousarray(grown.T), mask_t).T)
+        if np.array_equal(grown, reached):
+            return reached
+        reached = grown
+
+
+def resize_image(image_data: bytes, max_size: int = 800, format: str = "WEBP", quality: int = 85) -> tuple[bytes, str]:
+    """
+    Resize image to max_size and convert to specified format.
+    Returns tuple of (resized_bytes, content_type)
+    Preserves transparency for WEBP and PNG formats.
+    """
+    img = Image.open(io.BytesIO(image_data))
+
+    # Preserve RGBA mode for transparency support
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    elif img.mode not in ('RGBA', 'RGB'):
+        img = img.convert('RGBA')
+
+    # Calculate new size maintaining aspect ratio
+    width, height = img.size
+    if max(width, height) > max_size:
+        if width > height:
+            new_width = max_size
+            new_height = int(height * (max_size / width))
+        else:
+            new_height = max_size
+            new_width = int(width * (max_size / height))
+        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+    # Save to buffer in specified format
+    buffer = io.BytesIO()
+    if format.upper() == "WEBP":
+        # WebP supports transparency natively
+        img.save(buffer, format="WEBP", quality=quality, lossless=False)
+        content_type = "image/webp"
+    elif format.upper() == "JPEG":
+        # JPEG doesn't support transparency, convert to RGB with white background
+        if img.mode == 'RGBA':
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])
+            img = background
+        img.save(buffer, format="JPEG", quality=quality)
+        content_type = "image/jpeg"
+    else:
+        # PNG preserves transparency
+        img.save(buffer, format="PNG")
+        content_type = "image/png"
+
+    return buffer.getvalue(), content_type
+
+
+def remove_background(image_data: bytes, tolerance: int = 30, feather: int = 0, flood_fill: bool = False) -> bytes:
+    """
+    Remove background from image (white/light gray background).
+    Returns PNG with transparent background.
+
+    The background color is the average of the four corners; pixels whose
+    R, G and B all differ from it by less than `tolerance` become transparent.
+    feather > 0 fades alpha in over the next `feather` levels of difference
+    instead of a hard cut. flood_fill=True only clears background connected
+    to the image edges, so light areas inside the object are kept.
+    """
+    img = Image.open(io.BytesIO(image_data)).convert("RGBA")
+    if np is None:
+        return _remove_background_pixels(img, tolerance)
+
+    rgba = np.array(img)  # (height, width, 4) uint8, writable copy
+    corners = rgba[[0, 0, -1, -1], [0, -1, 0, -1], :3].astype(np.int32)
+    bg = (corners.sum(axis=0) // 4).astype(np.uint8)
+
+    # Largest per-channel difference from the background color (uint8 math, no overflow)
+    diff = None
+    for channel in range(3):
+        values = rgba[..., channel]
+        channel_diff = np.maximum(values, bg[channel]) - np.minimum(values, bg[channel])
+        diff = channel_diff if diff is None else np.maximum(diff, channel_diff, out=diff)
+    feather = max(0, int(feather))
+    candidates = diff < tolerance + feather
+
+    if flood_fill:
+        candidates = _connected_to_edges(candidates)
+
+    alpha = rgba[..., 3]
+    if feather:
+        # 0 inside tolerance, ramping to 1 at tolerance + feather
+        scale = np.clip((diff.astype(np.float32) - tolerance + 1) / (feather + 1), 0.0, 1.0)
+        alpha[candidates] = (alpha[candidates] * scale[candidates]).astype(np.uint8)
+    else:
+        alpha[candidates] = 0
+
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _remove_background_pixels(img: Image.Image, tolerance: int = 30) -> bytes:
+    """Per-pixel fallback when NumPy is not installed (hard tolerance only)."""
+    pixels = img.load()
+    width, height = img.size
+
+    # Find background color (sample corners)
+    corner_samples = [
+        pixels[0, 0],
+        pixels[width-1, 0],
+        pixels[0, height-1],
+        pixels[width-1, height-1]
+    ]
+    # Average the corner colors (assuming they're background)
+    bg_r = sum(c[0] for c in corner_samples) // 4
+    bg_g = sum(c[1] for c in corner_samples) // 4
+    bg_b = sum(c[2] for c in corner_samples) // 4
+
+    # Make similar colors transparent
+    for y in range(height):
+        for x in range(width):
+            r, g, b, a = pixels[x, y]
+            # Check if pixel is similar to background
+            if (abs(r - bg_r) < tolerance and
+                abs(g - bg_g) < tolerance and
+                abs(b - bg_b) < tolerance):
+                pixels[x, y] = (r, g, b, 0)  # Make transparent
+
+    # Save as PNG
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def crop_to_content(image_data: bytes, padding: int = 5) -> bytes:
+    """
+    Crop image to content (remove transparent borders).
+    Returns PNG.
+    """
+    img = Image.open(io.BytesIO(image_data)).convert("RGBA")
+
+    # Get bounding box of non-transparent pixels
+    bbox = img.getbbox()
+    if bbox:
+        # Add padding
+        left = max(0, bbox[0] - padding)
+        top = max(0, bbox[1] - padding)
+        right = min(img.width, bbox[2] + padding)
+        bottom = min(img.height, bbox[3] + padding)
+        img = img.crop((left, top, right, bottom))
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def process_gem_image(image_data: bytes, max_size: int = 400, tolerance: int = 30,
+                      feather: int = 0, flood_fill: bool = False) -> bytes:
+    """
+    Process gem image: remove background, crop to content, resize.
+    Returns PNG with transparent background.
+    """
+    # Remove background
+    no_bg = remove_background(image_data, tolerance, feather=feather, flood_fill=flood_fill)
+
+    # Crop to content
+    cropped = crop_to_content(no_bg)
+
+    # Resize
+    resized, _ = resize_image(cropped, max_size=max_size, format="PNG")
+
+    return resized
+
+
+def avif_supported() -> bool:
+    return "AVIF" in Image.SAVE
+
+
+def avif_decodable() -> bool:
+    return "AVIF" in Image.OPEN
+
+
+def _target_size(width: int, height: int, max_size: int) -> tuple:
+    """Same rounding as resize_image: long side = max_size, aspect kept."""
+    if max(width, height) <= max_size:
+        return width, height
+    if width > height:
+        return max_size, max(1, int(height * (max_size / width)))
+    return max(1, int(width * (max_size / height))), max_size
+
+
+def _downscale(img: Image.Image, max_size: int) -> Image.Image:
+    target = _target_size(img.width, img.height, max_size)
+    if target == img.size:
+        return img
+    # Cheap integer box reduction first, keeping >= 2x the target for LANCZOS quality
+    factor = min(img.width // (target[0] * 2), img.height // (target[1] * 2))
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img.resize(target, Image.Resampling.LANCZOS)
+
+
+def _encode(img: Image.Image, format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if format == "WEBP":
+        img.save(buffer, format="WEBP", quality=quality, lossless=False)
+    elif format == "AVIF":
+        img.save(buffer, format="AVIF", quality=quality)
+    elif format == "JPEG":
+        # JPEG doesn't support transparency, flatten onto white
+        if img.mode == 'RGBA':
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])
+            img = background
+        img.save(buffer, format="JPEG", quality=quality)
+    else:
+        img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_variants(image_data: bytes, variants: list) -> list:
+    """
+    Decode once and encode several sizes/formats in one pass.
+
+    variants: [{"name": "full", "max_size": 1024, "format": "WEBP", "quality": 85}, ...]
+    format "LQIP" produces a tiny WebP data URI instead of file bytes.
+
+    Returns one dict per variant: {"name", "format", "data", "content_type",
+    "ext", "width", "height", "bytes"} ("data_uri" for LQIP). Variants whose
+    encoder is unavailable (AVIF without a plugin) get {"name", "skipped"}.
+    """
+    img = Image.open(io.BytesIO(image_data))
+    largest = max((v.get("max_size") or LQIP_SIZE) for v in variants)
+    if img.format == "JPEG":
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that still covers the largest variant
+        img.draft("RGB", (largest, largest))
+
+    # Preserve RGBA mode for transparency support
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    elif img.mode not in ('RGBA', 'RGB'):
+        img = img.convert('RGBA')
+    img.load()
+
+    results = []
+    # Largest first, so each variant can be derived from the previous one
+    source = img
+    for variant in sorted(variants, key=lambda v: -(v.get("max_size") or LQIP_SIZE)):
+        name = variant["name"]
+        format = variant.get("format", "WEBP").upper()
+
+        if format == "LQIP":
+            preview = _downscale(source, variant.get("max_size") or LQIP_SIZE)
+            data = _encode(preview, "WEBP", variant.get("quality", LQIP_QUALITY))
+            results.append({
+                "name": name,
+                "format": format,
+                "data_uri": "data:image/webp;base64," + base64.b64encode(data).decode("ascii"),
+                "width": preview.width,
+                "height": preview.height,
+                "bytes": len(data),
+            })
+            continue
+
+        if format == "AVIF" and not avif_supported():
+            results.append({"name": name, "skipped": "AVIF encoder not available"})
+            continue
+        if format not in VARIANT_FORMATS:
+            raise ValueError(f"Unsupported variant format: {format}")
+
+        scaled = _downscale(source, variant["max_size"])
+        source = scaled
+        data = _encode(scaled, format, variant.get("quality", 85))
+        content_type, ext = VARIANT_FORMATS[format]
+        results.append({
+            "name": name,
+            "format": format,
+            "data": data,
+            "content_type": content_type,
+            "ext": ext,
+            "width": scaled.width,
+            "height": scaled.height,
+            "bytes": len(data),
+        })
+
+    order = {v["name"]: i for i, v in enumerate(variants)}
+    return sorted(results, key=lambda r: order[r["name"]])
+
+
+def normalize_image(image_data: bytes, max_size: int, format: str = "WEBP", quality: int = 90) -> tuple:
+    """
+    Prepare a user photo for a model: apply EXIF orientation, downscale to
+    `max_size` on the long side and re-encode. Returns (bytes, content_type).
+    """
+    img = Image.open(io.BytesIO(image_data))
+    if img.format == "JPEG":
+        img.draft("RGB", (max_size, max_size))
+    img = ImageOps.exif_transpose(img)
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    elif img.mode not in ('RGBA', 'RGB'):
+        img = img.convert('RGBA')
+
+    format = format.upper()
+    data = _encode(_downscale(img, max_size), format, quality)
+    return data, VARIANT_FORMATS[format][0]
@@ -1,12 +1,36 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api import router
+from api import router, run_generation_job
+from supabase_client import supabase
+from generation_jobs import job_queue
+from fal_queue import fal_queue
+from image_engine import image_engine
+from app_logger import logger
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI(title="OLAI.art Jewelry API", version="2.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Own process-wide resources: open pools on startup, close them on shutdown."""
+    await supabase.start()
+    await logger.start()
+    image_engine.start()
+    await job_queue.start(run_generation_job)
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+        await fal_queue.close()
+        image_engine.stop()
+        await logger.stop()
+        await supabase.close()
+
+
+app = FastAPI(title="OLAI.art Jewelry API", version="2.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
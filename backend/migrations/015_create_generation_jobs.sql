@@ -0,0 +1,20 @@
+-- Migration 015: Background generation jobs
+-- Used when GENERATION_JOB_STORE=supabase so job status is visible to every worker.
+-- The request payload (input image) is never stored here.
+
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id UUID PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',  -- queued, running, completed, failed
+    stage VARCHAR(50),                             -- last finished pipeline stage
+    events JSONB DEFAULT '[]'::jsonb,              -- [{seq, stage, at, data}]
+    result JSONB,                                  -- same shape as POST /api/generate response
+    error TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_created_at ON generation_jobs(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_status ON generation_jobs(status) WHERE status IN ('queued', 'running');
+
+-- Cleanup: finished jobs are only useful for a few hours
+-- DELETE FROM generation_jobs WHERE created_at < NOW() - INTERVAL '1 day';
@@ -0,0 +1,10 @@
+-- Migration 016: Content-addressed generation cache
+-- cache_key = sha256(input image bytes + prompt + model + request params), set by POST /api/generate.
+-- Requests with cachePolicy='reuse' return the latest matching generation instead of calling FAL.
+
+ALTER TABLE pendant_generations ADD COLUMN IF NOT EXISTS cache_key VARCHAR(64);
+ALTER TABLE pendant_generations ADD COLUMN IF NOT EXISTS output_thumbnails JSONB;
+
+CREATE INDEX IF NOT EXISTS idx_pendant_generations_cache_key
+    ON pendant_generations(cache_key, created_at DESC)
+    WHERE cache_key IS NOT NULL;
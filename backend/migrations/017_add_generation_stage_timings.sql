@@ -0,0 +1,9 @@
+-- Migration 017: Per-stage timing breakdown for generations
+-- Written by run_generation, aggregated by GET /api/admin/generations/timings.
+-- Shape: {"total_ms": int, "stages": {stage: ms}, "images": [{"index", "bg_removal", "download", "resize", "upload", "wait", "total"}]}
+
+ALTER TABLE pendant_generations ADD COLUMN IF NOT EXISTS stage_timings JSONB;
+
+CREATE INDEX IF NOT EXISTS idx_pendant_generations_timings_created_at
+    ON pendant_generations(created_at DESC)
+    WHERE stage_timings IS NOT NULL;
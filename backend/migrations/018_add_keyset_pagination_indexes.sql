@@ -0,0 +1,15 @@
+-- Migration 018: Indexes for keyset (cursor) pagination
+-- List endpoints page with ORDER BY created_at DESC, id DESC and
+-- WHERE (created_at, id) < (cursor). Including id lets the index serve the
+-- tie-breaker too, instead of sorting equal timestamps after the scan.
+
+CREATE INDEX IF NOT EXISTS idx_applications_created_at_id ON applications(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_applications_status_created_at_id ON applications(status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_pendant_generations_created_at_id ON pendant_generations(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_payments_created_at_id ON payments(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_app_logs_created_at_id ON app_logs(created_at DESC, id DESC);
+
+ANALYZE applications;
+ANALYZE pendant_generations;
+ANALYZE payments;
+ANALYZE app_logs;
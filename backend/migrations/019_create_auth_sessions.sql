@@ -0,0 +1,27 @@
+-- Migration 019: Session store for production workspace auth
+-- Only a SHA-256 of the session token is stored; lookups go through the
+-- unique index instead of scanning users. Expired rows are ignored by the
+-- lookup and can be purged at any time.
+
+CREATE TABLE IF NOT EXISTS auth_sessions (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    token_hash CHAR(64) NOT NULL,       -- hex sha256 of the bearer token
+    kind VARCHAR(20) NOT NULL,          -- production
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    email TEXT NOT NULL,
+    name TEXT,
+    expires_at TIMESTAMPTZ NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_auth_sessions_token_hash ON auth_sessions(token_hash);
+CREATE INDEX IF NOT EXISTS idx_auth_sessions_user_kind ON auth_sessions(user_id, kind);
+CREATE INDEX IF NOT EXISTS idx_auth_sessions_expires_at ON auth_sessions(expires_at);
+
+-- Sessions issued before this migration live in users.production_session_token
+-- until they expire; index it so the fallback lookup is not a scan either.
+CREATE INDEX IF NOT EXISTS idx_users_production_session_token
+    ON users(production_session_token) WHERE production_session_token IS NOT NULL;
+
+-- Cleanup
+-- DELETE FROM auth_sessions WHERE expires_at < NOW();
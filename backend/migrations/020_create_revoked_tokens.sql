@@ -0,0 +1,15 @@
+-- Migration 020: Revocation list for signed session tokens (signed_tokens.py)
+-- Signed tokens are verified without the database; logout adds the token id
+-- here and sensitive writes check this list. Rows are only needed until the
+-- token would have expired anyway.
+
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti TEXT PRIMARY KEY,
+    expires_at TIMESTAMPTZ NOT NULL,
+    revoked_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens(expires_at);
+
+-- Cleanup
+-- DELETE FROM revoked_tokens WHERE expires_at < NOW();
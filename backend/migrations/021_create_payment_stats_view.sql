@@ -0,0 +1,13 @@
+-- Migration 021: Payment totals aggregated in the database
+-- GET /api/admin/payments reads this view (a handful of rows, one per status)
+-- instead of downloading every payment to sum amounts in Python.
+
+CREATE OR REPLACE VIEW payment_stats_by_status AS
+SELECT
+    status,
+    COUNT(*)::BIGINT AS payment_count,
+    COALESCE(SUM(amount), 0)::BIGINT AS total_amount
+FROM payments
+GROUP BY status;
+
+GRANT SELECT ON payment_stats_by_status TO service_role;
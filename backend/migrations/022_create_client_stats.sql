@@ -0,0 +1,124 @@
+-- Migration 022: Per-client aggregates for GET /api/admin/clients
+-- One row per user with order/payment totals, kept current by triggers on
+-- users, applications and payments. A change only recomputes the affected
+-- user's row (their own applications/payments), so writes stay cheap and the
+-- admin list is a plain indexed, paginated read at any table size.
+
+CREATE TABLE IF NOT EXISTS client_stats (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    email TEXT,
+    name TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    telegram_username TEXT,
+    is_admin BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMPTZ,                 -- users.created_at
+    orders_count INTEGER NOT NULL DEFAULT 0,
+    paid_count INTEGER NOT NULL DEFAULT 0,   -- CONFIRMED / AUTHORIZED payments
+    total_spent BIGINT NOT NULL DEFAULT 0,   -- rubles, paid payments only
+    last_order_at TIMESTAMPTZ,
+    -- Users with no orders and no name are hidden from the list
+    listed BOOLEAN GENERATED ALWAYS AS (orders_count > 0 OR COALESCE(name, '') <> '') STORED,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_client_stats_created_at ON client_stats(created_at DESC, user_id DESC) WHERE listed;
+CREATE INDEX IF NOT EXISTS idx_client_stats_total_spent ON client_stats(total_spent DESC, user_id DESC) WHERE listed;
+CREATE INDEX IF NOT EXISTS idx_client_stats_orders_count ON client_stats(orders_count DESC, user_id DESC) WHERE listed;
+CREATE INDEX IF NOT EXISTS idx_client_stats_last_order_at ON client_stats(last_order_at DESC NULLS LAST, user_id DESC) WHERE listed;
+
+-- Recompute one user's row
+CREATE OR REPLACE FUNCTION refresh_client_stats(p_user_id UUID) RETURNS VOID AS $$
+BEGIN
+    IF p_user_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO client_stats (
+        user_id, email, name, first_name, last_name, telegram_username, is_admin, created_at,
+        orders_count, paid_count, total_spent, last_order_at, updated_at
+    )
+    SELECT
+        u.id, u.email, u.name, u.first_name, u.last_name, u.telegram_username, COALESCE(u.is_admin, FALSE), u.created_at,
+        COALESCE(a.orders_count, 0), COALESCE(p.paid_count, 0), COALESCE(p.total_spent, 0), a.last_order_at, NOW()
+    FROM users u
+    LEFT JOIN LATERAL (
+        SELECT COUNT(*)::INTEGER AS orders_count, MAX(created_at) AS last_order_at
+        FROM applications WHERE user_id = u.id
+    ) a ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT COUNT(*)::INTEGER AS paid_count, COALESCE(SUM(pay.amount), 0)::BIGINT AS total_spent
+        FROM payments pay
+        JOIN applications app ON app.id = pay.application_id
+        WHERE app.user_id = u.id AND pay.status IN ('CONFIRMED', 'AUTHORIZED')
+    ) p ON TRUE
+    WHERE u.id = p_user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        email = EXCLUDED.email,
+        name = EXCLUDED.name,
+        first_name = EXCLUDED.first_name,
+        last_name = EXCLUDED.last_name,
+        telegram_username = EXCLUDED.telegram_username,
+        is_admin = EXCLUDED.is_admin,
+        created_at = EXCLUDED.created_at,
+        orders_count = EXCLUDED.orders_count,
+        paid_count = EXCLUDED.paid_count,
+        total_spent = EXCLUDED.total_spent,
+        last_order_at = EXCLUDED.last_order_at,
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+-- users: profile fields
+CREATE OR REPLACE FUNCTION client_stats_on_user() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_client_stats(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_client_stats_users ON users;
+CREATE TRIGGER trg_client_stats_users
+    AFTER INSERT OR UPDATE OF email, name, first_name, last_name, telegram_username, is_admin ON users
+    FOR EACH ROW EXECUTE FUNCTION client_stats_on_user();
+
+-- applications: order count / last order (old and new owner on reassignment)
+CREATE OR REPLACE FUNCTION client_stats_on_application() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM refresh_client_stats(NEW.user_id);
+    END IF;
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.user_id IS DISTINCT FROM NEW.user_id) THEN
+        PERFORM refresh_client_stats(OLD.user_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_client_stats_applications ON applications;
+CREATE TRIGGER trg_client_stats_applications
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, created_at ON applications
+    FOR EACH ROW EXECUTE FUNCTION client_stats_on_application();
+
+-- payments: paid count / total spent of the application's owner
+CREATE OR REPLACE FUNCTION client_stats_on_payment() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM refresh_client_stats((SELECT user_id FROM applications WHERE id = NEW.application_id));
+    END IF;
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.application_id IS DISTINCT FROM NEW.application_id) THEN
+        PERFORM refresh_client_stats((SELECT user_id FROM applications WHERE id = OLD.application_id));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_client_stats_payments ON payments;
+CREATE TRIGGER trg_client_stats_payments
+    AFTER INSERT OR DELETE OR UPDATE OF status, amount, application_id ON payments
+    FOR EACH ROW EXECUTE FUNCTION client_stats_on_payment();
+
+-- Backfill
+SELECT refresh_client_stats(id) FROM users;
+
+ANALYZE client_stats;
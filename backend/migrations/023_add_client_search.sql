@@ -0,0 +1,50 @@
+-- Migration 023: Indexed client search for GET /api/admin/clients/search
+-- Trigram GIN index over the searchable user fields, queried through the
+-- search_clients RPC: ranked prefix matches first, then substring and fuzzy
+-- (trigram similarity) matches, with the limit applied in the database.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- One lower-cased document per user; the function is IMMUTABLE so it can be indexed
+CREATE OR REPLACE FUNCTION client_search_document(
+    p_email TEXT, p_name TEXT, p_first_name TEXT, p_last_name TEXT, p_telegram TEXT
+) RETURNS TEXT AS $$
+    SELECT lower(concat_ws(' ', p_email, p_name, p_first_name, p_last_name, p_telegram));
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE INDEX IF NOT EXISTS idx_users_search_trgm ON users
+    USING GIN (client_search_document(email, name, first_name, last_name, telegram_username) gin_trgm_ops);
+
+CREATE OR REPLACE FUNCTION search_clients(q TEXT, max_results INTEGER DEFAULT 10)
+RETURNS TABLE (
+    id UUID,
+    email TEXT,
+    name TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    telegram_username TEXT,
+    score REAL
+) AS $$
+    WITH query AS (
+        SELECT lower(trim(q)) AS term
+    )
+    SELECT u.id, u.email, u.name, u.first_name, u.last_name, u.telegram_username,
+        (
+            CASE WHEN lower(u.email) LIKE query.term || '%'
+                   OR lower(COALESCE(u.name, '')) LIKE query.term || '%'
+                   OR lower(COALESCE(u.first_name, '')) LIKE query.term || '%'
+                   OR lower(COALESCE(u.last_name, '')) LIKE query.term || '%'
+                   OR lower(COALESCE(u.telegram_username, '')) LIKE query.term || '%'
+                 THEN 1.0 ELSE 0.0 END
+            + word_similarity(query.term, client_search_document(u.email, u.name, u.first_name, u.last_name, u.telegram_username))
+        )::REAL AS score
+    FROM users u, query
+    WHERE client_search_document(u.email, u.name, u.first_name, u.last_name, u.telegram_username) LIKE '%' || query.term || '%'
+       OR query.term <% client_search_document(u.email, u.name, u.first_name, u.last_name, u.telegram_username)
+    ORDER BY score DESC, u.created_at DESC
+    LIMIT LEAST(GREATEST(max_results, 1), 50);
+$$ LANGUAGE sql STABLE;
+
+GRANT EXECUTE ON FUNCTION search_clients(TEXT, INTEGER) TO service_role;
+
+ANALYZE users;
@@ -0,0 +1,30 @@
+-- Migration 024: Foreign keys for PostgREST resource embedding
+-- PostgREST only embeds related tables (select=*,pendant_generations(...),
+-- users(email,name)) along foreign keys. These relations existed only by
+-- convention. NOT VALID skips checking existing rows, so the constraint is
+-- added instantly even if old rows point at deleted records; new writes are
+-- still checked. Run VALIDATE CONSTRAINT later once orphans are cleaned up.
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'pendant_generations_application_id_fkey') THEN
+        ALTER TABLE pendant_generations
+            ADD CONSTRAINT pendant_generations_application_id_fkey
+            FOREIGN KEY (application_id) REFERENCES applications(id) ON DELETE SET NULL NOT VALID;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'applications_user_id_fkey') THEN
+        ALTER TABLE applications
+            ADD CONSTRAINT applications_user_id_fkey
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL NOT VALID;
+    END IF;
+END $$;
+
+-- Let PostgREST pick up the new relationships
+NOTIFY pgrst, 'reload schema';
+
+-- Later, after cleaning up orphans:
+-- UPDATE pendant_generations g SET application_id = NULL
+--     WHERE application_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM applications a WHERE a.id = g.application_id);
+-- ALTER TABLE pendant_generations VALIDATE CONSTRAINT pendant_generations_application_id_fkey;
+-- ALTER TABLE applications VALIDATE CONSTRAINT applications_user_id_fkey;
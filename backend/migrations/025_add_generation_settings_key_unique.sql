@@ -0,0 +1,34 @@
+-- Migration 025: Unique settings keys for bulk upserts
+-- POST /api/settings writes all changed keys with one
+-- POST generation_settings?on_conflict=key (resolution=merge-duplicates),
+-- which needs a unique index on key. Of any duplicated key, keep the most
+-- recently written row: latest updated_at, then created_at, then highest id
+-- (whichever of these columns the table has; with none of them an arbitrary
+-- duplicate is kept).
+
+DO $$
+DECLARE
+    keep_order TEXT;
+BEGIN
+    SELECT string_agg(format('%I DESC NULLS LAST', column_name),
+                      ', ' ORDER BY array_position(ARRAY['updated_at', 'created_at', 'id'], column_name::TEXT))
+    INTO keep_order
+    FROM information_schema.columns
+    WHERE table_schema = current_schema()
+      AND table_name = 'generation_settings'
+      AND column_name IN ('updated_at', 'created_at', 'id');
+
+    EXECUTE format(
+        'DELETE FROM generation_settings
+         WHERE ctid IN (
+             SELECT ctid FROM (
+                 SELECT ctid, ROW_NUMBER() OVER (PARTITION BY key ORDER BY %s) AS rn
+                 FROM generation_settings
+             ) ranked
+             WHERE rn > 1
+         )',
+        COALESCE(keep_order, 'ctid')
+    );
+END $$;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_generation_settings_key ON generation_settings(key);
@@ -0,0 +1,81 @@
+"""
+Keyset (cursor) pagination on (created_at, id).
+
+Offset pages make Postgres walk and discard every skipped row, so page N
+costs O(N). Keyset pages start right after the last row of the previous
+page and use the created_at DESC indexes (011_add_performance_indexes.sql),
+so every page costs the same. `id` breaks ties between equal timestamps.
+
+Usage:
+    from pagination import KEYSET_ORDER, keyset_filter, next_page
+
+    rows = await supabase.select(table, filters=join_filters(base, keyset_filter(cursor)),
+                                 order=KEYSET_ORDER, limit=limit + 1)
+    rows, next_cursor = next_page(rows, limit)
+
+Cursors are opaque to clients: base64url of [created_at, id].
+Totals are optional: count=exact|planned|estimated|none (see SupabaseClient.count).
+"""
+
+import base64
+import json
+from typing import Optional
+from urllib.parse import quote
+
+from fastapi import HTTPException
+
+KEYSET_ORDER = "created_at.desc,id.desc"
+COUNT_MODES = ("exact", "planned", "estimated", "none")
+
+
+def encode_cursor(row: dict) -> str:
+    payload = json.dumps([row["created_at"], str(row["id"])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """(created_at, id) from a cursor; 400 if it was tampered with."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(created_at, str) or not isinstance(row_id, str):
+            raise ValueError("bad cursor payload")
+        return created_at, row_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _quoted(value: str) -> str:
+    # Double quotes keep ':' ',' '.' literal inside or=(...); percent-encoding keeps '+' in the timezone
+    return quote(f'"{value}"', safe="")
+
+
+def keyset_filter(cursor: Optional[str]) -> Optional[str]:
+    """PostgREST filter selecting rows after the cursor in KEYSET_ORDER."""
+    if not cursor:
+        return None
+    created_at, row_id = decode_cursor(cursor)
+    ts, rid = _quoted(created_at), _quoted(row_id)
+    return f"or=(created_at.lt.{ts},and(created_at.eq.{ts},id.lt.{rid}))"
+
+
+def join_filters(*parts: Optional[str]) -> Optional[str]:
+    filters = "&".join(p for p in parts if p)
+    return filters or None
+
+
+def next_page(rows: list, limit: int) -> tuple:
+    """Trim a `limit + 1` fetch to `limit` rows; returns (rows, next_cursor or None)."""
+    rows = rows or []
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1])
+
+
+def count_mode(count: Optional[str]) -> str:
+    """Validate the `count` query parameter."""
+    mode = (count or "exact").lower()
+    if mode not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"count must be one of: {', '.join(COUNT_MODES)}")
+    return mode
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the generation pipeline.
+
+Drives POST /api/generate/stream at a fixed concurrency and records when
+each pipeline stage event arrives, then reports p50/p95/p99 per stage and
+overall requests per second. Run it against a backend pointed at the
+local FAL stand-in so no credits are spent:
+
+    python scripts/fake_fal_server.py --port 8090 --workers 8 --run-seconds 5 --run-jitter 2
+    FAL_QUEUE_BASE_URL=http://127.0.0.1:8090 FAL_KEY=fake uvicorn main:app --port 8000
+    python scripts/benchmark_generation.py --requests 50 --concurrency 10
+
+Stage times are deltas between consecutive stage events of one request
+(e.g. "generated" = FAL queue + run time, "uploaded" = bg removal +
+storage uploads for all images); "total" is the full request.
+
+Usage:
+    python scripts/benchmark_generation.py [--url URL] [--requests N] [--concurrency C]
+                                           [--image PATH] [--prompt TEXT] [--json]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import mimetypes
+import time
+from typing import Optional
+
+import httpx
+
+# Order in which run_generation emits stage events
+STAGES = ["prompt_ready", "cache_hit", "submitted", "generated", "first_image", "uploaded", "saved", "result"]
+
+# 1x1 PNG used when no --image is given
+DEFAULT_IMAGE = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg=="
+
+
+def percentile(values: list, pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def load_image(path: Optional[str]) -> str:
+    if not path:
+        return DEFAULT_IMAGE
+    mime = mimetypes.guess_type(path)[0] or "image/png"
+    with open(path, "rb") as f:
+        return f"data:{mime};base64,{base64.b64encode(f.read()).decode()}"
+
+
+async def run_one(client: httpx.AsyncClient, url: str, body: dict) -> dict:
+    """Run one streamed generation and return stage arrival times (seconds since start)."""
+    started = time.perf_counter()
+    marks: dict = {}
+    error = None
+    try:
+        async with client.stream("POST", f"{url}/api/generate/stream", params={"format": "ndjson"}, json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                now = time.perf_counter() - started
+                kind = event.get("type")
+                if kind == "stage":
+                    marks.setdefault(event.get("stage"), now)
+                elif kind == "image":
+                    marks.setdefault("first_image", now)
+                elif kind == "result":
+                    marks["result"] = now
+                elif kind == "error":
+                    error = event.get("detail") or "error"
+    except Exception as e:
+        error = str(e)
+
+    if "result" not in marks and error is None:
+        error = "stream ended without result"
+    return {"marks": marks, "total": time.perf_counter() - started, "error": error}
+
+
+def stage_durations(marks: dict) -> dict:
+    """Convert arrival times into per-stage deltas."""
+    durations = {}
+    previous = 0.0
+    for stage in STAGES:
+        if stage in marks:
+            durations[stage] = marks[stage] - previous
+            previous = marks[stage]
+    return durations
+
+
+async def run_benchmark(args) -> dict:
+    body = {
+        "imageBase64": load_image(args.image),
+        "prompt": args.prompt,
+        "formFactor": "round",
+        "size": "pendant",
+        "material": "silver",
+        "sessionId": f"benchmark_{int(time.time())}",
+        "theme": "main",
+        "cachePolicy": "off",
+    }
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def worker(client: httpx.AsyncClient):
+        async with semaphore:
+            results.append(await run_one(client, args.url, body))
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.requests)))
+        wall = time.perf_counter() - started
+
+    ok = [r for r in results if r["error"] is None]
+    per_stage: dict = {stage: [] for stage in STAGES}
+    for r in ok:
+        for stage, seconds in stage_durations(r["marks"]).items():
+            per_stage[stage].append(seconds)
+    per_stage["total"] = [r["total"] for r in ok]
+
+    errors: dict = {}
+    for r in results:
+        if r["error"] is not None:
+            errors[r["error"][:120]] = errors.get(r["error"][:120], 0) + 1
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_seconds": round(wall, 3),
+        "rps": round(len(ok) / wall, 3) if wall else 0,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+            for stage, values in per_stage.items() if values
+        },
+        "errors": errors,
+    }
+
+
+def print_report(report: dict):
+    print(f"\nRequests: {report['requests']}  concurrency: {report['concurrency']}  "
+          f"ok: {report['succeeded']}  failed: {report['failed']}")
+    print(f"Wall time: {report['wall_seconds']}s  throughput: {report['rps']} req/s\n")
+    print(f"{'stage':<14}{'count':>7}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}")
+    for stage, row in report["stages"].items():
+        print(f"{stage:<14}{row['count']:>7}{row['p50']:>10.3f}{row['p95']:>10.3f}{row['p99']:>10.3f}")
+    if report["errors"]:
+        print("\nErrors:")
+        for message, count in report["errors"].items():
+            print(f"  {count:>4} x {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /api/generate/stream")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Backend base URL")
+    parser.add_argument("--requests", type=int, default=20, help="Total generations to run")
+    parser.add_argument("--concurrency", type=int, default=4, help="Generations in flight at once")
+    parser.add_argument("--image", help="Input image file (default: 1x1 PNG)")
+    parser.add_argument("--prompt", default="Benchmark generation")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout in seconds")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark remove_background (image_processing.py): NumPy implementation vs the
+per-pixel fallback, on synthetic gem photos (light background, dark gem
+with a light highlight inside).
+
+Usage:
+    python scripts/benchmark_remove_background.py [--sizes 400 1000 2000 4000] [--legacy-max 2000] [--repeat 3]
+
+The per-pixel loop is only timed up to --legacy-max px (it takes minutes at 4000 px).
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_processing
+from image_processing import np
+
+
+def make_gem_photo(size: int) -> bytes:
+    img = Image.new("RGB", (size, size), (236, 236, 232))
+    draw = ImageDraw.Draw(img)
+    margin = size // 5
+    draw.ellipse((margin, margin, size - margin, size - margin), fill=(40, 60, 140))
+    # Light highlight inside the gem - flood fill mode must keep it
+    h = size // 10
+    draw.ellipse((size // 2 - h, size // 2 - h, size // 2 + h, size // 2 + h), fill=(238, 238, 235))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def best_of(repeat: int, fn) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def transparent_share(png: bytes) -> float:
+    alpha = Image.open(io.BytesIO(png)).getchannel("A")
+    hist = alpha.histogram()
+    return hist[0] / sum(hist)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark remove_background")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[400, 1000, 2000, 4000])
+    parser.add_argument("--legacy-max", type=int, default=2000, help="Largest size to time the per-pixel loop on")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if np is None:
+        print("NumPy is not installed - nothing to compare")
+        return
+
+    print(f"{'size':>6}{'per-pixel s':>13}{'numpy s':>10}{'flood s':>10}{'feather s':>11}{'speedup':>9}{'identical':>11}{'kept highlight':>16}")
+    for size in args.sizes:
+        data = make_gem_photo(size)
+        vectorized = best_of(args.repeat, lambda: image_processing.remove_background(data))
+        flood = best_of(args.repeat, lambda: image_processing.remove_background(data, flood_fill=True))
+        feather = best_of(args.repeat, lambda: image_processing.remove_background(data, feather=12, flood_fill=True))
+
+        legacy = None
+        matches = "-"
+        if size <= args.legacy_max:
+            legacy_png = []
+            legacy = best_of(1, lambda: legacy_png.append(
+                image_processing._remove_background_pixels(Image.open(io.BytesIO(data)).convert("RGBA"))
+            ))
+            # Hard-tolerance output must be pixel-identical to the original loop
+            matches = str(np.array_equal(
+                np.array(Image.open(io.BytesIO(legacy_png[0]))),
+                np.array(Image.open(io.BytesIO(image_processing.remove_background(data)))),
+            ))
+
+        kept = transparent_share(image_processing.remove_background(data, flood_fill=True)) < transparent_share(
+            image_processing.remove_background(data)
+        )
+        legacy_text = f"{legacy:>13.3f}" if legacy is not None else f"{'-':>13}"
+        speedup = f"{legacy / vectorized:>8.0f}x" if legacy is not None else f"{'-':>9}"
+        print(f"{size:>6}{legacy_text}{vectorized:>10.3f}{flood:>10.3f}{feather:>11.3f}{speedup}{matches:>11}{str(kept):>16}")
+
+
+if __name__ == "__main__":
+    main()
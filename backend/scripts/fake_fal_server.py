@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the FAL.ai queue API.
+
+Implements the submit / status / response protocol used by fal_queue.py
+(MODEL_CONFIGS models and birefnet), including queue positions and
+webhook callbacks, so generation can be exercised and load-tested
+without a FAL key or spending credits.
+
+Simulated behaviour (all configurable, also at runtime via POST /_config):
+- worker pool: only `workers` requests run at once, the rest queue up
+- latency: submit latency, and run time = run_seconds +/- run_jitter
+  (birefnet uses bg_run_seconds)
+- failures: failure_rate of requests end as FAILED, submit_error_rate
+  of submits get HTTP 500/429
+- output: PNG images of image_size (e.g. 1024 or 1024x1536), random
+  noise by default so download/upload sizes are realistic
+
+Usage:
+    python scripts/fake_fal_server.py --port 8090 --workers 4 --run-seconds 6 --run-jitter 2
+
+    FAL_QUEUE_BASE_URL=http://127.0.0.1:8090 FAL_KEY=fake uvicorn main:app
+
+    curl http://127.0.0.1:8090/_stats
+    curl -X POST http://127.0.0.1:8090/_config -d '{"failure_rate": 0.1}'
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import random
+import time
+import uuid
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
+from PIL import Image
+
+app = FastAPI(title="Fake FAL queue")
+
+config = {
+    "workers": 2,
+    "run_seconds": 3.0,
+    "run_jitter": 0.0,
+    "bg_run_seconds": 1.0,
+    "submit_latency": 0.05,
+    "failure_rate": 0.0,
+    "submit_error_rate": 0.0,
+    "image_size": "1024",
+    "image_content": "noise",  # noise | flat
+}
+
+# request_id -> {"model", "status", "payload", "result", "submitted_at", ...}
+requests_by_id: dict = {}
+# request ids waiting for a worker, in submit order
+pending: list = []
+counters = {"submitted": 0, "completed": 0, "failed": 0, "submit_errors": 0, "status_polls": 0, "webhooks": 0}
+_workers_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _semaphore() -> asyncio.Semaphore:
+    global _workers_semaphore
+    if _workers_semaphore is None:
+        _workers_semaphore = asyncio.Semaphore(config["workers"])
+    return _workers_semaphore
+
+
+def _parse_size(value) -> Tuple[int, int]:
+    text = str(value).lower()
+    if "x" in text:
+        width, height = text.split("x", 1)
+        return int(width), int(height)
+    return int(text), int(text)
+
+
+@lru_cache(maxsize=8)
+def _image_bytes(width: int, height: int, content: str) -> bytes:
+    if content == "noise":
+        image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    else:
+        image = Image.new("RGB", (width, height), (200, 170, 90))
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _is_birefnet(model: str) -> bool:
+    return model.endswith("birefnet")
+
+
+def _model_result(base_url: str, model: str, request_id: str, payload: dict) -> dict:
+    width, height = _parse_size(config["image_size"])
+    if _is_birefnet(model):
+        return {"image": {"url": f"{base_url}/files/{request_id}_0.png", "width": width, "height": height}}
+    count = int(payload.get("num_images") or 1)
+    return {
+        "images": [
+            {"url": f"{base_url}/files/{request_id}_{i}.png", "width": width, "height": height}
+            for i in range(count)
+        ],
+        "seed": random.randint(0, 2 ** 31),
+    }
+
+
+def _run_seconds(model: str) -> float:
+    if _is_birefnet(model):
+        return config["bg_run_seconds"]
+    jitter = config["run_jitter"]
+    return max(0.0, config["run_seconds"] + random.uniform(-jitter, jitter))
+
+
+async def _run(request_id: str, base_url: str, webhook: Optional[str]):
+    job = requests_by_id[request_id]
+    async with _semaphore():
+        pending.remove(request_id)
+        job["status"] = "IN_PROGRESS"
+        job["started_at"] = time.time()
+        await asyncio.sleep(_run_seconds(job["model"]))
+        if random.random() < config["failure_rate"]:
+            job["status"] = "FAILED"
+            job["error"] = "Simulated failure"
+            counters["failed"] += 1
+        else:
+            job["result"] = _model_result(base_url, job["model"], request_id, job["payload"])
+            job["status"] = "COMPLETED"
+            counters["completed"] += 1
+        job["completed_at"] = time.time()
+
+    if webhook:
+        body = {"request_id": request_id, "gateway_request_id": request_id}
+        if job["status"] == "COMPLETED":
+            body.update(status="OK", payload=job["result"])
+        else:
+            body.update(status="ERROR", error=job["error"], payload=None)
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                await client.post(webhook, json=body)
+            counters["webhooks"] += 1
+        except Exception as e:
+            print(f"Webhook delivery failed for {request_id}: {e}")
+
+
+def _get_job(request_id: str) -> dict:
+    job = requests_by_id.get(request_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Request not found")
+    return job
+
+
+@app.get("/_stats")
+async def get_stats():
+    return {
+        **counters,
+        "queued": len(pending),
+        "running": sum(1 for job in requests_by_id.values() if job["status"] == "IN_PROGRESS"),
+        "config": config,
+    }
+
+
+@app.post("/_config")
+async def update_config(request: Request):
+    """Change simulation parameters without restarting (workers applies to new requests)"""
+    global _workers_semaphore
+    updates = await request.json()
+    unknown = set(updates) - set(config)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown keys: {sorted(unknown)}")
+    config.update(updates)
+    if "workers" in updates:
+        _workers_semaphore = None
+    return config
+
+
+@app.get("/files/{name}")
+async def get_file(name: str):
+    width, height = _parse_size(config["image_size"])
+    return Response(_image_bytes(width, height, config["image_content"]), media_type="image/png")
+
+
+@app.get("/{model:path}/requests/{request_id}/status")
+async def get_status(model: str, request_id: str):
+    job = _get_job(request_id)
+    counters["status_polls"] += 1
+    status = {"status": job["status"], "request_id": request_id}
+    if job["status"] == "IN_QUEUE":
+        status["queue_position"] = pending.index(request_id)
+    if job["status"] == "FAILED":
+        status["error"] = job["error"]
+    return status
+
+
+@app.get("/{model:path}/requests/{request_id}")
+async def get_response(model: str, request_id: str):
+    job = _get_job(request_id)
+    if job["status"] == "FAILED":
+        raise HTTPException(status_code=422, detail=job["error"])
+    if job["status"] != "COMPLETED":
+        raise HTTPException(status_code=400, detail="Request is still in progress")
+    return job["result"]
+
+
+@app.post("/{model:path}")
+async def submit(model: str, request: Request, fal_webhook: Optional[str] = None):
+    payload = await request.json()
+    if config["submit_latency"]:
+        await asyncio.sleep(config["submit_latency"])
+    if random.random() < config["submit_error_rate"]:
+        counters["submit_errors"] += 1
+        status_code = random.choice((429, 500))
+        raise HTTPException(status_code=status_code, detail="Simulated submit error")
+
+    base_url = str(request.base_url).rstrip("/")
+    request_id = str(uuid.uuid4())
+    requests_by_id[request_id] = {
+        "model": model,
+        "status": "IN_QUEUE",
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "submitted_at": time.time(),
+    }
+    pending.append(request_id)
+    counters["submitted"] += 1
+    asyncio.create_task(_run(request_id, base_url, fal_webhook))
+
+    request_url = f"{base_url}/{model}/requests/{request_id}"
+    return {
+        "request_id": request_id,
+        "status": "IN_QUEUE",
+        "queue_position": pending.index(request_id),
+        "status_url": f"{request_url}/status",
+        "response_url": request_url,
+        "cancel_url": f"{request_url}/cancel",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local FAL.ai queue stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--workers", type=int, default=config["workers"], help="Requests processed in parallel")
+    parser.add_argument("--run-seconds", type=float, default=config["run_seconds"], help="Mean generation time")
+    parser.add_argument("--run-jitter", type=float, default=config["run_jitter"], help="+/- seconds added to run time")
+    parser.add_argument("--bg-run-seconds", type=float, default=config["bg_run_seconds"], help="Background removal time")
+    parser.add_argument("--submit-latency", type=float, default=config["submit_latency"], help="Seconds per submit call")
+    parser.add_argument("--failure-rate", type=float, default=config["failure_rate"], help="Fraction of FAILED requests")
+    parser.add_argument("--submit-error-rate", type=float, default=config["submit_error_rate"],
+                        help="Fraction of submits answered with HTTP 429/500")
+    parser.add_argument("--image-size", default=config["image_size"], help="Output size, e.g. 1024 or 1024x1536")
+    parser.add_argument("--image-content", choices=("noise", "flat"), default=config["image_content"],
+                        help="noise gives realistic PNG sizes, flat gives tiny files")
+    args = parser.parse_args()
+
+    config.update(
+        workers=args.workers,
+        run_seconds=args.run_seconds,
+        run_jitter=args.run_jitter,
+        bg_run_seconds=args.bg_run_seconds,
+        submit_latency=args.submit_latency,
+        failure_rate=args.failure_rate,
+        submit_error_rate=args.submit_error_rate,
+        image_size=args.image_size,
+        image_content=args.image_content,
+    )
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
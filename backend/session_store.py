@@ -0,0 +1,108 @@
+"""
+Session store for production workspace auth (migrations/019_create_auth_sessions.sql).
+
+Tokens are random 256-bit strings handed to the client; only their SHA-256
+is stored, under a unique index, so verifying a token is one indexed
+lookup. Validated sessions are kept in an in-process cache for
+SESSION_CACHE_TTL seconds, so repeated requests from the same browser do
+not hit the database at all. Revocation drops the cache entry on this
+worker; other workers may accept a revoked token for up to the cache TTL.
+Production access is granted and removed directly in the database
+(users.is_production); removing it should also delete the user's
+auth_sessions rows.
+
+Usage:
+    from session_store import session_store
+
+    token, expires_at = await session_store.create("production", user, timedelta(days=7))
+    session = await session_store.verify("production", token)   # dict or None
+    await session_store.revoke(token)
+"""
+
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from supabase_client import supabase
+from ttl_cache import TTLCache
+
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "60"))
+SESSIONS_TABLE = "auth_sessions"
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SessionStore:
+    def __init__(self, cache_ttl: float = SESSION_CACHE_TTL):
+        # token hash -> {"kind", "user_id", "email", "name", "expires_at": datetime}
+        self._cache = TTLCache(ttl=cache_ttl, max_entries=2048)
+
+    async def create(self, kind: str, user: dict, lifetime: timedelta) -> tuple:
+        """Issue a new session for `user`; returns (token, expires_at ISO string)."""
+        token = secrets.token_urlsafe(32)
+        expires_at = _now() + lifetime
+        await supabase.insert(SESSIONS_TABLE, {
+            "token_hash": hash_token(token),
+            "kind": kind,
+            "user_id": user.get("id"),
+            "email": user.get("email"),
+            "name": user.get("name"),
+            "expires_at": expires_at.isoformat(),
+        })
+        return token, expires_at.isoformat()
+
+    async def verify(self, kind: str, token: str) -> Optional[dict]:
+        """Session dict for a valid, unexpired token of this kind, else None."""
+        if not token:
+            return None
+        token_hash = hash_token(token)
+        session = self._cache.get(token_hash)
+        if session is None:
+            rows = await supabase.select(
+                SESSIONS_TABLE,
+                columns="kind,user_id,email,name,expires_at",
+                filters=f"token_hash=eq.{token_hash}",
+                limit=1
+            )
+            if not rows:
+                return None
+            row = rows[0]
+            session = {**row, "expires_at": _parse_time(row.get("expires_at"))}
+            if session["expires_at"] is None:
+                return None
+            # Only validated sessions are cached (unknown tokens always go to the DB)
+            self._cache.set(token_hash, session)
+
+        if session["kind"] != kind or session["expires_at"] <= _now():
+            return None
+        return session
+
+    async def revoke(self, token: str):
+        token_hash = hash_token(token)
+        self._cache.invalidate(token_hash)
+        await supabase.delete_where(SESSIONS_TABLE, f"token_hash=eq.{token_hash}")
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+# Singleton instance
+session_store = SessionStore()
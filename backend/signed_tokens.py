@@ -0,0 +1,145 @@
+"""
+Stateless HMAC-signed session tokens for the admin and production roles.
+
+A token carries its own claims, so checking a session needs no database
+access:
+
+    v1.<kid>.<base64url(json claims)>.<base64url(hmac-sha256)>
+    claims: {"sub": email, "role": "admin" | "production", "iat": ..., "exp": ..., "jti": ..., "name": ...}
+
+Keys come from AUTH_TOKEN_KEYS="kid2:secret2,kid1:secret1". The first key
+signs new tokens; every listed key is accepted, so a key is rotated by
+prepending a new one and dropping the old one after the longest session
+lifetime. With no keys configured, signing is disabled and callers keep
+using database-backed sessions.
+
+Logout puts the token id on a small revocation list (revoked_tokens,
+migrations/020_create_revoked_tokens.sql). The list is consulted by the
+admin session check and by production sensitive writes (is_revoked), and
+is cached for REVOKED_CACHE_TTL seconds, so at most one database read per
+worker per TTL.
+
+Usage:
+    from signed_tokens import signed_tokens
+
+    if signed_tokens.enabled:
+        token, expires_at = signed_tokens.issue("admin", email, timedelta(hours=24))
+    claims = signed_tokens.verify(token, "admin")      # dict or None
+    if await signed_tokens.is_revoked(claims): ...
+    await signed_tokens.revoke(claims)
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from supabase_client import supabase
+from ttl_cache import TTLCache
+
+TOKEN_VERSION = "v1"
+REVOKED_TABLE = "revoked_tokens"
+REVOKED_CACHE_TTL = float(os.getenv("REVOKED_CACHE_TTL", "30"))
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode((data + "=" * (-len(data) % 4)).encode("ascii"))
+
+
+def _parse_keys(raw: str) -> list:
+    """[(kid, secret bytes)] from "kid:secret,kid:secret"; the first key signs."""
+    keys = []
+    for item in raw.split(","):
+        kid, sep, secret = item.strip().partition(":")
+        if sep and kid and secret and "." not in kid:
+            keys.append((kid, secret.encode("utf-8")))
+    return keys
+
+
+def looks_signed(token: Optional[str]) -> bool:
+    return bool(token) and token.startswith(TOKEN_VERSION + ".")
+
+
+class SignedTokens:
+    def __init__(self, raw_keys: str = ""):
+        self.keys = _parse_keys(raw_keys)
+        self._by_kid = dict(self.keys)
+        self._revoked = TTLCache(ttl=REVOKED_CACHE_TTL, max_entries=1)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.keys)
+
+    def _sign(self, secret: bytes, signing_input: str) -> bytes:
+        return hmac.new(secret, signing_input.encode("ascii"), hashlib.sha256).digest()
+
+    def issue(self, role: str, email: str, lifetime: timedelta, name: Optional[str] = None) -> tuple:
+        """Sign a token for `email`; returns (token, expires_at ISO string)."""
+        if not self.enabled:
+            raise RuntimeError("AUTH_TOKEN_KEYS is not configured")
+        kid, secret = self.keys[0]
+        now = int(time.time())
+        exp = now + int(lifetime.total_seconds())
+        claims = {"sub": email, "role": role, "iat": now, "exp": exp, "jti": uuid.uuid4().hex}
+        if name:
+            claims["name"] = name
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        signing_input = f"{TOKEN_VERSION}.{kid}.{payload}"
+        token = f"{signing_input}.{_b64encode(self._sign(secret, signing_input))}"
+        return token, datetime.fromtimestamp(exp, tz=timezone.utc).isoformat()
+
+    def verify(self, token: Optional[str], role: str) -> Optional[dict]:
+        """Claims of a well-signed, unexpired token for `role`, else None. No I/O."""
+        if not looks_signed(token):
+            return None
+        parts = token.split(".")
+        if len(parts) != 4:
+            return None
+        _, kid, payload, signature = parts
+        secret = self._by_kid.get(kid)
+        if secret is None:
+            return None
+        try:
+            expected = self._sign(secret, f"{TOKEN_VERSION}.{kid}.{payload}")
+            if not hmac.compare_digest(expected, _b64decode(signature)):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, TypeError):
+            return None
+        if not isinstance(claims, dict) or claims.get("role") != role:
+            return None
+        if not isinstance(claims.get("exp"), int) or claims["exp"] <= time.time():
+            return None
+        return claims
+
+    # ---- revocation list (sensitive writes only) ----
+
+    async def _load_revoked(self) -> set:
+        now = datetime.utcnow().isoformat()
+        rows = await supabase.select(REVOKED_TABLE, columns="jti", filters=f"expires_at=gt.{now}")
+        return {r["jti"] for r in rows or []}
+
+    async def is_revoked(self, claims: dict) -> bool:
+        revoked = await self._revoked.get_or_load("revoked", self._load_revoked)
+        return claims.get("jti") in revoked
+
+    async def revoke(self, claims: dict):
+        """Put a token on the revocation list until it would expire anyway."""
+        await supabase.insert(REVOKED_TABLE, {
+            "jti": claims["jti"],
+            "expires_at": datetime.fromtimestamp(claims["exp"], tz=timezone.utc).isoformat(),
+        })
+        self._revoked.invalidate()
+
+
+# Singleton instance
+signed_tokens = SignedTokens(os.getenv("AUTH_TOKEN_KEYS", ""))
@@ -0,0 +1,110 @@
+"""
+Per-stage timing breakdown for generations.
+
+run_generation records how long each pipeline stage took (and each
+post-processed image) and stores the result in
+pendant_generations.stage_timings (migrations/017_add_generation_stage_timings.sql):
+
+    {
+        "total_ms": 41230,
+        "stages": {"prepare": 85, "fal_submit": 310, "fal_queue": 2100, "fal_inference": 30500, ...},
+        "images": [{"index": 0, "bg_removal": 3400, "download": 220, "resize": 180, "upload": 410, "total": 4210}, ...]
+    }
+
+Usage:
+    timer = StageTimer()
+    with timer.stage("prepare"):
+        ...
+    timer.add("fal_queue", ms)
+    gen_data["stage_timings"] = timer.to_dict()
+
+    aggregate_stage_timings(rows)  # -> {model: {stage: {count, p50, p95, p99}}}
+"""
+
+import math
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+
+def ms_since(started: float) -> int:
+    """Milliseconds elapsed since a time.perf_counter() value."""
+    return int((time.perf_counter() - started) * 1000)
+
+
+class StageTimer:
+    """Collects stage and per-image durations (ms) for one generation."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict = {}
+        self.images: dict = {}
+
+    def add(self, name: str, ms: int):
+        """Add `ms` to a stage (repeated stages accumulate)."""
+        self.stages[name] = self.stages.get(name, 0) + int(ms)
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, ms_since(started))
+
+    def image(self, index: int) -> dict:
+        """Timing dict for one output image; callers fill in stage -> ms."""
+        return self.images.setdefault(index, {"index": index})
+
+    def to_dict(self) -> dict:
+        return {
+            "total_ms": ms_since(self.started),
+            "stages": dict(self.stages),
+            "images": [self.images[i] for i in sorted(self.images)],
+        }
+
+
+def percentile(values: list, pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an unsorted list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _summary(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def aggregate_stage_timings(rows: Iterable[dict]) -> dict:
+    """
+    Group pendant_generations rows (model_used, stage_timings) into
+    percentiles per model and stage. Per-image stages are prefixed
+    with "image.", e.g. "image.bg_removal".
+    """
+    samples: dict = {}
+    for row in rows:
+        timings = row.get("stage_timings")
+        if not isinstance(timings, dict):
+            continue
+        model = samples.setdefault(row.get("model_used") or "unknown", {})
+        if timings.get("total_ms") is not None:
+            model.setdefault("total", []).append(timings["total_ms"])
+        for stage, ms in (timings.get("stages") or {}).items():
+            model.setdefault(stage, []).append(ms)
+        for image in timings.get("images") or []:
+            for stage, ms in image.items():
+                if stage != "index" and isinstance(ms, (int, float)):
+                    model.setdefault(f"image.{stage}", []).append(ms)
+
+    return {
+        model: {stage: _summary(values) for stage, values in sorted(stages.items())}
+        for model, stages in samples.items()
+    }
@@ -1,18 +1,128 @@
 import os
-import io
+import copy
+import time
+import asyncio
 import httpx
-from PIL import Image
+from typing import Awaitable, Optional
 from dotenv import load_dotenv
 
+import image_processing
+from image_engine import image_engine
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL", "https://vofigcbihwkmocrsfowt.supabase.co")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
 
+# Connection pool settings for the shared HTTP clients.
+# The Supabase pool serves PostgREST + Storage, the fetch pool serves
+# downloads from third-party hosts (FAL CDN etc.) so they can't starve each other.
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "true").lower() not in ("0", "false", "no")
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "10"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "10"))
+FETCH_MAX_KEEPALIVE = int(os.getenv("FETCH_MAX_KEEPALIVE", "5"))
+# Share one in-flight request between concurrent identical select() calls
+SUPABASE_SINGLE_FLIGHT = os.getenv("SUPABASE_SINGLE_FLIGHT", "true").lower() not in ("0", "false", "no")
+# Rows per request for insert_many / upsert_many
+SUPABASE_BULK_CHUNK_SIZE = int(os.getenv("SUPABASE_BULK_CHUNK_SIZE", "500"))
+# Shared deadline (seconds) for a QueryBatch of independent reads
+SUPABASE_BATCH_TIMEOUT = float(os.getenv("SUPABASE_BATCH_TIMEOUT", "10"))
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (installed via httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class BatchResult:
+    """Outcome of QueryBatch.run(): values by name plus per-query errors."""
+
+    def __init__(self, values: dict, errors: dict, elapsed_ms: int):
+        self.values = values
+        self.errors = errors
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def get(self, name: str, default=None):
+        """Value of a query, or `default` if it failed or timed out."""
+        return self.values.get(name, default)
+
+    def __getitem__(self, name: str):
+        """Value of a query; re-raises its error if it failed."""
+        if name in self.errors:
+            raise self.errors[name]
+        return self.values[name]
+
+
+class QueryBatch:
+    """
+    Runs independent queries concurrently under one deadline, so a handler
+    waits for the slowest query instead of the sum of all of them.
+    Failures (and queries still running at the deadline, as TimeoutError)
+    are collected per name instead of aborting the batch.
+
+        batch = supabase.batch(timeout=5)
+        batch.add("users", supabase.select("users", limit=10))
+        batch.add("total", supabase.count("users"))
+        result = await batch.run()
+        users = result.get("users", [])
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = SUPABASE_BATCH_TIMEOUT if timeout is None else timeout
+        self._queries: dict = {}
+
+    def add(self, name: str, query: Awaitable) -> "QueryBatch":
+        if name in self._queries:
+            raise ValueError(f"Duplicate query name in batch: {name}")
+        self._queries[name] = query
+        return self
+
+    async def run(self) -> BatchResult:
+        started = time.perf_counter()
+        tasks = {name: asyncio.ensure_future(query) for name, query in self._queries.items()}
+        self._queries = {}
+        if tasks:
+            _, pending = await asyncio.wait(tasks.values(), timeout=self.timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        values, errors = {}, {}
+        for name, task in tasks.items():
+            if task.cancelled():
+                errors[name] = asyncio.TimeoutError(f"{name}: no result within {self.timeout}s")
+            elif task.exception() is not None:
+                errors[name] = task.exception()
+            else:
+                values[name] = task.result()
+        for name, error in errors.items():
+            print(f"Query batch: {name} failed: {error!r}")
+        return BatchResult(values, errors, int((time.perf_counter() - started) * 1000))
+
+
 class SupabaseClient:
     def __init__(self):
         self.url = SUPABASE_URL
         self.key = SUPABASE_KEY
+        self._client: Optional[httpx.AsyncClient] = None
+        self._fetch_client: Optional[httpx.AsyncClient] = None
+        # select() single-flight: request URL -> (task fetching the parsed response, {"joined": bool})
+        self._inflight: dict = {}
+        self.single_flight = SUPABASE_SINGLE_FLIGHT
+        self.select_requests = 0
+        self.select_hits = 0     # calls served by joining an in-flight request
+        self.select_merges = 0   # requests that had at least one caller join
         if not self.key:
             print("WARNING: SUPABASE_SERVICE_KEY is not set!")
         self.headers = {
@@ -26,6 +136,56 @@ class SupabaseClient:
             del self.headers["Authorization"]
             del self.headers["apikey"]
 
+    # ============== CONNECTION POOL ==============
+
+    def _create_client(self, max_connections: int, max_keepalive: int, http2: bool) -> httpx.AsyncClient:
+        if http2 and not _http2_available():
+            print("WARNING: h2 package not installed, falling back to HTTP/1.1")
+            http2 = False
+        return httpx.AsyncClient(
+            timeout=60.0,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Long-lived pooled client for Supabase requests (keep-alive + HTTP/2).
+        Created by start() in the app lifespan, or lazily for scripts.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client(SUPABASE_MAX_CONNECTIONS, SUPABASE_MAX_KEEPALIVE, SUPABASE_HTTP2)
+        return self._client
+
+    @property
+    def fetch_client(self) -> httpx.AsyncClient:
+        """Pooled client for downloading images from external URLs"""
+        if self._fetch_client is None or self._fetch_client.is_closed:
+            self._fetch_client = self._create_client(FETCH_MAX_CONNECTIONS, FETCH_MAX_KEEPALIVE, http2=False)
+        return self._fetch_client
+
+    async def start(self):
+        """Open connection pools. Called once on application startup."""
+        _ = self.client
+        _ = self.fetch_client
+
+    async def close(self):
+        """Close connection pools. Called once on application shutdown."""
+        for pool in (self._client, self._fetch_client):
+            if pool is not None and not pool.is_closed:
+                await pool.aclose()
+        self._client = None
+        self._fetch_client = None
+
+    def batch(self, timeout: Optional[float] = None) -> QueryBatch:
+        """New QueryBatch for running independent reads concurrently."""
+        return QueryBatch(timeout)
+
     def _rest_url(self, table: str) -> str:
         return f"{self.url}/rest/v1/{table}"
 
@@ -36,39 +196,40 @@ class SupabaseClient:
         """
         url = f"{self.url}/rest/v1/rpc/exec_sql"
 
-        async with httpx.AsyncClient(timeout=30) as client:
-            # Try using RPC with a custom function first
-            response = await client.post(
-                url,
+        # Try using RPC with a custom function first
+        response = await self.client.post(
+            url,
+            headers=self.headers,
+            json={"query": sql},
+            timeout=30
+        )
+
+        if response.status_code == 404:
+            # Function doesn't exist, try direct SQL endpoint
+            # Some Supabase setups have this
+            sql_url = f"{self.url}/pg/query"
+            response = await self.client.post(
+                sql_url,
                 headers=self.headers,
-                json={"query": sql}
+                json={"query": sql},
+                timeout=30
             )
 
-            if response.status_code == 404:
-                # Function doesn't exist, try direct SQL endpoint
-                # Some Supabase setups have this
-                sql_url = f"{self.url}/pg/query"
-                response = await client.post(
-                    sql_url,
-                    headers=self.headers,
-                    json={"query": sql}
-                )
-
-            return {
-                "status": response.status_code,
-                "success": response.status_code in [200, 201],
-                "data": response.json() if response.status_code in [200, 201] else None,
-                "error": response.text if response.status_code not in [200, 201] else None
-            }
+        return {
+            "status": response.status_code,
+            "success": response.status_code in [200, 201],
+            "data": response.json() if response.status_code in [200, 201] else None,
+            "error": response.text if response.status_code not in [200, 201] else None
+        }
 
-    async def select(self, table: str, columns: str = "*", filters=None, order: str = None, limit: int = None, offset: int = None):
-        """
-        Select records from table with pagination support.
+    async def rpc(self, function: str, params: Optional[dict] = None):
+        """Call a Postgres function exposed by PostgREST (POST /rpc/<function>)"""
+        response = await self.client.post(f"{self.url}/rest/v1/rpc/{function}", headers=self.headers, json=params or {})
+        response.raise_for_status()
+        return response.json()
 
-        filters can be:
-        - dict: {"field": "value"} -> adds field=eq.value
-        - str: "field=eq.value&other=gt.5" -> appended directly
-        """
+    def _select_url(self, table: str, columns: str, filters, order: Optional[str], limit: Optional[int],
+                    offset: Optional[int], embed: Optional[dict]) -> str:
         url = f"{self._rest_url(table)}?select={columns}"
 
         if filters:
@@ -87,13 +248,104 @@ class SupabaseClient:
         if offset:
             url += f"&offset={offset}"
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.get(url, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
+        # Options for embedded resources, e.g. {"pendant_generations": {"order": "created_at.desc", "limit": 50}}
+        for relation, options in (embed or {}).items():
+            for key, value in options.items():
+                url += f"&{relation}.{key}={value}"
+
+        return url
+
+    async def select(self, table: str, columns: str = "*", filters=None, order: str = None, limit: int = None,
+                     offset: int = None, embed: Optional[dict] = None):
+        """
+        Select records from table with pagination support.
+
+        filters can be:
+        - dict: {"field": "value"} -> adds field=eq.value
+        - str: "field=eq.value&other=gt.5" -> appended directly
+
+        Related rows are fetched in the same request by naming them in columns
+        (PostgREST resource embedding, needs a foreign key), e.g.
+        columns="*,pendant_generations(id,output_images)" or "id,users(email,name)";
+        embed sets per-relation order/limit: {"pendant_generations": {"order": "created_at.desc"}}.
+        """
+        url = self._select_url(table, columns, filters, order, limit, offset, embed)
+
+        self.select_requests += 1
+        if not self.single_flight:
+            return await self._get_json(url)
+
+        pending = self._inflight.get(url)
+        if pending is not None:
+            # Identical query already in flight - share its result
+            task, state = pending
+            self.select_hits += 1
+            if not state["joined"]:
+                state["joined"] = True
+                self.select_merges += 1
+            # Callers may mutate the rows, so joiners get their own copy
+            return copy.deepcopy(await asyncio.shield(task))
+
+        # The fetch runs as its own task that every caller awaits through shield():
+        # cancelling the caller that started it (client disconnect, QueryBatch
+        # deadline) doesn't cancel the request the joiners are waiting on
+        task = asyncio.ensure_future(self._get_json(url))
+        state = {"joined": False}
+        self._inflight[url] = (task, state)
+        task.add_done_callback(lambda done: self._select_done(url, done))
+        data = await asyncio.shield(task)
+        # The first caller resumes before the joiners copy the result
+        return copy.deepcopy(data) if state["joined"] else data
+
+    def _select_done(self, url: str, task: asyncio.Future):
+        pending = self._inflight.get(url)
+        if pending is not None and pending[0] is task:
+            self._inflight.pop(url, None)
+        # Mark a failure as retrieved so a fetch nobody waits for anymore doesn't log a warning
+        if not task.cancelled():
+            task.exception()
+
+    async def select_with_count(self, table: str, columns: str = "*", filters=None, order: str = None,
+                                limit: int = None, offset: int = None, embed: Optional[dict] = None,
+                                count: str = "exact") -> tuple:
+        """
+        select() plus the total row count from the same request (Content-Range).
+        count: "exact", "planned" or "estimated" - see count(). Returns (rows, total).
+        """
+        url = self._select_url(table, columns, filters, order, limit, offset, embed)
+        headers = {**self.headers, "Prefer": f"count={count}"}
+
+        response = await self.client.get(url, headers=headers)
+        total = response.headers.get("Content-Range", "*/*").split("/")[-1]
+        total = int(total) if total.isdigit() else None
+        if response.status_code == 416:
+            # Offset past the last row: PostgREST answers 416 (PGRST103) instead of an empty page
+            return [], total
+        response.raise_for_status()
+        return response.json(), total
+
+    async def _get_json(self, url: str):
+        response = await self.client.get(url, headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def select_stats(self) -> dict:
+        """Single-flight counters for select()"""
+        return {
+            "enabled": self.single_flight,
+            "requests": self.select_requests,
+            "hits": self.select_hits,
+            "merges": self.select_merges,
+            "in_flight": len(self._inflight),
+            "hit_rate": round(self.select_hits / self.select_requests, 3) if self.select_requests else 0.0,
+        }
 
-    async def count(self, table: str, filters=None) -> int:
-        """Count records in table"""
+    async def count(self, table: str, filters=None, mode: str = "exact") -> int:
+        """
+        Count records in table.
+        mode: "exact" (full scan), "planned" (planner row estimate, instant),
+        "estimated" (exact below PostgREST's db-max-rows, planned above).
+        """
         url = f"{self._rest_url(table)}?select=count"
 
         if filters:
@@ -103,64 +355,118 @@ class SupabaseClient:
             elif isinstance(filters, str) and filters:
                 url += f"&{filters}"
 
-        headers = {**self.headers, "Prefer": "count=exact"}
+        headers = {**self.headers, "Prefer": f"count={mode}"}
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.head(url, headers=headers)
-            response.raise_for_status()
-            # PostgREST returns count in Content-Range header
-            content_range = response.headers.get("Content-Range", "*/0")
-            total = content_range.split("/")[-1]
-            return int(total) if total != "*" else 0
+        response = await self.client.head(url, headers=headers, timeout=30.0)
+        response.raise_for_status()
+        # PostgREST returns count in Content-Range header
+        content_range = response.headers.get("Content-Range", "*/0")
+        total = content_range.split("/")[-1]
+        return int(total) if total != "*" else 0
 
     async def select_by_field(self, table: str, field: str, value: str, columns: str = "*"):
         """Select record by arbitrary field"""
         url = f"{self._rest_url(table)}?{field}=eq.{value}&select={columns}"
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.get(url, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
-            return data[0] if data else None
+        response = await self.client.get(url, headers=self.headers)
+        response.raise_for_status()
+        data = response.json()
+        return data[0] if data else None
 
     async def select_one(self, table: str, id: str, columns: str = "*"):
         """Select single record by id"""
         url = f"{self._rest_url(table)}?id=eq.{id}&select={columns}"
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.get(url, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
-            return data[0] if data else None
+        response = await self.client.get(url, headers=self.headers)
+        response.raise_for_status()
+        data = response.json()
+        return data[0] if data else None
 
     async def insert(self, table: str, data: dict):
         """Insert record into table"""
         url = self._rest_url(table)
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(url, headers=self.headers, json=data)
+        response = await self.client.post(url, headers=self.headers, json=data)
+        response.raise_for_status()
+        result = response.json()
+        return result[0] if result else None
+
+    def _write_headers(self, returning: bool, resolution: Optional[str] = None) -> dict:
+        prefer = "return=representation" if returning else "return=minimal"
+        if resolution:
+            prefer += f",resolution={resolution}"
+        return {**self.headers, "Prefer": prefer}
+
+    async def _post_rows(self, table: str, rows: list, returning: bool, resolution: Optional[str] = None,
+                         on_conflict: Optional[str] = None, chunk_size: Optional[int] = None) -> Optional[list]:
+        """POST rows in chunks (sequentially, so order is kept); rows of one call must share the same keys."""
+        url = self._rest_url(table)
+        if on_conflict:
+            url += f"?on_conflict={on_conflict}"
+        headers = self._write_headers(returning, resolution)
+        chunk_size = chunk_size or SUPABASE_BULK_CHUNK_SIZE
+
+        written = []
+        for start in range(0, len(rows), chunk_size):
+            response = await self.client.post(url, headers=headers, json=rows[start:start + chunk_size])
             response.raise_for_status()
-            result = response.json()
-            return result[0] if result else None
+            if returning:
+                written.extend(response.json())
+        return written if returning else None
+
+    async def insert_many(self, table: str, rows: list, returning: bool = False,
+                          chunk_size: Optional[int] = None) -> Optional[list]:
+        """
+        Insert many rows with one request per chunk of SUPABASE_BULK_CHUNK_SIZE.
+        With returning=False (Prefer: return=minimal) nothing is sent back and None is returned.
+        """
+        if not rows:
+            return [] if returning else None
+        return await self._post_rows(table, rows, returning, chunk_size=chunk_size)
+
+    async def upsert(self, table: str, data: dict, on_conflict: Optional[str] = None):
+        """Insert or update (merge) one record by primary key or `on_conflict` columns; returns it"""
+        result = await self._post_rows(table, [data], True, "merge-duplicates", on_conflict)
+        return result[0] if result else None
+
+    async def upsert_many(self, table: str, rows: list, on_conflict: Optional[str] = None, returning: bool = False,
+                          ignore_duplicates: bool = False, chunk_size: Optional[int] = None) -> Optional[list]:
+        """
+        Insert or update many rows in chunks. Conflicts on the primary key (or the
+        unique `on_conflict` columns, e.g. "key") merge into the existing row, or are
+        skipped with ignore_duplicates=True.
+        """
+        if not rows:
+            return [] if returning else None
+        resolution = "ignore-duplicates" if ignore_duplicates else "merge-duplicates"
+        return await self._post_rows(table, rows, returning, resolution, on_conflict, chunk_size)
 
     async def update(self, table: str, id: str, data: dict):
         """Update record by id"""
         url = f"{self._rest_url(table)}?id=eq.{id}"
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.patch(url, headers=self.headers, json=data)
-            response.raise_for_status()
-            result = response.json()
-            return result[0] if result else None
+        response = await self.client.patch(url, headers=self.headers, json=data)
+        response.raise_for_status()
+        result = response.json()
+        return result[0] if result else None
 
     async def delete(self, table: str, id: str):
         """Delete record by id"""
         url = f"{self._rest_url(table)}?id=eq.{id}"
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.delete(url, headers=self.headers)
-            response.raise_for_status()
-            return True
+        response = await self.client.delete(url, headers=self.headers)
+        response.raise_for_status()
+        return True
+
+    async def delete_where(self, table: str, filters: str):
+        """Delete records matching a PostgREST filter string (e.g. "user_id=eq.x")"""
+        if not filters:
+            raise ValueError("delete_where requires a filter")
+        url = f"{self._rest_url(table)}?{filters}"
+
+        response = await self.client.delete(url, headers=self.headers)
+        response.raise_for_status()
+        return True
 
     # ============== STORAGE METHODS ==============
 
@@ -181,26 +487,52 @@ class SupabaseClient:
         if upsert:
             headers["x-upsert"] = "true"
 
-        async with httpx.AsyncClient(timeout=60) as client:
-            response = await client.post(url, headers=headers, content=file_data)
-
-            # Log detailed error info for debugging
-            if response.status_code >= 400:
-                print(f"Storage upload error: {response.status_code} - {response.text}")
-                print(f"  URL: {url}")
-                print(f"  Bucket: {bucket}, Path: {path}")
-
-            if response.status_code == 400 and "already exists" in response.text.lower():
-                # File exists and upsert didn't work, try to delete and re-upload
-                print(f"File exists, attempting to delete and re-upload: {path}")
-                try:
-                    delete_url = f"{self.url}/storage/v1/object/{bucket}/{path}"
-                    await client.delete(delete_url, headers={"apikey": self.key, "Authorization": f"Bearer {self.key}"})
-                    response = await client.post(url, headers=headers, content=file_data)
-                except Exception as e:
-                    print(f"Error during delete-reupload: {e}")
-            response.raise_for_status()
-            return response.json()
+        client = self.client
+        response = await client.post(url, headers=headers, content=file_data)
+
+        # Log detailed error info for debugging
+        if response.status_code >= 400:
+            print(f"Storage upload error: {response.status_code} - {response.text}")
+            print(f"  URL: {url}")
+            print(f"  Bucket: {bucket}, Path: {path}")
+
+        if response.status_code == 400 and "already exists" in response.text.lower():
+            # File exists and upsert didn't work, try to delete and re-upload
+            print(f"File exists, attempting to delete and re-upload: {path}")
+            try:
+                delete_url = f"{self.url}/storage/v1/object/{bucket}/{path}"
+                await client.delete(delete_url, headers={"apikey": self.key, "Authorization": f"Bearer {self.key}"})
+                response = await client.post(url, headers=headers, content=file_data)
+            except Exception as e:
+                print(f"Error during delete-reupload: {e}")
+        response.raise_for_status()
+        return response.json()
+
+    async def upload_stream(self, bucket: str, path: str, fileobj, size: int, content_type: str,
+                            chunk_size: int = 256 * 1024, upsert: bool = True):
+        """Upload from a file object in chunks (no full copy in memory)."""
+        url = f"{self._storage_url(bucket)}/{path}"
+        headers = {
+            "apikey": self.key,
+            "Authorization": f"Bearer {self.key}",
+            "Content-Type": content_type,
+            "Content-Length": str(size),
+        }
+        if upsert:
+            headers["x-upsert"] = "true"
+
+        async def body():
+            while True:
+                chunk = fileobj.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+        response = await self.client.post(url, headers=headers, content=body())
+        if response.status_code >= 400:
+            print(f"Storage upload error: {response.status_code} - {response.text}")
+        response.raise_for_status()
+        return response.json()
 
     async def get_public_url(self, bucket: str, path: str) -> str:
         """Get public URL for a file in storage"""
@@ -208,65 +540,22 @@ class SupabaseClient:
 
     async def upload_from_url(self, bucket: str, path: str, source_url: str) -> str:
         """Download image from URL and upload to storage, return public URL"""
-        async with httpx.AsyncClient(timeout=60) as client:
-            # Download image
-            response = await client.get(source_url)
-            response.raise_for_status()
+        # Download image
+        response = await self.fetch_client.get(source_url)
+        response.raise_for_status()
 
-            # Determine content type
-            content_type = response.headers.get("content-type", "image/png")
+        # Determine content type
+        content_type = response.headers.get("content-type", "image/png")
 
-            # Upload to storage
-            await self.upload_file(bucket, path, response.content, content_type)
+        # Upload to storage
+        await self.upload_file(bucket, path, response.content, content_type)
 
-            # Return public URL
-            return await self.get_public_url(bucket, path)
+        # Return public URL
+        return await self.get_public_url(bucket, path)
 
     def resize_image(self, image_data: bytes, max_size: int = 800, format: str = "WEBP", quality: int = 85) -> tuple[bytes, str]:
-        """
-        Resize image to max_size and convert to specified format.
-        Returns tuple of (resized_bytes, content_type)
-        Preserves transparency for WEBP and PNG formats.
-        """
-        img = Image.open(io.BytesIO(image_data))
-
-        # Preserve RGBA mode for transparency support
-        if img.mode == 'P':
-            img = img.convert('RGBA')
-        elif img.mode not in ('RGBA', 'RGB'):
-            img = img.convert('RGBA')
-
-        # Calculate new size maintaining aspect ratio
-        width, height = img.size
-        if max(width, height) > max_size:
-            if width > height:
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # Save to buffer in specified format
-        buffer = io.BytesIO()
-        if format.upper() == "WEBP":
-            # WebP supports transparency natively
-            img.save(buffer, format="WEBP", quality=quality, lossless=False)
-            content_type = "image/webp"
-        elif format.upper() == "JPEG":
-            # JPEG doesn't support transparency, convert to RGB with white background
-            if img.mode == 'RGBA':
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3])
-                img = background
-            img.save(buffer, format="JPEG", quality=quality)
-            content_type = "image/jpeg"
-        else:
-            # PNG preserves transparency
-            img.save(buffer, format="PNG")
-            content_type = "image/png"
-
-        return buffer.getvalue(), content_type
+        """Sync resize (see image_processing.resize_image); async code should use image_engine."""
+        return image_processing.resize_image(image_data, max_size=max_size, format=format, quality=quality)
 
     async def upload_from_url_resized(
         self,
@@ -278,30 +567,93 @@ class SupabaseClient:
         quality: int = 85
     ) -> str:
         """Download image from URL, resize it, and upload to storage. Return public URL."""
-        async with httpx.AsyncClient(timeout=60) as client:
-            # Download image
-            response = await client.get(source_url)
-            response.raise_for_status()
+        # Download image
+        response = await self.fetch_client.get(source_url)
+        response.raise_for_status()
+
+        # Resize and convert
+        resized_data, content_type = await image_engine.resize_image(
+            response.content,
+            max_size=max_size,
+            format=format,
+            quality=quality
+        )
 
-            # Resize and convert
-            resized_data, content_type = self.resize_image(
-                response.content,
-                max_size=max_size,
-                format=format,
-                quality=quality
-            )
+        # Update path extension
+        if format.upper() == "WEBP":
+            path = path.rsplit('.', 1)[0] + '.webp'
+        elif format.upper() == "JPEG":
+            path = path.rsplit('.', 1)[0] + '.jpg'
+
+        # Upload to storage
+        await self.upload_file(bucket, path, resized_data, content_type)
+
+        # Return public URL
+        return await self.get_public_url(bucket, path)
+
+    async def upload_variants(
+        self,
+        bucket: str,
+        base_path: str,
+        variants: list,
+        source_url: Optional[str] = None,
+        image_data: Optional[bytes] = None,
+        timings: Optional[dict] = None
+    ) -> dict:
+        """
+        Decode the image once, render every variant (see image_processing.render_variants)
+        and upload them concurrently. Variant files are named
+        {base_path without extension}{variant "suffix"}{format extension}.
+
+        Returns a manifest:
+            {"source_bytes": n, "placeholder": "data:..." | None,
+             "variants": {name: {"url", "bytes", "width", "height", "content_type"}},
+             "skipped": {name: reason}}
+        If `timings` is given, download/resize/upload durations (ms) are added to it.
+        """
+        timings = timings if timings is not None else {}
+
+        def add_timing(stage: str, started: float):
+            timings[stage] = timings.get(stage, 0) + int((time.perf_counter() - started) * 1000)
+
+        if image_data is None:
+            started = time.perf_counter()
+            response = await self.fetch_client.get(source_url)
+            response.raise_for_status()
+            image_data = response.content
+            add_timing("download", started)
 
-            # Update path extension
-            if format.upper() == "WEBP":
-                path = path.rsplit('.', 1)[0] + '.webp'
-            elif format.upper() == "JPEG":
-                path = path.rsplit('.', 1)[0] + '.jpg'
+        started = time.perf_counter()
+        rendered = await image_engine.render_variants(image_data, variants)
+        add_timing("resize", started)
 
-            # Upload to storage
-            await self.upload_file(bucket, path, resized_data, content_type)
+        base_name = base_path.rsplit('.', 1)[0]
+        suffixes = {v["name"]: v.get("suffix", "") for v in variants}
+        manifest = {"source_bytes": len(image_data), "placeholder": None, "variants": {}, "skipped": {}}
+        uploads = []
+        for item in rendered:
+            if "skipped" in item:
+                manifest["skipped"][item["name"]] = item["skipped"]
+            elif "data_uri" in item:
+                manifest["placeholder"] = item["data_uri"]
+            else:
+                uploads.append(item)
+
+        async def upload(item: dict):
+            path = f"{base_name}{suffixes[item['name']]}{item['ext']}"
+            await self.upload_file(bucket, path, item["data"], item["content_type"])
+            manifest["variants"][item["name"]] = {
+                "url": await self.get_public_url(bucket, path),
+                "bytes": item["bytes"],
+                "width": item["width"],
+                "height": item["height"],
+                "content_type": item["content_type"],
+            }
 
-            # Return public URL
-            return await self.get_public_url(bucket, path)
+        started = time.perf_counter()
+        await asyncio.gather(*(upload(item) for item in uploads))
+        add_timing("upload", started)
+        return manifest
 
     async def upload_with_thumbnail(
         self,
@@ -311,118 +663,38 @@ class SupabaseClient:
         full_size: int = 1024,
         thumb_size: int = 400,
         format: str = "WEBP",
-        quality: int = 85
+        quality: int = 85,
+        timings: Optional[dict] = None,
+        manifest: Optional[dict] = None,
+        extra_variants: Optional[list] = None
     ) -> tuple[str, str]:
         """
         Upload image with both full size and thumbnail versions.
         Returns tuple of (full_url, thumbnail_url)
+        The full upload_variants manifest is copied into `manifest` if given;
+        `extra_variants` (e.g. AVIF, LQIP) are rendered in the same pass.
         """
-        async with httpx.AsyncClient(timeout=60) as client:
-            # Download original image
-            response = await client.get(source_url)
-            response.raise_for_status()
-            original_data = response.content
-
-        # Determine file extension
-        ext = '.webp' if format.upper() == "WEBP" else '.jpg' if format.upper() == "JPEG" else '.png'
-        base_name = base_path.rsplit('.', 1)[0]
-
-        # Create full size version
-        full_data, content_type = self.resize_image(
-            original_data,
-            max_size=full_size,
-            format=format,
-            quality=quality
-        )
-        full_path = f"{base_name}{ext}"
-        await self.upload_file(bucket, full_path, full_data, content_type)
-        full_url = await self.get_public_url(bucket, full_path)
-
-        # Create thumbnail version
-        thumb_data, content_type = self.resize_image(
-            original_data,
-            max_size=thumb_size,
-            format=format,
-            quality=quality
-        )
-        thumb_path = f"{base_name}_thumb{ext}"
-        await self.upload_file(bucket, thumb_path, thumb_data, content_type)
-        thumb_url = await self.get_public_url(bucket, thumb_path)
-
-        return full_url, thumb_url
-
-    def remove_background(self, image_data: bytes, tolerance: int = 30) -> bytes:
-        """
-        Remove background from image (white/light gray background).
-        Returns PNG with transparent background.
-        """
-        img = Image.open(io.BytesIO(image_data)).convert("RGBA")
-        pixels = img.load()
-        width, height = img.size
-
-        # Find background color (sample corners)
-        corner_samples = [
-            pixels[0, 0],
-            pixels[width-1, 0],
-            pixels[0, height-1],
-            pixels[width-1, height-1]
-        ]
-        # Average the corner colors (assuming they're background)
-        bg_r = sum(c[0] for c in corner_samples) // 4
-        bg_g = sum(c[1] for c in corner_samples) // 4
-        bg_b = sum(c[2] for c in corner_samples) // 4
-
-        # Make similar colors transparent
-        for y in range(height):
-            for x in range(width):
-                r, g, b, a = pixels[x, y]
-                # Check if pixel is similar to background
-                if (abs(r - bg_r) < tolerance and
-                    abs(g - bg_g) < tolerance and
-                    abs(b - bg_b) < tolerance):
-                    pixels[x, y] = (r, g, b, 0)  # Make transparent
-
-        # Save as PNG
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        return buffer.getvalue()
+        variants = [
+            {"name": "full", "max_size": full_size, "format": format, "quality": quality},
+            {"name": "thumb", "max_size": thumb_size, "format": format, "quality": quality, "suffix": "_thumb"},
+        ] + list(extra_variants or [])
+        result = await self.upload_variants(bucket, base_path, variants, source_url=source_url, timings=timings)
+        if manifest is not None:
+            manifest.update(result)
+        return result["variants"]["full"]["url"], result["variants"]["thumb"]["url"]
+
+    def remove_background(self, image_data: bytes, tolerance: int = 30, feather: int = 0, flood_fill: bool = False) -> bytes:
+        """Sync background removal (see image_processing.remove_background)."""
+        return image_processing.remove_background(image_data, tolerance, feather=feather, flood_fill=flood_fill)
 
     def crop_to_content(self, image_data: bytes, padding: int = 5) -> bytes:
-        """
-        Crop image to content (remove transparent borders).
-        Returns PNG.
-        """
-        img = Image.open(io.BytesIO(image_data)).convert("RGBA")
-
-        # Get bounding box of non-transparent pixels
-        bbox = img.getbbox()
-        if bbox:
-            # Add padding
-            left = max(0, bbox[0] - padding)
-            top = max(0, bbox[1] - padding)
-            right = min(img.width, bbox[2] + padding)
-            bottom = min(img.height, bbox[3] + padding)
-            img = img.crop((left, top, right, bottom))
-
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        return buffer.getvalue()
-
-    def process_gem_image(self, image_data: bytes, max_size: int = 400, tolerance: int = 30) -> bytes:
-        """
-        Process gem image: remove background, crop to content, resize.
-        Returns PNG with transparent background.
-        """
-        # Remove background
-        no_bg = self.remove_background(image_data, tolerance)
-
-        # Crop to content
-        cropped = self.crop_to_content(no_bg)
-
-        # Resize
-        resized, _ = self.resize_image(cropped, max_size=max_size, format="PNG")
+        """Sync crop to non-transparent content (see image_processing.crop_to_content)."""
+        return image_processing.crop_to_content(image_data, padding=padding)
 
-        return resized
+    def process_gem_image(self, image_data: bytes, max_size: int = 400, tolerance: int = 30,
+                          feather: int = 0, flood_fill: bool = False) -> bytes:
+        """Sync gem pipeline (see image_processing.process_gem_image)."""
+        return image_processing.process_gem_image(image_data, max_size, tolerance, feather=feather, flood_fill=flood_fill)
 
     async def upload_gem_image(
         self,
@@ -431,16 +703,18 @@ class SupabaseClient:
         image_data: bytes,
         remove_bg: bool = True,
         max_size: int = 400,
-        bg_tolerance: int = 30
+        bg_tolerance: int = 30,
+        bg_feather: int = 0,
+        bg_flood_fill: bool = False
     ) -> str:
         """
         Upload gem image with optional background removal.
         Returns public URL.
         """
         if remove_bg:
-            processed = self.process_gem_image(image_data, max_size, bg_tolerance)
+            processed = await image_engine.process_gem_image(image_data, max_size, bg_tolerance, bg_feather, bg_flood_fill)
         else:
-            processed, _ = self.resize_image(image_data, max_size=max_size, format="PNG")
+            processed, _ = await image_engine.resize_image(image_data, max_size=max_size, format="PNG")
 
         # Ensure path ends with .png
         if not path.lower().endswith('.png'):
@@ -0,0 +1,75 @@
+"""
+select() single-flight: identical concurrent selects share one request.
+
+Run from backend/: python -m pytest -q tests
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supabase_client import SupabaseClient  # noqa: E402
+
+
+def _client(delay: float = 0.05):
+    client = SupabaseClient()
+    client.single_flight = True
+    client.fetches = 0
+
+    async def fake_get_json(url):
+        client.fetches += 1
+        await asyncio.sleep(delay)
+        return [{"id": 1, "url": url}]
+
+    client._get_json = fake_get_json
+    return client
+
+
+def test_joiners_share_one_request():
+    async def scenario():
+        client = _client()
+        results = await asyncio.gather(*[client.select("users") for _ in range(3)])
+        return client, results
+
+    client, results = asyncio.run(scenario())
+    assert client.fetches == 1
+    assert all(rows == results[0] for rows in results)
+    # Every caller got its own rows
+    assert len({id(rows) for rows in results}) == 3
+    assert client._inflight == {}
+
+
+def test_cancelled_leader_does_not_fail_joiners():
+    async def scenario():
+        client = _client()
+        leader = asyncio.create_task(client.select("users"))
+        await asyncio.sleep(0)
+        joiners = [asyncio.create_task(client.select("users")) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(*joiners)
+        return client, leader, results
+
+    client, leader, results = asyncio.run(scenario())
+    assert leader.cancelled()
+    assert client.fetches == 1
+    assert results == [[{"id": 1, "url": results[0][0]["url"]}]] * 2
+    assert client._inflight == {}
+
+
+def test_failure_reaches_every_caller():
+    async def scenario():
+        client = _client()
+
+        async def failing_get_json(url):
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        client._get_json = failing_get_json
+        return await asyncio.gather(*[client.select("users") for _ in range(2)], return_exceptions=True), client
+
+    results, client = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert client._inflight == {}
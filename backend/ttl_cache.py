@@ -0,0 +1,127 @@
+"""
+In-process read-through TTL cache with version-based invalidation.
+
+Usage:
+    from ttl_cache import TTLCache
+
+    settings_cache = TTLCache(ttl=300)
+
+    settings = await settings_cache.get_or_load("settings", load_settings_from_db)
+    etag = settings_cache.etag("settings")
+
+    # After a write
+    settings_cache.invalidate()
+
+Each uvicorn worker has its own cache, so other workers may serve
+the previous value for up to `ttl` seconds after a write.
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+
+class TTLCache:
+    """Caches results of async loaders per key for `ttl` seconds (LRU-bounded)."""
+
+    def __init__(self, ttl: float, max_entries: int = 128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Bumped on every invalidation; loads started before a bump are not stored
+        self.version = 0
+        self._entries: "OrderedDict[Any, dict]" = OrderedDict()
+        self._inflight: dict = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh_entry(self, key) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["loaded_at"] > self.ttl:
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key, default=None):
+        """Return cached value without loading."""
+        entry = self._fresh_entry(key)
+        return entry["value"] if entry else default
+
+    def set(self, key, value):
+        self._entries[key] = {"value": value, "loaded_at": time.monotonic(), "etag": None}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(self, key, loader: Callable[[], Awaitable[Any]]):
+        """
+        Return cached value or call `loader()` once to fill the cache.
+        Concurrent misses for the same key share one load.
+        Loader exceptions propagate and nothing is cached.
+        """
+        entry = self._fresh_entry(key)
+        if entry is not None:
+            self.hits += 1
+            return entry["value"]
+
+        self.misses += 1
+        pending = self._inflight.get(key)
+        if pending is None:
+            # The load runs as its own task: cancelling any waiter (the first
+            # one included) never cancels the load the others are waiting on
+            pending = asyncio.ensure_future(loader())
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda task, version=self.version: self._load_done(key, version, task))
+        return await asyncio.shield(pending)
+
+    def _load_done(self, key, version: int, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            self._inflight.pop(key, None)
+        # exception() also marks a failure as retrieved when nobody is left waiting
+        if task.cancelled() or task.exception() is not None:
+            return
+        if version == self.version:
+            self.set(key, task.result())
+
+    def etag(self, key) -> Optional[str]:
+        """Strong ETag for the cached value (computed once per load)."""
+        entry = self._fresh_entry(key)
+        if entry is None:
+            return None
+        if entry["etag"] is None:
+            payload = json.dumps(entry["value"], sort_keys=True, ensure_ascii=False, default=str)
+            digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:20]
+            entry["etag"] = f'"{digest}"'
+        return entry["etag"]
+
+    def invalidate(self, key=None):
+        """Drop one key (or everything) and bump the version counter."""
+        self.version += 1
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl,
+        }
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison)."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return any(c[2:] == etag if c.startswith("W/") else c == etag for c in candidates)
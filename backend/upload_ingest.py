@@ -0,0 +1,216 @@
+"""
+Streaming multipart image ingest.
+
+POST /api/uploads reads the request body chunk by chunk instead of letting
+the framework buffer it: the file part is written to a spooled temp file
+(memory up to UPLOAD_SPOOL_MEMORY bytes, then disk) while it is hashed and
+size-checked, and its type is sniffed from the first bytes. Files are
+stored content-addressed in Storage (uploads/<sha256><ext>), so the same
+photo uploaded twice is stored once.
+
+The returned URL can be passed instead of base64 to /api/generate
+(imageUrl), /api/admin/gems (image_url) and production stage photos.
+
+Usage:
+    from upload_ingest import ingest_image_upload
+
+    upload = await ingest_image_upload(request)   # -> dict with url, sha256, size, ...
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from image_processing import avif_decodable
+from supabase_client import supabase
+from ttl_cache import TTLCache
+
+try:
+    from multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart >= 0.0.13 renamed the package
+    from python_multipart.multipart import MultipartParser, parse_options_header
+
+UPLOAD_BUCKET = os.getenv("UPLOAD_BUCKET", "generations")
+UPLOAD_PREFIX = "uploads"
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_SPOOL_MEMORY = int(os.getenv("UPLOAD_SPOOL_MEMORY", str(1024 * 1024)))
+# Multipart framing allowance on top of the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+
+# Known stored hashes -> URL, to skip the existence check on repeat uploads
+_known_uploads = TTLCache(ttl=24 * 3600, max_entries=4096)
+
+
+def sniff_image_type(head: bytes) -> Optional[tuple]:
+    """(content_type, extension) from magic bytes, or None if not a supported image."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg", ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png", ".png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis") and avif_decodable():
+        return "image/avif", ".avif"
+    return None
+
+
+def _unsupported_format(head: bytes) -> Optional[str]:
+    """Name of a recognised image format that normalization can't decode (no HEIF codec, AVIF only with the plugin, no GIF handling)."""
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"avif", b"avis"):
+            return "AVIF"
+        if brand in (b"heic", b"heix", b"mif1", b"msf1"):
+            return "HEIC"
+    return None
+
+
+def _reject_unsupported(head: bytes):
+    unsupported = _unsupported_format(head)
+    if unsupported:
+        raise HTTPException(status_code=415, detail=f"{unsupported} images are not supported, use JPEG, PNG or WebP")
+    raise HTTPException(status_code=415, detail="Unsupported image type")
+
+
+def uploaded_path(url: str) -> Optional[tuple]:
+    """(bucket, path) if `url` is a public URL of our own Storage, else None."""
+    prefix = f"{supabase.url}/storage/v1/object/public/"
+    if not url or not url.startswith(prefix):
+        return None
+    bucket, _, path = url[len(prefix):].partition("/")
+    return (bucket, path) if path else None
+
+
+async def load_uploaded_image(url: str) -> bytes:
+    """Download an image previously stored by us. Other hosts are rejected (no SSRF)."""
+    if uploaded_path(url) is None:
+        raise HTTPException(status_code=400, detail="image_url must point to an uploaded file (POST /api/uploads)")
+    response = await supabase.fetch_client.get(url)
+    if response.status_code == 404:
+        raise HTTPException(status_code=400, detail="Uploaded file not found")
+    response.raise_for_status()
+    return response.content
+
+
+class _FilePart:
+    """State of the multipart part currently being parsed."""
+
+    def __init__(self):
+        self.headers: dict = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.is_target = False
+
+
+async def ingest_image_upload(request: Request, field: str = "file") -> dict:
+    """Stream the `field` file part of a multipart request into Storage."""
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=415, detail="Expected multipart/form-data")
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File too large (max {UPLOAD_MAX_BYTES} bytes)")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY)
+    digest = hashlib.sha256()
+    state = {"size": 0, "head": b"", "found": False, "filename": None, "error": None}
+    part = _FilePart()
+
+    def on_part_begin():
+        nonlocal part
+        part = _FilePart()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        part.header_field += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        part.header_value += data[start:end]
+
+    def on_header_end():
+        part.headers[part.header_field.lower()] = part.header_value
+        part.header_field = b""
+        part.header_value = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part.headers.get(b"content-disposition", b""))
+        if disposition.get(b"name", b"").decode("utf-8", "replace") == field and not state["found"]:
+            part.is_target = True
+            state["found"] = True
+            filename = disposition.get(b"filename")
+            state["filename"] = filename.decode("utf-8", "replace") if filename else None
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if not part.is_target or state["error"]:
+            return
+        chunk = data[start:end]
+        state["size"] += len(chunk)
+        if state["size"] > UPLOAD_MAX_BYTES:
+            state["error"] = (413, f"File too large (max {UPLOAD_MAX_BYTES} bytes)")
+            return
+        if len(state["head"]) < 16:
+            state["head"] += chunk[:16 - len(state["head"])]
+        digest.update(chunk)
+        spool.write(chunk)
+
+    parser = MultipartParser(params[b"boundary"], callbacks={
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+            if state["error"]:
+                raise HTTPException(status_code=state["error"][0], detail=state["error"][1])
+            # Reject non-images as soon as the magic bytes are in
+            if len(state["head"]) >= 16 and sniff_image_type(state["head"]) is None:
+                _reject_unsupported(state["head"])
+        try:
+            parser.finalize()
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+
+        if not state["found"] or state["size"] == 0:
+            raise HTTPException(status_code=400, detail=f"Missing file field '{field}'")
+        detected = sniff_image_type(state["head"])
+        if detected is None:
+            _reject_unsupported(state["head"])
+        mime, ext = detected
+
+        sha256 = digest.hexdigest()
+        path = f"{UPLOAD_PREFIX}/{sha256}{ext}"
+        url = _known_uploads.get(sha256)
+        deduplicated = url is not None
+        if not deduplicated:
+            public_url = await supabase.get_public_url(UPLOAD_BUCKET, path)
+            existing = await supabase.fetch_client.head(public_url)
+            deduplicated = existing.status_code == 200
+            if not deduplicated:
+                spool.seek(0)
+                await supabase.upload_stream(UPLOAD_BUCKET, path, spool, state["size"], mime)
+            url = public_url
+            _known_uploads.set(sha256, url)
+
+        return {
+            "url": url,
+            "sha256": sha256,
+            "size": state["size"],
+            "contentType": mime,
+            "filename": state["filename"],
+            "deduplicated": deduplicated,
+        }
+    finally:
+        spool.close()
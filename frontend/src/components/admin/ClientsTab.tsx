@@ -55,22 +55,31 @@ export interface Client {
   is_admin?: boolean;
 }
 
+// Clients per page of GET /admin/clients
+const PAGE_SIZE = 200;
+
 export function ClientsTab() {
   const [clients, setClients] = useState<Client[]>([]);
+  const [total, setTotal] = useState<number | null>(null);
+  const [hasMore, setHasMore] = useState(false);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [search, setSearch] = useState("");
-  const [selectedClientId, setSelectedClientId] = useState<string | null>(null);
+  const [selectedClient, setSelectedClient] = useState<Client | null>(null);
+  const [openingClientId, setOpeningClientId] = useState<string | null>(null);
   const [showClientForm, setShowClientForm] = useState(false);
 
   const loadClients = async () => {
     setLoading(true);
     try {
-      const { data, error } = await api.listClients();
+      const { data, total, hasMore, error } = await api.listClients({ limit: PAGE_SIZE });
       if (error) {
         console.error("Error loading clients:", error);
         return;
       }
       setClients(data || []);
+      setTotal(total);
+      setHasMore(hasMore);
     } catch (error) {
       console.error("Error loading clients:", error);
     } finally {
@@ -78,6 +87,52 @@ export function ClientsTab() {
     }
   };
 
+  const loadMoreClients = async () => {
+    setLoadingMore(true);
+    try {
+      const { data, total, hasMore, error } = await api.listClients({
+        limit: PAGE_SIZE,
+        offset: clients.length,
+      });
+      if (error) {
+        console.error("Error loading clients:", error);
+        return;
+      }
+      setClients((prev) => [...prev, ...(data || [])]);
+      setTotal(total);
+      setHasMore(hasMore);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // List rows carry only aggregates; the card needs the client's applications and payments
+  const openClient = async (client: Client) => {
+    setOpeningClientId(client.id);
+    try {
+      const { data, error } = await api.getClient(client.id);
+      if (error || !data || data.detail) {
+        console.error("Error loading client:", error || data?.detail);
+        return;
+      }
+      setSelectedClient({
+        ...client,
+        ...data,
+        applications: data.applications || [],
+        payments: data.payments || [],
+      });
+    } finally {
+      setOpeningClientId(null);
+    }
+  };
+
+  const refreshClient = async () => {
+    await loadClients();
+    if (selectedClient) {
+      await openClient(selectedClient);
+    }
+  };
+
   useEffect(() => {
     loadClients();
   }, []);
@@ -110,14 +165,13 @@ export function ClientsTab() {
     return c.name || c.email.split("@")[0];
   };
 
-  const selectedClient = clients.find((c) => c.id === selectedClientId) || null;
-
   if (selectedClient) {
     return (
       <ClientCard
+        key={selectedClient.id}
         client={selectedClient}
-        onBack={() => setSelectedClientId(null)}
-        onRefresh={loadClients}
+        onBack={() => setSelectedClient(null)}
+        onRefresh={refreshClient}
       />
     );
   }
@@ -128,7 +182,7 @@ export function ClientsTab() {
       <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
         <div className="bg-card rounded-xl border border-border p-4">
           <p className="text-sm text-muted-foreground">Всего клиентов</p>
-          <p className="text-2xl font-bold">{clients.length}</p>
+          <p className="text-2xl font-bold">{total ?? clients.length}</p>
         </div>
         <div className="bg-card rounded-xl border border-border p-4">
           <p className="text-sm text-muted-foreground">С оплатами</p>
@@ -217,7 +271,7 @@ export function ClientsTab() {
                 <TableRow
                   key={client.id}
                   className="cursor-pointer hover:bg-muted/50"
-                  onClick={() => setSelectedClientId(client.id)}
+                  onClick={() => openClient(client)}
                 >
                   <TableCell>
                     <div>
@@ -249,7 +303,11 @@ export function ClientsTab() {
                     {formatDate(client.created_at)}
                   </TableCell>
                   <TableCell>
-                    <ChevronRight className="w-4 h-4 text-muted-foreground" />
+                    {openingClientId === client.id ? (
+                      <Loader2 className="w-4 h-4 animate-spin text-muted-foreground" />
+                    ) : (
+                      <ChevronRight className="w-4 h-4 text-muted-foreground" />
+                    )}
                   </TableCell>
                 </TableRow>
               ))}
@@ -257,6 +315,28 @@ export function ClientsTab() {
           </Table>
         </div>
       )}
+
+      {/* Pagination */}
+      {!loading && clients.length > 0 && (
+        <div className="flex items-center justify-between text-sm text-muted-foreground">
+          <span>
+            Загружено {clients.length}
+            {total !== null ? ` из ${total}` : ""}
+            {hasMore ? " (выручка и поиск — по загруженным)" : ""}
+          </span>
+          {hasMore && (
+            <Button
+              variant="outline"
+              size="sm"
+              onClick={loadMoreClients}
+              disabled={loadingMore}
+            >
+              {loadingMore && <Loader2 className="w-4 h-4 mr-2 animate-spin" />}
+              Показать ещё
+            </Button>
+          )}
+        </div>
+      )}
     </div>
   );
 }
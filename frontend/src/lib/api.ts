@@ -389,12 +389,12 @@ export const api = {
             return { data: null, error };
         }
     },
-    adminLogout: async (email: string) => {
+    adminLogout: async (email: string, token?: string) => {
         try {
             const response = await fetch(`${API_URL}/admin/logout`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ email })
+                body: JSON.stringify({ email, token })
             });
             const data = await response.json();
             return { data, error: null };
@@ -415,14 +415,23 @@ export const api = {
     },
 
     // Admin Clients API
-    listClients: async () => {
+    listClients: async (params?: { limit?: number; offset?: number }) => {
         try {
-            const response = await fetch(`${API_URL}/admin/clients`);
+            const query = new URLSearchParams();
+            if (params?.limit) query.set('limit', String(params.limit));
+            if (params?.offset) query.set('offset', String(params.offset));
+            const qs = query.toString();
+            const response = await fetch(`${API_URL}/admin/clients${qs ? `?${qs}` : ''}`);
             const data = await response.json();
-            // API returns { clients: [...], total: N }
-            return { data: data.clients || [], error: null };
+            // API returns { clients: [...], total: N, has_more: bool } - one page; use offset for the next
+            return {
+                data: data.clients || [],
+                total: data.total ?? null,
+                hasMore: Boolean(data.has_more),
+                error: null
+            };
         } catch (error) {
-            return { data: [], error };
+            return { data: [], total: null, hasMore: false, error };
         }
     },
     getClient: async (userId: string) => {